@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Staged minimization in gen3d: wall time and energy (MMFF94s) of the returned
+conformer when all conformers are minimized for max_ff_iter steps (previous
+behavior) or with minimization schedules; energies are reported as the mean
+difference from the reference (positive: higher than the reference) and as
+the fraction of molecules within 0.5 kcal/mol of it
+
+usage: python benchmarks/minimization.py [library.smi] [numconfs] [schedule ...]
+"""
+
+import sys
+import time
+
+from rdkit import Chem
+from rdkit import RDLogger
+from rdkit.Chem import rdForceFieldHelpers
+
+from scrubber.core import gen3d, parse_ff_schedule
+
+RDLogger.DisableLog("rdApp.*")
+
+SMILES = [
+    "CC(=O)Nc1ccc(O)cc1",
+    "CC(C)Cc1ccc(C(C)C(=O)O)cc1",
+    "CN1CCN(CC1)c1ccc(NC(=O)c2ccccc2)cc1",
+    "CCCCCCCCCC(=O)OCC(O)CO",
+    "COc1ccc(CCN(C)CCCC(C#N)(C(C)C)c2ccc(OC)c(OC)c2)cc1OC",
+    "CC(C)NCC(O)COc1cccc2ccccc12",
+    "O=C(O)CCCCCCCC=CCCCCCCCC",
+    "CC1CCCC(C)N1CCCC(O)(c1ccccc1)c1ccccn1",
+]
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1]) as fp:
+        SMILES = [line.split()[0] for line in fp if line.strip()]
+numconfs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+schedules = sys.argv[3:] if len(sys.argv) > 3 else ["20:10,200:1", "50:5,200:1", "50:3,200"]
+max_ff_iter = 200
+
+mols = [Chem.MolFromSmiles(smi) for smi in SMILES]
+
+
+def final_energy(mol):
+    props = rdForceFieldHelpers.MMFFGetMoleculeProperties(mol, mmffVariant="MMFF94s")
+    return rdForceFieldHelpers.MMFFGetMoleculeForceField(mol, props).CalcEnergy()
+
+
+def run(ff_schedule):
+    energies = []
+    t_start = time.perf_counter()
+    for mol in mols:
+        mol_3d = gen3d(
+            Chem.Mol(mol),
+            max_ff_iter=max_ff_iter,
+            numconfs=numconfs,
+            ff_schedule=ff_schedule,
+        )
+        energies.append(final_energy(mol_3d))
+    return time.perf_counter() - t_start, energies
+
+
+ref_time, ref_energies = run(None)
+print("%d molecules, %d conformers each" % (len(mols), numconfs))
+print("%-20s : %7.2f s" % ("all %d steps" % max_ff_iter, ref_time))
+for schedule in schedules:
+    elapsed, energies = run(parse_ff_schedule(schedule))
+    delta = [e - ref for e, ref in zip(energies, ref_energies)]
+    within = sum(1 for d in delta if d < 0.5) / len(delta)
+    print(
+        "%-20s : %7.2f s (%4.2fx), dE mean %+6.2f kcal/mol, within 0.5 kcal/mol %5.1f%%"
+        % (schedule, elapsed, ref_time / elapsed, sum(delta) / len(delta), within * 100)
+    )
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmark of the SMARTS registry: time spent matching the patterns of
+the hot paths (tautomers selection, amide fixes, ring fixes) when patterns are
+compiled at each call (previous behavior) or taken from the registry
+
+usage: python benchmarks/patterns.py [library.smi] [repeats]
+"""
+
+import sys
+import time
+
+from rdkit import Chem
+
+from scrubber.patterns import SMARTS, get_smarts, precompile
+from scrubber.protonate import Tautomerizer, default_tautomers_fn
+
+SMILES = [
+    "CC(=O)Nc1ccc(O)cc1",
+    "O=C1CCCCN1",
+    "OC1CCCCO1",
+    "CC(C)Cc1ccc(C(C)C(=O)O)cc1",
+    "Cc1nc[nH]c1",
+    "O=c1cccc[nH]1",
+    "CN1CCN(CC1)c1ccc(NC(=O)c2ccccc2)cc1",
+    "C[NH+](C)CCC(=O)[O-]",
+]
+
+HOT_PATTERNS = ["amide", "amide_ringfix", "ring6", "anomeric", "secondary_amide", "neutralize"]
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1]) as fp:
+        SMILES = [line.split()[0] for line in fp if line.strip()]
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+mols = [Chem.AddHs(Chem.MolFromSmiles(smi)) for smi in SMILES]
+_, keepmax_smarts = Tautomerizer.parse_tautomers_config_file(default_tautomers_fn)
+all_smarts = [SMARTS[name] for name in HOT_PATTERNS] + [s["smarts"] for s in keepmax_smarts]
+
+
+def compiled_each_call():
+    for mol in mols:
+        for smarts in all_smarts:
+            mol.GetSubstructMatches(Chem.MolFromSmarts(smarts))
+
+
+def from_registry():
+    for mol in mols:
+        for smarts in all_smarts:
+            mol.GetSubstructMatches(get_smarts(smarts))
+
+
+precompile(all_smarts)
+for label, func in [("compiled each call", compiled_each_call), ("registry", from_registry)]:
+    t_start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    elapsed = time.perf_counter() - t_start
+    print("%-20s : %8.1f us/mol" % (label, elapsed / (repeats * len(mols)) * 1e6))
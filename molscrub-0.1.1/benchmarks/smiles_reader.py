@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""
+Parse rate of SMILES input files: SMIMolSupplierWrapper (one line at a time)
+and ParallelSMIMolSupplier (block reading, batches parsed by a pool of
+processes) with increasing number of processes; without an input file, a
+file with the molecules below repeated is used
+
+usage: python benchmarks/smiles_reader.py [library.smi] [nr_proc ...]
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from rdkit import RDLogger
+
+from scrubber.storage import ParallelSMIMolSupplier, SMIMolSupplierWrapper
+
+RDLogger.DisableLog("rdApp.*")
+
+SMILES = [
+    "CC(=O)Nc1ccc(O)cc1 paracetamol",
+    "CC(C)Cc1ccc(C(C)C(=O)O)cc1 ibuprofen",
+    "CN1CCN(CC1)c1ccc(NC(=O)c2ccccc2)cc1 mol3",
+    "COc1ccc(CCN(C)CCCC(C#N)(C(C)C)c2ccc(OC)c(OC)c2)cc1OC verapamil",
+    "CC1CCCC(C)N1CCCC(O)(c1ccccc1)c1ccccn1 mol5",
+    "not_a_smiles broken",
+]
+
+if len(sys.argv) > 1:
+    fname = sys.argv[1]
+else:
+    fd, fname = tempfile.mkstemp(suffix=".smi")
+    with os.fdopen(fd, "w") as fp:
+        for _ in range(20000):
+            fp.write("\n".join(SMILES) + "\n")
+proc_list = [int(n) for n in sys.argv[2:]] or [2, 4, multiprocessing.cpu_count()]
+
+
+def rate(supplier):
+    t_start = time.perf_counter()
+    count = sum(1 for _ in supplier)
+    return count, count / (time.perf_counter() - t_start)
+
+
+count, serial_rate = rate(SMIMolSupplierWrapper(fname))
+print("%d lines" % count)
+print("%-24s : %9.0f mol/s" % ("SMIMolSupplierWrapper", serial_rate))
+for nr_proc in proc_list:
+    _, parallel_rate = rate(ParallelSMIMolSupplier(fname, nr_proc=nr_proc))
+    print(
+        "%-24s : %9.0f mol/s (%4.1fx)"
+        % ("parallel, %d processes" % nr_proc, parallel_rate, parallel_rate / serial_rate)
+    )
+
+if len(sys.argv) == 1:
+    os.remove(fname)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+"""
+Cold-start latency of scrub.py: each command is run in a new interpreter and
+the median wall time is reported; use `python -X importtime` on the same
+commands to find which imports are responsible
+
+usage: python benchmarks/startup.py [repeats]
+"""
+
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+scripts_dir = pathlib.Path(__file__).resolve().parents[1] / "scripts"
+scrub_py = str(scripts_dir / "scrub.py")
+repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+out_fname = os.path.join(tempfile.mkdtemp(), "out.sdf")
+commands = [
+    ("import scrubber", [sys.executable, "-c", "import scrubber"]),
+    ("import scrubber.Scrub", [sys.executable, "-c", "from scrubber import Scrub"]),
+    ("scrub.py --help", [sys.executable, scrub_py, "--help"]),
+    ("scrub.py 1 molecule", [sys.executable, scrub_py, "c1ccccc1O", "-o", out_fname, "--cpu", "1"]),
+]
+
+for label, cmd in commands:
+    times = []
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - t_start)
+    print("%-24s : %6.3f s (min %6.3f s)" % (label, statistics.median(times), min(times)))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import pathlib
+import sys
+
+from scrubber.fileindex import build_index
+from scrubber.fileindex import MoleculeFileIndex
+
+parser = argparse.ArgumentParser(
+    description="Index the records of a SDF/SMILES file (INPUT.idx) and split it in shards "
+    "with balanced number of molecules, to be processed with 'scrub.py --shard K/N'")
+parser.add_argument("input", help="input filename (.sdf/.smi/.cxsmiles)")
+parser.add_argument("-n", "--shards", help="number of shards", type=int, default=1)
+parser.add_argument("--json", help="save the shards table in a JSON file")
+parser.add_argument("--force", help="rebuild the index even if it is up to date", action="store_true")
+args = parser.parse_args()
+
+extension = pathlib.Path(args.input).suffix
+if extension not in (".sdf", ".smi", ".cxsmiles"):
+    print("input file extension must be .sdf/.smi/.cxsmiles", file=sys.stderr)
+    sys.exit(2)
+title_line = extension == ".cxsmiles"
+
+if args.force:
+    build_index(args.input, titleLine=title_line)
+index = MoleculeFileIndex.get(args.input, titleLine=title_line)
+print("Index %s: %d molecules" % (index.index_fname, len(index)))
+shards = index.shards(args.shards)
+index.close()
+
+print("%6s %12s %12s %16s %16s" % ("shard", "start_count", "end_count", "start_offset", "end_offset"))
+for s in shards:
+    print("%6d %12d %12d %16d %16d" % (
+        s["shard"], s["start_count"], s["end_count"], s["start_offset"], s["end_offset"]))
+
+if args.json is not None:
+    with open(args.json, "w") as f:
+        json.dump({"input": args.input, "shards": shards}, f, indent=2)
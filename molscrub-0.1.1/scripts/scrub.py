@@ -1,44 +1,48 @@
 #!/usr/bin/env python
 
 import argparse
+import collections
 import io
 import json
 import multiprocessing
 from os import linesep
 import pathlib
+import signal
 import sys
 
-from scrubber import Scrub
-from scrubber import SMIMolSupplierWrapper
-
-from rdkit import Chem
-from rdkit import RDLogger
-from rdkit.Chem import rdMolInterchange
-
-Chem.SetDefaultPickleProperties(Chem.PropertyPickleOptions.MolProps |
-                                Chem.PropertyPickleOptions.PrivateProps)
-RDLogger.DisableLog("rdApp.*")
-
-try:
-    import h5py
-    _got_h5py = True
-except ImportError as e:
-    _h5py_import_error = e
-    _got_h5py = False
+# RDKit and scrubber are imported after parsing the arguments, so --help
+# doesn't wait for them; h5py is imported only to read or write .hdf5 files
 
 class SDWriter:
     """support Python's `with` statement and always write all conformers"""
 
-    def __init__(self, filename):
+    def __init__(self, filename, resume_offset=None, compression_level=None, compression_threads=1):
         self.filename = filename
+        self.resume_offset = resume_offset
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
 
     def __enter__(self):
-        self.rdkit_sdwriter = Chem.SDWriter(self.filename)
+        # the RDKit writer uses a Python file object, so the position in the
+        # output file can be checkpointed and restored
+        if split_compression(self.filename)[1] is not None:
+            self.fp = open_compressed(self.filename, "wt", level=self.compression_level,
+                                      threads=self.compression_threads)
+        else:
+            self.fp = open_for_resume(self.filename, self.resume_offset)
+        self.rdkit_sdwriter = Chem.SDWriter(self.fp)
         self.counter_mol_group = 0
         return self
 
     def __exit__(self, *args):
         self.rdkit_sdwriter.close()
+        self.fp.close()
+
+    def tell(self):
+        """flush pending data and return the position in the output file"""
+        self.rdkit_sdwriter.flush()
+        self.fp.flush()
+        return self.fp.tell()
 
     def write_mols(self, mol_group, add_suffix=False, add_serial_suffix=False):
 
@@ -78,49 +82,123 @@ class SDWriter:
         self.counter_mol_group += 1
 
 
-class HDF5Writer:
+class IsomerWriter:
+    """base of the writers storing each isomer with all its conformers:
+    isomers are named and passed to _write(mol, isomer_id), the writer is
+    created by _open()"""
+
+    # store the ScrubInfo property in each isomer
+    scrub_info = True
 
     def __init__(self, filename):
         self.filename = filename
 
     def __enter__(self):
-        self.h5file = h5py.File(self.filename, "w")
-        dt = h5py.string_dtype()
-        self.mols = self.h5file.create_dataset("mols", (0,), maxshape=(None,), dtype=dt, chunks=True)
-        self.group_id = self.h5file.create_dataset("group_id", (0,), maxshape=(None,), dtype="i8", chunks=True)
+        self.writer = self._open()
         self.counter_mol_group = 0
         return self
 
-    def __exit__(self, *args):
-        self.h5file.close()
+    def __exit__(self, exc_type, *args):
+        self._close(aborted=not exc_type is None)
+
+    def _close(self, aborted=False):
+        self.writer.close()
 
     def write_mols(self, mol_group, add_suffix=False, add_serial_suffix=False):
-        nr_isomers = len(isomer_list)
-        serial_suffix = 0
+        add_suffix |= add_serial_suffix
+        name = ""
+        if len(mol_group) > 0 and mol_group[0].HasProp("_Name"):
+            name = mol_group[0].GetProp("_Name")
+        nr_isomers = len(mol_group)
         for i, mol in enumerate(mol_group):
-            nr_confs = mol.GetNumConformers()
-            if add_serial_suffix:
-                if nr_isomers > 1 or nr_confs > 1:
-                    serial_suffix += 1
-                    mol.SetProp("_Name", name + "_%d" % serial_suffix)
-            elif add_suffix:
-                if mol.HasProp("_Name"):
-                    name = mol.GetProp("_Name")
-                else:
-                    name = ""
-                if len(mol_group) > 1:
-                    suffix = "_i%d" % len(mol_group)
-                else:
-                    suffix = ""
-                mol.SetProp("_Name", name + suffix)
-            index = self.mols.shape[0]
-            self.mols.resize((index + 1, ))
-            self.mols[index] = rdMolInterchange.MolToJSON(mol)
-            self.group_id.resize((index + 1, ))
-            self.group_id[index] = self.counter_mol_group
+            if self.scrub_info:
+                mol.SetProp("ScrubInfo", json.dumps({
+                    "isomerGroup": self.counter_mol_group,
+                    "isomerId": i,
+                    "nr_conformers:": mol.GetNumConformers(),
+                    "nr_isomers:": nr_isomers,
+                }))
+            if add_serial_suffix and nr_isomers > 1:
+                mol.SetProp("_Name", name + "_%d" % (i + 1))
+            elif add_suffix and nr_isomers > 1:
+                mol.SetProp("_Name", name + "_i%d" % i)
+            self._write(mol, i)
         self.counter_mol_group += 1
 
 
+class MolbinWriter(IsomerWriter):
+    """write each isomer (with all conformers and properties) as a record of
+    a .molbin file, with the command line options in the header"""
+
+    def _open(self):
+        return molbin.MolbinWriter(self.filename, header={"scrub_options": vars(args)})
+
+    def _write(self, mol, isomer_id):
+        self.writer.write(mol)
+
+
+class ArchiveWriter(IsomerWriter):
+    """write each isomer (with all conformers) as a member (file) of rotating
+    tar or zip archives, with a manifest of the members"""
+
+    def _open(self):
+        return archive.ArchiveWriter(
+            self.filename,
+            max_members=args.archive_max_members,
+            max_size=args.archive_max_size,
+        )
+
+    def _write(self, mol, isomer_id):
+        self.writer.write(mol)
+
+
+class PipeWriter(IsomerWriter):
+    """write each isomer (with all conformers and properties) to the standard
+    output as a framed stream, read by another process (e.g. scrub.py -)"""
+
+    def _open(self):
+        return PipeMolWriter(header={"scrub_options": vars(args)})
+
+    def _write(self, mol, isomer_id):
+        self.writer.write(mol)
+
+    def _close(self, aborted=False):
+        # the end of the stream tells the reader that the stream is complete
+        self.writer.close(aborted=aborted)
+
+
+class DatabaseWriter(IsomerWriter):
+    """store the isomers (with all conformers) and the errors of the input
+    molecules of a SQLite database (see scrubber.database)"""
+
+    scrub_info = False
+
+    def _open(self):
+        return DatabaseMolWriter(molecule_db)
+
+    def _write(self, mol, isomer_id):
+        self.writer.write(mol)
+
+    def write_error(self, input_mol, error):
+        self.writer.write_error(input_mol, error)
+
+    def set_status(self, input_mol, status):
+        self.writer.set_status(input_mol, status)
+
+
+class HDF5Writer(IsomerWriter):
+    """write each isomer (with all conformers and properties) as a row of a
+    columnar .hdf5 store, with the command line options in the header"""
+
+    scrub_info = False
+
+    def _open(self):
+        return HDF5MolWriter(self.filename, header={"scrub_options": vars(args)})
+
+    def _write(self, mol, isomer_id):
+        self.writer.write(mol, group_id=self.counter_mol_group, isomer_id=isomer_id)
+
+
 class MolSupplier:
     """wraps other suppliers (e.g. Chem.SDMolSupplier) to change non-integer
         molecule names to integers, and to set rdkit mol names from properties
@@ -138,6 +216,9 @@ class MolSupplier:
         self.supplier.reset()
         return self
 
+    def tell(self):
+        return self.supplier.tell()
+
     def __next__(self):
         mol = self.supplier.__next__()
         if mol is None:
@@ -184,6 +265,8 @@ def get_info_str(counter):
     c = counter
     s = ""
     s += "Input molecules supplied: %d\n" % c["supplied"]
+    if c["duplicates"]:
+        s += "duplicates skipped: %d\n" % c["duplicates"]
     s += "mols processed: %d, skipped by rdkit: %d, failed: %d\n" % (
             c["ok_mols"], c["rdkit_nope"], c["failed"])
     if c["ok_mols"] == 0:
@@ -198,10 +281,10 @@ def get_info_str(counter):
 
 parser_essential = argparse.ArgumentParser(description="Protonate molecules and add 3D coordinates", add_help=False)
 
-parser_essential.add_argument("input", help="input filename (.sdf/.mol/.smi/.cxsmiles) or SMILES string")
+parser_essential.add_argument("input", help="input filename (.sdf/.mol/.smi/.cxsmiles/.molbin/.hdf5; text formats optionally compressed: .gz/.bz2/.xz/.zst; archives of per-ligand files .sdf.tar/.sdf.zip or their .manifest.tsv; '-' for the output of another scrub.py -o -; .db/.sqlite for the pending molecules of the output database) or SMILES string")
 
 basic = parser_essential.add_argument_group("options")
-basic.add_argument("-o", "--out_fname", help="output filename (.sdf/.hdf5)", required=True)
+basic.add_argument("-o", "--out_fname", help="output filename (.sdf/.molbin/.hdf5, .sdf can be compressed: .gz/.bz2/.xz/.zst; one file per isomer in rotating archives: .sdf.tar/.sdf.tar.gz/.sdf.zip, also .mol/.smi; '-' streams to the standard output for another scrub.py, and messages are printed to the standard error; .db/.sqlite stores the input and output molecules in a database, and runs are resumed from the molecules not yet processed)", required=True)
 basic.add_argument("--write_failed_mols", help="filename for failed molecules (.sdf)")
 basic.add_argument("--name_from_prop", help="set molecule name from RDKit/SDF property")
 basic.add_argument("--ph", help="pH value for acid/base transformations", default=7.4, type=float)
@@ -225,13 +308,47 @@ acidbase.add_argument("--ph_high", help="high end of pH range (superseeds --ph)"
 geom = parser_advanced.add_argument_group("3D coordinates")
 geom.add_argument("--max_ff_iter", help="maximum number of force field optimization steps", type=int, default=200)
 geom.add_argument("--numconfs", help="Number of conformers to generate", type=int, default=1)
+geom.add_argument("--ff_schedule", help="staged minimization, comma-separated iters:keep stages; e.g. '50:5,200:1' minimizes all conformers for 50 steps, then the best 5 for 200 more steps (overrides --max_ff_iter) [default: disabled]", metavar="SCHEDULE")
+geom.add_argument("--prune_rms", help="before minimization, remove conformers with heavy atoms RMSD (Angstrom) from a lower energy one below this value [default: disabled]", type=float)
+geom.add_argument("--prune_energy_window", help="before minimization, remove conformers with energy (kcal/mol) higher than the lowest by more than this value; energies of embedded conformers are high, use large values (e.g. 100) [default: disabled]", type=float)
+geom.add_argument("--threads", help="threads used by RDKit to generate and minimize the conformers of a molecule; with 'auto', cores are split between molecules and conformers (useful with --numconfs and few molecules) [default: auto]", default="auto")
 geom.add_argument("--etkdg_rng_seed", help="seed for random number generator used in ETKDG", type=int)
 geom.add_argument("--ff", help="uff, mmff94, mmff94s, espaloma", choices=["uff", "mmff94", "mmff94s","espaloma"], default="mmff94s")
+geom.add_argument("--embed_max_attempts", help="if the 3D embedding fails, try fallbacks (new seed, random coordinates, more iterations, no torsion preferences) up to this number of attempts; 1 disables fallbacks", type=int, default=1)
+geom.add_argument("--ring_library", help="SQLite file of ring-system conformers: known ring systems are embedded from the stored coordinates, new ones are added")
 geom.add_argument("--template", help="Template molecule for 3D embedding with constraints")
 geom.add_argument("--template_smarts", help="SMARTs patter matching atoms of template and query molecules for 3D embedding")
 
 misc2 = parser_advanced.add_argument_group("more miscellaneous options")
 misc2.add_argument("--wcg", help="make sure mol names and suffixes are integers", action="store_true")
+misc2.add_argument("--parsers", help="number of processes parsing .sdf/.smi/.cxsmiles input, in addition to --cpu; useful when reading large files is the bottleneck", type=int, default=1)
+misc2.add_argument("--keep_order", help="write output molecules in the same order as the input (with multiprocessing)", action="store_true")
+
+dedupe_opts = parser_advanced.add_argument_group("duplicates")
+dedupe_opts.add_argument("--dedupe", help="skip input molecules with the same canonical SMILES of a previous one; 'exact' keeps all keys (moved to a temporary database if too many), 'bloom' uses a fixed amount of memory for very large libraries, with a small rate of false duplicates", choices=["exact", "bloom"])
+dedupe_opts.add_argument("--dedupe_aliases", help="file where duplicates are recorded as: name, name (or key, with bloom) of first occurrence, SMILES [default: OUT_FNAME.aliases.tsv]")
+dedupe_opts.add_argument("--dedupe_capacity", help="expected number of input molecules for --dedupe bloom", type=int, default=100000000)
+dedupe_opts.add_argument("--dedupe_error_rate", help="rate of false duplicates for --dedupe bloom", type=float, default=1e-5)
+
+compress_opts = parser_advanced.add_argument_group("compressed output (.sdf.gz/.bz2/.xz/.zst)")
+compress_opts.add_argument("--compression_level", help="compression level [default: codec default]", type=int)
+compress_opts.add_argument("--compression_threads", help="compression threads (.zst only)", type=int, default=1)
+
+archive_opts = parser_advanced.add_argument_group("archive output (.sdf.tar/.sdf.tar.gz/.sdf.zip)")
+archive_opts.add_argument("--archive_max_members", help="maximum number of files in each archive, before starting a new one", type=int, default=10000)
+archive_opts.add_argument("--archive_max_size", help="maximum size of each archive in MB (uncompressed), before starting a new one", type=float, default=1024)
+
+cache_opts = parser_advanced.add_argument_group("cache")
+cache_opts.add_argument("--cache", help="SQLite file to store results and reuse them for molecules already processed with the same options")
+cache_opts.add_argument("--cache_max_size", help="maximum size of the cache in MB; least recently used results are removed", type=float)
+
+shard = parser_advanced.add_argument_group("sharding (.sdf/.smi/.cxsmiles input)")
+shard.add_argument("--shard", help="process only the K-th of N shards of the input (K starts at 0, e.g. 3/64); uses the INPUT.idx index, built if missing (see index_input.py)", metavar="K/N")
+
+ckpt = parser_advanced.add_argument_group("checkpoints (.sdf/.smi/.cxsmiles input, .sdf output)")
+ckpt.add_argument("--checkpoint", help="save the progress periodically in this file (default with --resume: OUT_FNAME.checkpoint.json)")
+ckpt.add_argument("--checkpoint_interval", help="number of input molecules between checkpoints", type=int, default=1000)
+ckpt.add_argument("--resume", help="resume from the checkpoint, appending to existing output files", action="store_true")
 
 if "--help_advanced" in sys.argv:
     parser_essential.print_help()
@@ -247,6 +364,56 @@ args_essential, remaining_args = parser_essential.parse_known_args()
 args_advanced = parser_advanced.parse_args(remaining_args)
 args = argparse.Namespace(**vars(args_essential), **vars(args_advanced))
 
+from scrubber import Scrub
+from scrubber import SMIMolSupplierWrapper
+from scrubber import SDFMolSupplierWrapper
+from scrubber import ParallelSDFMolSupplier
+from scrubber import ParallelSMIMolSupplier
+from scrubber import RunCheckpoint
+from scrubber import ScrubCache
+from scrubber import RingConformerLibrary
+from scrubber.checkpoint import open_for_resume
+from scrubber.fileindex import MoleculeFileIndex
+from scrubber.dedupe import Deduplicator
+from scrubber.core import parse_ff_schedule
+from scrubber.geom.embedding import EmbedStats
+from scrubber.compression import open_compressed, split_compression
+from scrubber import molbin
+from scrubber import archive
+from scrubber.pipe import PipeMolSupplier, PipeMolWriter, claim_stdout
+from scrubber.database import MoleculeDatabase, DatabaseMolSupplier, DatabaseMolWriter
+from scrubber.database import is_database, STATUS_DUPLICATE
+from scrubber import hdf5store
+from scrubber.hdf5store import HDF5MolReader, HDF5MolWriter
+
+from rdkit import Chem
+from rdkit import RDLogger
+
+if args.out_fname == "-":
+    # the output stream is written to stdout, messages are printed to stderr
+    claim_stdout()
+
+Chem.SetDefaultPickleProperties(Chem.PropertyPickleOptions.MolProps |
+                                Chem.PropertyPickleOptions.PrivateProps)
+RDLogger.DisableLog("rdApp.*")
+
+if args.threads == "auto":
+    threads = "auto"
+else:
+    try:
+        threads = int(args.threads)
+    except ValueError:
+        print("--threads must be 'auto' or an integer", file=sys.stderr)
+        sys.exit(2)
+
+ff_schedule = None
+if args.ff_schedule is not None:
+    try:
+        ff_schedule = parse_ff_schedule(args.ff_schedule)
+    except ValueError as err:
+        print("--ff_schedule: %s" % err, file=sys.stderr)
+        sys.exit(2)
+
 if args.ph_low is None and args.ph_high is None:
     ph_low = args.ph
     ph_high = args.ph
@@ -257,22 +424,110 @@ else:
     print("--ph_low and --ph_high work together, either use both or none.")
     sys.exit()
 
+# compressed files are recognized by the extension (e.g. .sdf.gz)
+input_ext = pathlib.Path(split_compression(args.input)[0]).suffix
+input_codec = split_compression(args.input)[1]
+out_ext = pathlib.Path(split_compression(args.out_fname)[0]).suffix
+out_codec = split_compression(args.out_fname)[1]
+out_archive = archive.split_archive(args.out_fname)[1]
+if out_archive is not None:
+    # archives are compressed as a whole
+    out_codec = None
+
+# checkpoints
+checkpoint = None
+resume_state = None
+if args.checkpoint is not None or args.resume:
+    if input_ext not in (".sdf", ".smi", ".cxsmiles") or input_codec is not None:
+        print("--checkpoint and --resume require (uncompressed) .sdf/.smi/.cxsmiles input", file=sys.stderr)
+        sys.exit(2)
+    if pathlib.Path(args.out_fname).suffix != ".sdf":
+        print("--checkpoint and --resume require (uncompressed) .sdf output", file=sys.stderr)
+        sys.exit(2)
+    if args.checkpoint is None:
+        args.checkpoint = str(pathlib.Path(args.out_fname).with_suffix(".checkpoint.json"))
+    checkpoint = RunCheckpoint(args.checkpoint, interval=args.checkpoint_interval)
+    if args.resume:
+        try:
+            resume_state = checkpoint.load()
+        except FileNotFoundError:
+            print("Checkpoint %s not found, starting from the beginning." % args.checkpoint)
+    if resume_state is not None:
+        RunCheckpoint.check_file(args.input, resume_state["input"])
+        if resume_state.get("completed", False):
+            print("According to %s the run is already completed." % args.checkpoint)
+            sys.exit()
+        print("Resuming from input molecule %d (%s)" % (resume_state["counters"]["supplied"], args.checkpoint))
+
+start_offset = 0 if resume_state is None else resume_state["input"]["offset"]
+end_offset = None
+
+# shards
+if args.shard is not None:
+    try:
+        shard_idx, nr_shards = [int(x) for x in args.shard.split("/")]
+    except ValueError:
+        print("--shard must be in the K/N format (e.g. 3/64)", file=sys.stderr)
+        sys.exit(2)
+    if not 0 <= shard_idx < nr_shards:
+        print("--shard K/N requires 0 <= K < N", file=sys.stderr)
+        sys.exit(2)
+    if input_ext not in (".sdf", ".smi", ".cxsmiles") or input_codec is not None:
+        print("--shard requires (uncompressed) .sdf/.smi/.cxsmiles input", file=sys.stderr)
+        sys.exit(2)
+    index = MoleculeFileIndex.get(args.input, titleLine=input_ext == ".cxsmiles")
+    shard_info = index.shards(nr_shards)[shard_idx]
+    index.close()
+    print("Shard %d/%d: input molecules %d-%d" % (
+        shard_idx, nr_shards, shard_info["start_count"], shard_info["end_count"]))
+    end_offset = shard_info["end_offset"]
+    if resume_state is None:
+        start_offset = shard_info["start_offset"]
+
 # input
-extension = pathlib.Path(args.input).suffix
-if extension == ".sdf":
-    supplier = Chem.SDMolSupplier(args.input)
+extension = input_ext
+if args.input == "-":
+    supplier = PipeMolSupplier()
+elif archive.is_archive(args.input):
+    supplier = archive.ArchiveMolSupplier(args.input, removeHs=True)
+elif extension == ".sdf":
+    # same defaults as Chem.SDMolSupplier (e.g., removeHs=True), with byte offsets
+    if args.parsers > 1:
+        supplier = ParallelSDFMolSupplier(args.input, removeHs=True, start_offset=start_offset,
+                                          end_offset=end_offset, nr_proc=args.parsers)
+    else:
+        supplier = SDFMolSupplierWrapper(args.input, removeHs=True, start_offset=start_offset, end_offset=end_offset)
+elif extension == ".molbin":
+    supplier = molbin.MolbinReader(args.input)
+elif extension == ".hdf5":
+    if input_codec is not None:
+        print("compressed .hdf5 input is not supported")
+        sys.exit()
+    supplier = HDF5MolReader(args.input)
+elif extension == ".mol" and input_codec is not None:
+    with open_compressed(args.input, "rt") as fp:
+        supplier = [Chem.MolFromMolBlock(fp.read())]
 elif extension == ".mol":
     supplier = [Chem.MolFromMolFile(args.input)]
-elif extension == ".smi":
-    supplier = SMIMolSupplierWrapper(args.input)
-elif extension == ".cxsmiles":
-    supplier = SMIMolSupplierWrapper(args.input, is_enamine_cxsmiles=True, titleLine=True)
+elif extension in (".smi", ".cxsmiles"):
+    smi_opts = {"start_offset": start_offset, "end_offset": end_offset}
+    if extension == ".cxsmiles":
+        smi_opts.update(is_enamine_cxsmiles=True, titleLine=True)
+    if args.parsers > 1:
+        supplier = ParallelSMIMolSupplier(args.input, nr_proc=args.parsers, **smi_opts)
+    else:
+        supplier = SMIMolSupplierWrapper(args.input, **smi_opts)
+elif is_database(args.input):
+    if pathlib.Path(args.input).resolve() != pathlib.Path(args.out_fname).resolve():
+        print("a database input requires the same database as output (-o)")
+        sys.exit()
+    supplier = None # the pending input molecules, see output
 else:
     mol = Chem.MolFromSmiles(args.input)
     if mol is None:
         print("Input parsed as SMILES string, but conversion to RDKit mol failed.")
         print("The SMILES might be incorrect.")
-        print("If you want to pass a filename, its extension must be .sdf/.mol/.smi.")
+        print("If you want to pass a filename, its extension must be .sdf/.mol/.smi/.cxsmiles/.molbin/.hdf5.")
         sys.exit()
     supplier = [mol]
 
@@ -302,31 +557,108 @@ if args.template_smarts is not None:
 else:
     template_smarts = None
 
-if args.wcg or args.name_from_prop:
+renaming_supplier = None
+if supplier is not None and (args.wcg or args.name_from_prop):
     supplier = MolSupplier(
         supplier,
         name_from_prop=args.name_from_prop,
         rename_to_int=args.wcg
     )
+    if resume_state is not None:
+        supplier.counter = resume_state["renaming"]["counter"]
+        supplier.names = {int(k): v for k, v in resume_state["renaming"]["names"].items()}
+    renaming_supplier = supplier
+
+if args.dedupe is not None:
+    if args.dedupe_aliases is None:
+        args.dedupe_aliases = str(pathlib.Path(args.out_fname).with_suffix(".aliases.tsv"))
+    aliases_offset = None
+    if resume_state is not None:
+        aliases_offset = resume_state["outputs"].get("dedupe_aliases")
+    dedupe = Deduplicator(
+        args.dedupe,
+        aliases_fname=args.dedupe_aliases,
+        resume_offset=aliases_offset,
+        capacity=args.dedupe_capacity,
+        error_rate=args.dedupe_error_rate,
+    )
+    if resume_state is not None:
+        # the keys are not saved in the checkpoint: they are rebuilt from the
+        # input molecules read before it, named as in the previous run
+        first_offset = 0 if args.shard is None else shard_info["start_offset"]
+        if input_ext == ".sdf":
+            previous = SDFMolSupplierWrapper(args.input, removeHs=True, start_offset=first_offset, end_offset=start_offset)
+        else:
+            previous = SMIMolSupplierWrapper(args.input, start_offset=first_offset, end_offset=start_offset,
+                                             is_enamine_cxsmiles=input_ext == ".cxsmiles", titleLine=input_ext == ".cxsmiles")
+        if args.wcg or args.name_from_prop:
+            previous = MolSupplier(previous, name_from_prop=args.name_from_prop, rename_to_int=args.wcg)
+        print("Duplicate keys restored from the input before the checkpoint: %d" % dedupe.restore(previous))
+else:
+    dedupe = None
 
 # output
+molecule_db = None
 do_gen2d = False # if output SDF and skip_gen3d, we will need 2D conformers
-extension = pathlib.Path(args.out_fname).suffix
-if extension == ".sdf":
+extension = out_ext
+if extension == ".hdf5" and out_codec is not None:
+    print("compressed .hdf5 output is not supported (use .sdf.gz/.bz2/.xz/.zst)")
+    sys.exit()
+if args.out_fname == "-":
+    Writer = PipeWriter
+elif is_database(args.out_fname):
+    if checkpoint is not None:
+        print("Databases are resumed from the status of the input molecules, --checkpoint is not needed")
+        sys.exit()
+    molecule_db = MoleculeDatabase(args.out_fname)
+    if not is_database(args.input):
+        # files already imported are skipped
+        input_fname = args.input if pathlib.Path(args.input).is_file() else None
+        imported = molecule_db.import_molecules(supplier, input_fname)
+        print("Input molecules imported in %s: %d" % (args.out_fname, imported))
+    print("Input molecules in %s: %s" % (args.out_fname, ", ".join(
+        "%s %d" % item for item in sorted(molecule_db.counts().items()))))
+    supplier = DatabaseMolSupplier(molecule_db)
+    Writer = DatabaseWriter
+elif out_archive is not None:
+    member_ext = pathlib.Path(archive.split_archive(args.out_fname)[0]).suffix
+    if member_ext[1:] not in archive.MEMBER_FORMATS:
+        print("archive output filename must be e.g. ligands.sdf.tar (files: .sdf/.mol/.smi)")
+        sys.exit()
+    Writer = ArchiveWriter
+    if args.skip_gen3d:
+        do_gen2d = True
+elif extension == ".sdf":
     Writer = SDWriter
     if args.skip_gen3d:
         do_gen2d = True
+elif extension == ".molbin":
+    if out_codec is not None:
+        print("compressed .molbin output is not supported")
+        sys.exit()
+    Writer = MolbinWriter
 elif extension == ".hdf5":
-    if _got_h5py:
-        Writer = HDF5Writer
-    else:
-        print(_h5py_import_error, file=sys.stderr)
-        print("Could not import h5py. Install h5py to write .hdf5")
+    try:
+        hdf5store._import_h5py()
+    except ImportError as e:
+        print(e, file=sys.stderr)
         sys.exit()
+    Writer = HDF5Writer
 else:
-    print("output file extension must be .sdf/.hdf5")
+    print("output file extension must be .sdf/.molbin/.hdf5")
     sys.exit()
 
+if args.cache is not None:
+    max_size = None if args.cache_max_size is None else int(args.cache_max_size * 1024**2)
+    scrub_cache = ScrubCache(args.cache, max_size=max_size)
+else:
+    scrub_cache = None
+
+if args.ring_library is not None:
+    ring_library = RingConformerLibrary(args.ring_library)
+else:
+    ring_library = None
+
 scrub = Scrub(
     ph_low,
     ph_high,
@@ -343,6 +675,13 @@ scrub = Scrub(
     numconfs = args.numconfs,
     etkdg_rng_seed=args.etkdg_rng_seed,
     ff=args.ff,
+    cache=scrub_cache,
+    ring_library=ring_library,
+    embed_max_attempts=args.embed_max_attempts,
+    num_threads=1 if threads == "auto" else threads,
+    prune_rms=args.prune_rms,
+    prune_energy_window=args.prune_energy_window,
+    ff_schedule=ff_schedule,
 )
 
 counter = {
@@ -352,7 +691,11 @@ counter = {
     "isomers": 0,
     "conformers": 0,
     "failed": 0,
+    "duplicates": 0,
 }
+if resume_state is not None:
+    counter.update(resume_state["counters"])
+embed_stats = EmbedStats(None if resume_state is None else resume_state.get("embed_stats"))
 
 def scrub_and_catch_errors(input_mol, sdwriter_failed_mols=None):
     log = {}
@@ -377,7 +720,7 @@ def scrub_and_debug(input_mol, _=None):
     isomer_list = scrub(input_mol)
     return (isomer_list, log)
 
-def write_and_log(isomer_list, log, counter):
+def write_and_log(isomer_list, log, counter, input_mol=None):
     counter["supplied"] += 1
     if log["input_mol_none"]:
         counter["rdkit_nope"] += 1
@@ -390,6 +733,8 @@ def write_and_log(isomer_list, log, counter):
             counter["failed"] += 1
             return
         counter["isomers"] += len(isomer_list)
+        for mol in isomer_list:
+            embed_stats.add_mol(mol)
         counter["conformers"] += sum([mol.GetNumConformers() for mol in isomer_list])
         if counter["supplied"] % 100 == 0:
             print("Scrub in progress. Here's how things are going:")
@@ -397,7 +742,10 @@ def write_and_log(isomer_list, log, counter):
     else:
         counter["failed"] += 1
         if "exception" in log:
+            embed_stats.add_error(log["exception"])
             print(log["exception"], file=sys.stderr)
+        if molecule_db is not None:
+            w.write_error(input_mol, log.get("exception", "no isomers"))
 
 if args.debug and args.write_failed_mols:
     print("--write_failed_mols does not work with --debug, exiting", file=sys.stderr)
@@ -412,36 +760,153 @@ elif args.write_failed_mols is not None:
         print("--write_failed_mols does not work with multiprocessing, needs --cpu 1, exiting", file=sys.stderr)
         sys.exit(2)
     scrub_fn = scrub_and_catch_errors
-    sdwriter_failures = Chem.SDWriter(args.write_failed_mols)
+    failed_offset = None if resume_state is None else resume_state["outputs"]["write_failed_mols"]
+    fp_failures = open_for_resume(args.write_failed_mols, failed_offset)
+    sdwriter_failures = Chem.SDWriter(fp_failures)
 else:
     scrub_fn = scrub_and_catch_errors
     sdwriter_failures = None
 
+def snapshot_input_state():
+    """state that advances while reading the input (duplicates and renaming),
+    saved with the input position it belongs to"""
+    state = {"duplicates": counter["duplicates"]}
+    if dedupe is not None:
+        state["dedupe_aliases"] = dedupe.tell()
+    if isinstance(supplier, MolSupplier):
+        state["renaming_counter"] = supplier.counter
+    return state
+
+def save_checkpoint(input_offset, completed=False, input_state=None):
+    # with multiprocessing, the input is read ahead of the molecules written:
+    # input_state is the snapshot taken after the last molecule written
+    if input_state is None:
+        input_state = snapshot_input_state()
+    outputs = {"out_fname": w.tell(), "write_failed_mols": None}
+    if dedupe is not None:
+        dedupe.flush()
+        outputs["dedupe_aliases"] = input_state["dedupe_aliases"]
+    if sdwriter_failures is not None:
+        sdwriter_failures.flush()
+        fp_failures.flush()
+        outputs["write_failed_mols"] = fp_failures.tell()
+    state = {
+        "input": dict(RunCheckpoint.file_signature(args.input), offset=input_offset),
+        "outputs": outputs,
+        "counters": dict(counter, duplicates=input_state["duplicates"]),
+        "embed_stats": embed_stats.counts,
+        "mol_groups": w.counter_mol_group,
+        "completed": completed,
+    }
+    if isinstance(supplier, MolSupplier):
+        renaming_counter = input_state["renaming_counter"]
+        names = {k: v for k, v in supplier.names.items() if k <= renaming_counter}
+        state["renaming"] = {"counter": renaming_counter, "names": names}
+    checkpoint.save(state, counter["supplied"])
+
+def track_offsets(mols, supplier, offsets):
+    """record the input position and state after each molecule supplied to
+    the pool"""
+    for input_mol in mols:
+        offsets.append((supplier.tell(), snapshot_input_state()))
+        yield input_mol
+
+def skip_duplicates(mols):
+    for input_mol in mols:
+        if input_mol is not None and dedupe.is_duplicate(input_mol):
+            counter["duplicates"] += 1
+            if molecule_db is not None:
+                w.set_status(input_mol, STATUS_DUPLICATE)
+            continue
+        yield input_mol
+
+stop_requested = []
+
+def sigterm_handler(signum, frame):
+    # pre-emption (e.g. by a job scheduler): stop after the current molecule
+    stop_requested.append(signum)
+
+def stop_with_checkpoint(input_offset, input_state=None):
+    if p is not None:
+        # stops the pool
+        p.close()
+    save_checkpoint(input_offset, input_state=input_state)
+    print("Terminated, progress saved in %s (use --resume to continue)." % args.checkpoint)
+    sys.exit(1)
+
 if __name__ == '__main__':
-    with Writer(args.out_fname) as w:
+    writer_opts = {}
+    if out_codec is not None:
+        writer_opts["compression_level"] = args.compression_level
+        writer_opts["compression_threads"] = args.compression_threads
+    if resume_state is not None:
+        writer_opts["resume_offset"] = resume_state["outputs"]["out_fname"]
+    p = None
+    with Writer(args.out_fname, **writer_opts) as w:
+        if resume_state is not None:
+            w.counter_mol_group = resume_state["mol_groups"]
+        input_offset = start_offset  # position after the last molecule written
+        input_state = None
+        if dedupe is None:
+            mols = supplier
+        else:
+            mols = skip_duplicates(supplier)
         if args.cpu == 1:
-            for input_mol in supplier:
+            if checkpoint is not None:
+                signal.signal(signal.SIGTERM, sigterm_handler)
+            for input_mol in mols:
                 isomer_list, log = scrub_fn(input_mol, sdwriter_failures)
-                write_and_log(isomer_list, log, counter)
+                write_and_log(isomer_list, log, counter, input_mol)
+                if checkpoint is not None:
+                    input_offset = supplier.tell()
+                    if stop_requested:
+                        stop_with_checkpoint(input_offset)
+                    if checkpoint.is_due(counter["supplied"]):
+                        save_checkpoint(input_offset)
         else:
             if args.cpu < 1:
                 nr_proc = multiprocessing.cpu_count()
             else:
                 nr_proc = args.cpu
-            p = multiprocessing.Pool(nr_proc - 1) # leave 1 for main process
-            for (isomer_list, log) in p.imap_unordered(scrub_fn, supplier):
-                write_and_log(isomer_list, log, counter)
-
+            if checkpoint is None:
+                source = mols
+            else:
+                signal.signal(signal.SIGTERM, sigterm_handler)
+                offsets = collections.deque()
+                source = track_offsets(mols, supplier, offsets)
+            # results are needed in input order by checkpoints, to match the
+            # input position with the output written so far
+            ordered = args.keep_order or checkpoint is not None
+            p = scrub.stream(source, nr_proc=nr_proc - 1, ordered=ordered, threads=threads) # leave 1 for main process
+            for (input_mol, isomer_list, error) in p:
+                log = {"input_mol_none": input_mol is None}
+                if error is not None:
+                    if args.debug:
+                        raise error
+                    log["exception"] = error
+                write_and_log(isomer_list, log, counter, input_mol)
+                if checkpoint is not None:
+                    input_offset, input_state = offsets.popleft()
+                    if stop_requested:
+                        stop_with_checkpoint(input_offset, input_state)
+                    if checkpoint.is_due(counter["supplied"]):
+                        save_checkpoint(input_offset, input_state=input_state)
+        if checkpoint is not None:
+            save_checkpoint(input_offset, completed=True, input_state=input_state)
 
     if sdwriter_failures is not None:
         sdwriter_failures.close()
+        fp_failures.close()
+    if dedupe is not None:
+        dedupe.close()
 
     print("Scrub completed.\nSummary of what happened:")
     print(get_info_str(counter), end="")
+    print(embed_stats.summary(), end="")
 
-    if args.wcg:
+    if args.wcg and renaming_supplier is not None:
         fname = pathlib.Path(args.out_fname).with_suffix(".renaming.json")
         print("Writing %s" % (fname))
         with open(fname, "w") as f:
-            json.dump(supplier.names, f)
+            json.dump(renaming_supplier.names, f)
         print("Done.")
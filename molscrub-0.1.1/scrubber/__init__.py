@@ -1,15 +1,59 @@
-from . import transform
-from . import geom
-from . import cli
-from . import core
-from . import storage
-from . import common
-from .protonate import AcidBaseConjugator
-from .protonate import Tautomerizer
-from .ringfix import fix_rings
-from .core import Scrub
-from .core import gen3d
-from .storage import SMIMolSupplierWrapper
+import importlib
+
+# submodules and names are imported on first access, so that importing the
+# package (or a light submodule, e.g. scrubber.fileindex) doesn't load RDKit
+# and all the other dependencies
+_submodules = [
+    "transform",
+    "geom",
+    "cli",
+    "core",
+    "storage",
+    "common",
+    "checkpoint",
+    "fileindex",
+    "cache",
+    "dedupe",
+    "patterns",
+    "ringlib",
+    "compression",
+    "molbin",
+    "hdf5store",
+    "archive",
+    "pipe",
+    "database",
+]
+
+_names = {
+    "AcidBaseConjugator": "protonate",
+    "Tautomerizer": "protonate",
+    "fix_rings": "ringfix",
+    "Scrub": "core",
+    "gen3d": "core",
+    "EmbeddingTemplate": "core",
+    "embed_series": "core",
+    "SMIMolSupplierWrapper": "storage",
+    "SDFMolSupplierWrapper": "storage",
+    "ParallelSDFMolSupplier": "storage",
+    "ParallelSMIMolSupplier": "storage",
+    "ReorderBuffer": "storage",
+    "SplitWriter": "storage",
+    "ShardedQueue": "storage",
+    "RunCheckpoint": "checkpoint",
+    "ScrubCache": "cache",
+    "RingConformerLibrary": "ringlib",
+    "MolbinReader": "molbin",
+    "MolbinWriter": "molbin",
+    "HDF5MolReader": "hdf5store",
+    "HDF5MolWriter": "hdf5store",
+    "ArchiveWriter": "archive",
+    "ArchiveMolSupplier": "archive",
+    "PipeMolWriter": "pipe",
+    "PipeMolSupplier": "pipe",
+    "MoleculeDatabase": "database",
+    "DatabaseMolSupplier": "database",
+    "DatabaseMolWriter": "database",
+}
 
 __all__ = [
     "transform",
@@ -18,9 +62,54 @@ __all__ = [
     "core",
     "storage",
     "common",
+    "checkpoint",
+    "fileindex",
+    "cache",
+    "dedupe",
+    "patterns",
+    "ringlib",
+    "compression",
+    "molbin",
+    "hdf5store",
+    "archive",
+    "pipe",
+    "database",
     "AcidBaseConjugator",
     "Tautomerizer",
     "fix_rings",
     "Scrub",
     "gen3d",
+    "EmbeddingTemplate",
+    "embed_series",
+    "RunCheckpoint",
+    "ReorderBuffer",
+    "SplitWriter",
+    "ShardedQueue",
+    "ScrubCache",
+    "RingConformerLibrary",
+    "MolbinReader",
+    "MolbinWriter",
+    "HDF5MolReader",
+    "HDF5MolWriter",
+    "ArchiveWriter",
+    "ArchiveMolSupplier",
+    "PipeMolWriter",
+    "PipeMolSupplier",
+    "MoleculeDatabase",
+    "DatabaseMolSupplier",
+    "DatabaseMolWriter",
 ]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    if name in _names:
+        value = getattr(importlib.import_module("." + _names[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_names))
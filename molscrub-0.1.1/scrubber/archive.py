@@ -0,0 +1,326 @@
+import io
+import os
+import re
+import tarfile
+import time
+import zipfile
+
+from rdkit import Chem
+
+"""
+This file contains the archive output (and input) of per-ligand files, to
+write one file per molecule without creating millions of small files on
+(parallel) filesystems
+
+Molecules are written as members (e.g. ZINC000001.sdf) of rotating tar or
+zip archives (ligands_00000.tar, ligands_00001.tar, ...), and a new archive
+is started when the current one reaches the maximum number of members or
+size. A manifest (ligands.manifest.tsv) maps each ligand name to the archive
+and the member containing it:
+
+    name        archive             member
+    ZINC000001  ligands_00000.tar   ZINC000001.sdf
+
+Archives are selected with the extension of the output file name, after the
+extension of the member format: ligands.sdf.tar, ligands.sdf.tar.gz (or
+.tgz), ligands.smi.zip.
+"""
+
+ARCHIVE_EXTENSIONS = [
+    (".tar.gz", "tar.gz"),
+    (".tgz", "tar.gz"),
+    (".tar", "tar"),
+    (".zip", "zip"),
+]
+
+MANIFEST_EXT = ".manifest.tsv"
+
+MEMBER_FORMATS = ("sdf", "mol", "smi")
+
+
+def split_archive(fname: str) -> tuple:
+    """return the filename without the archive extension and the archive
+    format (None if the file is not an archive)"""
+    for ext, archive_format in ARCHIVE_EXTENSIONS:
+        if fname.lower().endswith(ext):
+            return fname[: -len(ext)], archive_format
+    return fname, None
+
+
+def is_archive(fname: str) -> bool:
+    """return True for archives and archive manifests"""
+    return split_archive(fname)[1] is not None or fname.endswith(MANIFEST_EXT)
+
+
+def render_member(mol, ftype: str) -> bytes:
+    """return the content of the member file of the molecule (all conformers
+    for sdf)"""
+    if ftype == "mol":
+        return Chem.MolToMolBlock(mol).encode()
+    buff = io.StringIO()
+    if ftype == "sdf":
+        writer = Chem.SDWriter(buff)
+        for conf in mol.GetConformers() or [None]:
+            writer.write(mol, confId=-1 if conf is None else conf.GetId())
+    else:
+        writer = Chem.SmilesWriter(buff, includeHeader=False)
+        writer.write(mol)
+    writer.close()
+    return buff.getvalue().encode()
+
+
+def parse_member(data: bytes, ftype: str, sanitize: bool = True, removeHs: bool = False) -> list:
+    """return the molecules (None if not parsed) of the member file"""
+    if ftype == "sdf":
+        supplier = Chem.ForwardSDMolSupplier(io.BytesIO(data), sanitize=sanitize, removeHs=removeHs)
+        return list(supplier)
+    if ftype == "mol":
+        return [Chem.MolFromMolBlock(data.decode(), sanitize=sanitize, removeHs=removeHs)]
+    mols = []
+    for line in data.decode().splitlines():
+        if not line.strip():
+            continue
+        fields = line.split(maxsplit=1)
+        mol = Chem.MolFromSmiles(fields[0], sanitize=sanitize)
+        if not mol is None and len(fields) > 1:
+            mol.SetProp("_Name", fields[1].strip())
+        mols.append(mol)
+    return mols
+
+
+class ArchiveWriter(object):
+    """Write each molecule as a member of rotating tar or zip archives, with
+    a manifest of the members.
+
+        >>> with ArchiveWriter("output/ligands.sdf.tar", max_members=10000) as writer:
+        ...     writer.write(mol)
+
+    A new archive is started when the current one has `max_members` members
+    or `max_size` MB of (uncompressed) data. Member names are the molecule
+    names (or `member_name`), made unique over the whole output adding _v1,
+    _v2, ...
+    """
+
+    def __init__(self, fname: str, max_members: int = 10000, max_size: float = 1024):
+        base, self.archive_format = split_archive(fname)
+        if self.archive_format is None:
+            raise ValueError(
+                "Archive file name must end with %s" % "/".join(ext for ext, _ in ARCHIVE_EXTENSIONS)
+            )
+        self.basename, ext = os.path.splitext(base)
+        self.ftype = ext[1:].lower()
+        if not self.ftype in MEMBER_FORMATS:
+            raise ValueError(
+                "Invalid member format [%s], allowed: %s" % (self.ftype, ", ".join(MEMBER_FORMATS))
+            )
+        self.fname = fname
+        self.max_members = max_members
+        self.max_size = max_size
+        self.manifest_fname = self.basename + MANIFEST_EXT
+        dirname = os.path.dirname(self.basename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._archive_ext = fname[len(base) :]
+        self._manifest = open(self.manifest_fname, "w")
+        self._manifest.write("name\tarchive\tmember\n")
+        self._names = set()
+        self._archive = None
+        self._archive_count = 0
+        self.archive_fname = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _rotate(self):
+        """close the current archive and start a new one"""
+        self._close_archive()
+        self.archive_fname = "%s_%05d%s" % (self.basename, self._archive_count, self._archive_ext)
+        self._archive_count += 1
+        if self.archive_format == "zip":
+            self._archive = zipfile.ZipFile(self.archive_fname, "w", compression=zipfile.ZIP_DEFLATED)
+        elif self.archive_format == "tar.gz":
+            self._archive = tarfile.open(self.archive_fname, "w:gz")
+        else:
+            self._archive = tarfile.open(self.archive_fname, "w")
+        self._members = 0
+        self._size = 0
+
+    def _close_archive(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+            self._manifest.flush()
+
+    def _member_name(self, name: str) -> str:
+        # members are extracted in the same directory, so names are unique
+        name = re.sub(r"\s+", "_", name).replace(os.path.sep, "=") or "MOL"
+        member = "%s.%s" % (name, self.ftype)
+        attempt = 0
+        while member in self._names:
+            attempt += 1
+            member = "%s_v%d.%s" % (name, attempt, self.ftype)
+        self._names.add(member)
+        return member
+
+    def add(self, name: str, data: bytes, member_name: str = None) -> tuple:
+        """add a member with the data of the ligand; return the archive file
+        name and the member name"""
+        if (
+            self._archive is None
+            or self._members >= self.max_members
+            or self._size >= self.max_size * 1024**2
+        ):
+            self._rotate()
+        member = self._member_name(name if member_name is None else member_name)
+        if self.archive_format == "zip":
+            self._archive.writestr(member, data)
+        else:
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._archive.addfile(info, io.BytesIO(data))
+        self._members += 1
+        self._size += len(data)
+        self._manifest.write(
+            "%s\t%s\t%s\n" % (re.sub(r"\s", " ", name), os.path.basename(self.archive_fname), member)
+        )
+        return self.archive_fname, member
+
+    def write(self, mol, name: str = None, member_name: str = None) -> tuple:
+        """add the molecule (all conformers for sdf) as a member"""
+        if name is None:
+            name = mol.GetProp("_Name") if mol.HasProp("_Name") else ""
+        return self.add(name, render_member(mol, self.ftype), member_name)
+
+    def close(self):
+        if self._manifest is None:
+            return
+        self._close_archive()
+        self._manifest.close()
+        self._manifest = None
+
+
+def read_manifest(fname: str) -> list:
+    """return the (name, archive path, member) entries of the manifest"""
+    dirname = os.path.dirname(fname)
+    entries = []
+    with open(fname) as fp:
+        fp.readline()
+        for line in fp:
+            name, archive, member = line.rstrip("\n").split("\t")
+            entries.append((name, os.path.join(dirname, archive), member))
+    return entries
+
+
+class ArchiveMolSupplier(object):
+    """Read the molecules of the members of archives written by
+    ArchiveWriter, from an archive or from the manifest (all the archives, in
+    order); the member format is guessed from the member extension.
+
+        >>> supplier = ArchiveMolSupplier("output/ligands.manifest.tsv")
+        >>> for mol in supplier:
+        ...     pass
+        >>> mols = supplier.get("ZINC000001")
+
+    Archives are read sequentially (streaming for tar archives); get() uses
+    the manifest to read a single member.
+    """
+
+    def __init__(self, fname: str, sanitize: bool = True, removeHs: bool = False):
+        self.fname = fname
+        self.sanitize = sanitize
+        self.removeHs = removeHs
+        self._index = None
+        if fname.endswith(MANIFEST_EXT):
+            self._index = {}
+            self.archives = []
+            for name, archive, member in read_manifest(fname):
+                self._index.setdefault(name, []).append((archive, member))
+                if not self.archives or self.archives[-1] != archive:
+                    self.archives.append(archive)
+        else:
+            self.archives = [fname]
+        self._archive = None
+        self.reset()
+
+    def __iter__(self):
+        return self
+
+    def reset(self):
+        self._close_fp()
+        self._archive_idx = -1
+        self._members = iter(())
+        self._pending = []
+        self._counter = 0
+
+    def tell(self) -> int:
+        """return the number of members read"""
+        return self._counter
+
+    @staticmethod
+    def _open(fname: str):
+        if split_archive(fname)[1] == "zip":
+            return zipfile.ZipFile(fname, "r")
+        return tarfile.open(fname, "r:*")
+
+    def _read_member(self, archive, member) -> bytes:
+        if isinstance(archive, zipfile.ZipFile):
+            return archive.read(member)
+        with archive.extractfile(member) as fp:
+            return fp.read()
+
+    def _parse(self, member_name: str, data: bytes) -> list:
+        ftype = os.path.splitext(member_name)[1][1:].lower()
+        return parse_member(data, ftype, sanitize=self.sanitize, removeHs=self.removeHs)
+
+    def _next_member(self):
+        """return the name and the data of the next member, or None"""
+        while True:
+            for member in self._members:
+                if isinstance(self._archive, zipfile.ZipFile):
+                    return member, self._archive.read(member)
+                if member.isfile():
+                    return member.name, self._read_member(self._archive, member)
+            self._close_fp()
+            self._archive_idx += 1
+            if self._archive_idx >= len(self.archives):
+                return None
+            self._archive = self._open(self.archives[self._archive_idx])
+            if isinstance(self._archive, zipfile.ZipFile):
+                self._members = iter(self._archive.namelist())
+            else:
+                # tar members are read while streaming
+                self._members = iter(self._archive)
+
+    def __next__(self):
+        while not self._pending:
+            item = self._next_member()
+            if item is None:
+                raise StopIteration
+            self._counter += 1
+            self._pending = self._parse(*item)
+        return self._pending.pop(0)
+
+    def get(self, name: str) -> list:
+        """return the molecules of the ligand (requires the manifest)"""
+        if self._index is None:
+            raise ValueError("Reading ligands by name requires the manifest (%s)" % MANIFEST_EXT)
+        mols = []
+        for archive_fname, member in self._index.get(name, []):
+            archive = self._open(archive_fname)
+            try:
+                mols.extend(self._parse(member, self._read_member(archive, member)))
+            finally:
+                archive.close()
+        return mols
+
+    def _close_fp(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def close(self):
+        self._close_fp()
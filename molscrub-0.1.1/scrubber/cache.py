@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+
+from rdkit import Chem
+
+from .protonate import copy_mol_props
+
+"""
+This file contains the persistent cache of scrub results, used to skip the
+processing of molecules already seen with the same options (e.g., when
+processing new releases of vendor catalogs)
+
+Results are stored in a SQLite database, keyed by the hash of the canonical
+SMILES of the input molecule and the hash of the options used to process it.
+"""
+
+# increase when the content of the cache entries changes
+CACHE_FORMAT = 1
+
+
+class ScrubCache(object):
+    """Content-addressed cache of the isomers generated by Scrub.
+
+        >>> cache = ScrubCache("scrub_cache.sqlite", max_size=2 * 1024**3)
+        >>> scrub = Scrub(ph_low=7.4, cache=cache)
+
+    The database uses write-ahead logging, so it can be shared by concurrent
+    processes (e.g., the workers of Scrub.stream()); each process opens its
+    own connection. When the database grows larger than `max_size` bytes or
+    `max_entries` entries, the least recently used entries are evicted; to
+    avoid a write for each hit, the time of use is updated only if older than
+    `touch_interval` seconds.
+
+    Properties of the input molecule are not stored: they are copied from the
+    input molecule to the cached isomers when the cache is hit. The embedding
+    statistics (see geom.embedding) are not stored either, so they are
+    counted only for the molecules actually embedded.
+    """
+
+    def __init__(
+        self,
+        fname: str,
+        max_size: int = None,
+        max_entries: int = None,
+        timeout: float = 60.0,
+        evict_interval: int = 1000,
+        touch_interval: float = 3600.0,
+    ):
+        self.fname = fname
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.evict_interval = evict_interval
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._puts = 0
+
+    def __getstate__(self):
+        # connections can't be shared by processes
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        return state
+
+    def _connect(self) -> sqlite3.Connection:
+        """return the connection of the current process"""
+        if self._pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.fname, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, data BLOB, size INTEGER, last_used REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used)")
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    @staticmethod
+    def options_hash(options: dict, data_files: list = None) -> str:
+        """return the hash of the options (JSON-serializable values) and of the
+        content of the data files used to process the molecules"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        for fname in data_files or []:
+            with open(fname, "rb") as fp:
+                digest.update(hashlib.sha256(fp.read()).digest())
+        digest.update(b"%d" % CACHE_FORMAT)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(input_mol, options_hash: str) -> str:
+        """return the key of a molecule processed with the options"""
+        smiles = Chem.MolToSmiles(input_mol)
+        return hashlib.sha256(("%s %s" % (smiles, options_hash)).encode()).hexdigest()
+
+    def get(self, input_mol, options_hash: str) -> list:
+        """return the cached isomers of the molecule, or None if the molecule
+        is not in the cache"""
+        key = self.make_key(input_mol, options_hash)
+        conn = self._connect()
+        row = conn.execute("SELECT data, last_used FROM entries WHERE key=?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        now = time.time()
+        if now - row[1] >= self.touch_interval:
+            conn.execute("UPDATE entries SET last_used=? WHERE key=?", (now, key))
+        self.hits += 1
+        mol_list = []
+        for data in pickle.loads(row[0]):
+            mol = Chem.Mol(data)
+            copy_mol_props(input_mol, mol)
+            mol_list.append(mol)
+        return mol_list
+
+    def put(self, input_mol, options_hash: str, mol_list: list):
+        """store the isomers of the molecule"""
+        key = self.make_key(input_mol, options_hash)
+        cleared_props = set(input_mol.GetPropNames())
+        cleared_props.update(["_Name", "_embed_fallback", "_embed_failures"])
+        mol_data = []
+        for mol in mol_list:
+            mol = Chem.Mol(mol)
+            for prop_name in cleared_props:
+                mol.ClearProp(prop_name)
+            mol_data.append(mol.ToBinary(Chem.PropertyPickleOptions.AllProps))
+        data = pickle.dumps(mol_data, pickle.HIGHEST_PROTOCOL)
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, data, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, data, len(data), time.time()),
+        )
+        self._puts += 1
+        if self._puts % self.evict_interval == 0:
+            self.evict()
+
+    def evict(self):
+        """remove the least recently used entries exceeding the limits"""
+        if self.max_size is None and self.max_entries is None:
+            return
+        conn = self._connect()
+        count, size = conn.execute("SELECT COUNT(*), TOTAL(size) FROM entries").fetchone()
+        excess_count, excess_size = 0, 0
+        if self.max_entries is not None:
+            excess_count = count - self.max_entries
+        if self.max_size is not None:
+            excess_size = size - self.max_size
+        if excess_count <= 0 and excess_size <= 0:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed, removed_size = 0, 0
+            cursor = conn.execute("SELECT key, size FROM entries ORDER BY last_used")
+            keys = []
+            for key, entry_size in cursor:
+                if removed >= excess_count and removed_size >= excess_size:
+                    break
+                keys.append((key,))
+                removed += 1
+                removed_size += entry_size
+            conn.executemany("DELETE FROM entries WHERE key=?", keys)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
@@ -0,0 +1,109 @@
+import json
+import os
+import time
+
+"""
+This file contains the checkpointing used to resume long runs that crashed or
+have been pre-empted
+"""
+
+
+class RunCheckpoint(object):
+    """Save and restore the progress of a run in a JSON file.
+
+    The content of the checkpoint is defined by the caller (input position,
+    output file positions, counters...); the file is written atomically, so a
+    crash while saving will leave the previous checkpoint intact.
+
+        >>> checkpoint = RunCheckpoint("run.checkpoint.json", interval=1000)
+        >>> for count, mol in enumerate(supplier, 1):
+        ...     process(mol)
+        ...     if checkpoint.is_due(count):
+        ...         checkpoint.save({"input": {"offset": supplier.tell()}})
+
+    Checkpoints are due every `interval` molecules or every `interval_sec`
+    seconds, whichever comes first.
+    """
+
+    version = 1
+
+    def __init__(self, fname: str, interval: int = 1000, interval_sec: float = 300.0):
+        self.fname = fname
+        self.interval = interval
+        self.interval_sec = interval_sec
+        self._last_count = 0
+        self._last_time = time.time()
+
+    def is_due(self, count: int) -> bool:
+        """check if a new checkpoint should be saved after processing `count`
+        molecules"""
+        if count - self._last_count >= self.interval:
+            return True
+        if self.interval_sec and (time.time() - self._last_time >= self.interval_sec):
+            return True
+        return False
+
+    def save(self, state: dict, count: int = None):
+        """write the state to the checkpoint file"""
+        state = dict(state)
+        state["version"] = self.version
+        state["time"] = time.time()
+        tmp_fname = "%s.tmp" % self.fname
+        with open(tmp_fname, "w") as fp:
+            json.dump(state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_fname, self.fname)
+        self._last_time = time.time()
+        if count is not None:
+            self._last_count = count
+
+    def load(self) -> dict:
+        """read the checkpoint file; FileNotFoundError is raised if the
+        checkpoint does not exist"""
+        with open(self.fname, "r") as fp:
+            state = json.load(fp)
+        if state.get("version") != self.version:
+            raise ValueError(
+                "Checkpoint [%s] has version %s, expected %d"
+                % (self.fname, state.get("version"), self.version)
+            )
+        return state
+
+    @staticmethod
+    def file_signature(fname: str) -> dict:
+        """return the information used to verify that a file did not change
+        between a checkpoint and the resumed run"""
+        return {
+            "fname": os.path.abspath(fname),
+            "size": os.path.getsize(fname),
+            "mtime": os.path.getmtime(fname),
+        }
+
+    @staticmethod
+    def check_file(fname: str, signature: dict):
+        """raise an error if the file does not match the signature stored in
+        the checkpoint"""
+        if os.path.getsize(fname) != signature["size"]:
+            raise ValueError(
+                "File [%s] changed since the checkpoint was saved (size: %d, expected %d)"
+                % (fname, os.path.getsize(fname), signature["size"])
+            )
+        # files rewritten in place may keep the same size
+        if "mtime" in signature and os.path.getmtime(fname) != signature["mtime"]:
+            raise ValueError(
+                "File [%s] changed since the checkpoint was saved (mtime: %f, expected %f)"
+                % (fname, os.path.getmtime(fname), signature["mtime"])
+            )
+
+
+def open_for_resume(fname: str, offset: int = None):
+    """open a text file for writing; if an offset is specified, the file is
+    truncated at that position and the writing continues from there, so
+    anything written after the last checkpoint is discarded"""
+    if offset is None:
+        return open(fname, "w")
+    fp = open(fname, "r+")
+    fp.seek(offset)
+    fp.truncate()
+    return fp
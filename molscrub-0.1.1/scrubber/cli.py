@@ -91,8 +91,11 @@ cli_options = {
         "description": "options for input definition and parsing.",
         "values": {
             "--in_fname": {
-                "help": """ [ REQUIRED ] input file to process (SMI, SDF). The file type is
-                guessed from the extension, unless the --in_ftype option is used. """,
+                "help": """ [ REQUIRED ] input file to process (SMI, SDF, or archives of
+                per-ligand files and their .manifest.tsv), or '-' to read the
+                stream written by another process to the standard input. The file
+                type is guessed from the extension, unless the --in_ftype option
+                is used. """,
                 "action": "store",
                 "metavar": "INPUT_FILE[.EXT]",
                 # "required": True,
@@ -212,6 +215,40 @@ cli_options = {
                 # "default": None,
                 "default": argparse.SUPPRESS,
             },
+            "--in_start_offset": {
+                "help": """start reading the input file from the specified byte
+                offset, e.g. the input position saved in a checkpoint; the offset
+                must point at the beginning of a record [ default: %s ]"""
+                % molprovider_default["start_offset"],
+                "action": "store",
+                "metavar": "BYTES",
+                "required": False,
+                "type": type(molprovider_default["start_offset"]),
+                "default": argparse.SUPPRESS,
+            },
+            "--in_use_index": {
+                "help": """if the input file has an up-to-date index (INPUT.idx,
+                created with index_input.py), use it to jump directly to the
+                molecule specified with --in_start_count [ default: %s ]"""
+                % molprovider_default["use_index"],
+                "action": "store",
+                "required": False,
+                "metavar": "TRUE|FALSE",
+                "choices": [True, False],
+                "type": lambda x: bool(strtobool(x)),
+                "default": argparse.SUPPRESS,
+            },
+            "--in_nr_parsers": {
+                "help": """number of processes parsing the records of SDF and
+                SMILES input files (with safe parsing), useful for very large
+                files when reading is the bottleneck [ default: %s ]"""
+                % molprovider_default["nr_parsers"],
+                "action": "store",
+                "metavar": "NUM",
+                "required": False,
+                "type": type(molprovider_default["nr_parsers"]),
+                "default": argparse.SUPPRESS,
+            },
         },
     },
     "output": {
@@ -223,7 +260,9 @@ cli_options = {
                 \'--out_ftype\' is used; if a fullpath with explicit directories
                 is specified, the directories will be created automatically; in
                 \"split\" mode, the file name will be prepended to whatever value
-                is specified in the \"--out_naming\" option""",
+                is specified in the \"--out_naming\" option; with '-' molecules
+                are written to the standard output as a stream that can be read
+                by another process (messages are printed to the standard error)""",
                 "action": "store",
                 "metavar": "OUTPUT_FNAME[.EXT]",
                 # "required": True,
@@ -257,11 +296,13 @@ cli_options = {
                 \'single\' mode is used, writing all the output in a single file;
                 if the \'split\' mode is used, then each molecule will be saved in
                 individual files; the output filenames can be controlled with the
-                \"--out_naming\" option [ default: %s ] """
+                \"--out_naming\" option; the \'archive\' mode saves the individual
+                files as members of rotating tar or zip archives (e.g. output
+                filename ligands.sdf.tar), with a manifest [ default: %s ] """
                 % molstorage_default["mode"],
                 "action": "store",
-                # "metavar": "single|split",
-                "choices": ("single", "split"),
+                # "metavar": "single|split|archive",
+                "choices": ("single", "split", "archive"),
                 "type": type(molstorage_default["mode"]),
                 # "default": molstorage_default["mode"],
                 "default": argparse.SUPPRESS,
@@ -287,6 +328,59 @@ cli_options = {
                 "type": int,
                 "default": argparse.SUPPRESS,
             },
+            "--out_split_fanout": {
+                "help": """[SPLIT MODE ONLY] distribute the output files in the
+                specified number of levels of sub-directories named after the
+                hash of the file name (256 sub-directories per level), to keep
+                directories small when writing millions of files [ default: %d ]"""
+                % molstorage_default["split_fanout"],
+                "action": "store",
+                "metavar": "LEVELS",
+                "required": False,
+                "type": int,
+                "default": argparse.SUPPRESS,
+            },
+            "--out_split_batch_size": {
+                "help": """[SPLIT MODE ONLY] number of molecules buffered in memory
+                and written at once [ default: %d ]"""
+                % molstorage_default["split_batch_size"],
+                "action": "store",
+                "metavar": "INT",
+                "required": False,
+                "type": int,
+                "default": argparse.SUPPRESS,
+            },
+            "--out_split_sync": {
+                "help": """[SPLIT MODE ONLY] sync the output files to disk after
+                each batch [ default: %s ]"""
+                % str(molstorage_default["split_sync"]),
+                "action": "store",
+                "required": False,
+                "metavar": "TRUE|FALSE",
+                "choices": [True, False],
+                "type": lambda x: bool(strtobool(x)),
+                "default": argparse.SUPPRESS,
+            },
+            "--out_archive_max_members": {
+                "help": """[ARCHIVE MODE ONLY] maximum number of molecules in each
+                archive, before starting a new one [ default: %d ]"""
+                % molstorage_default["archive_max_members"],
+                "action": "store",
+                "metavar": "INT",
+                "required": False,
+                "type": int,
+                "default": argparse.SUPPRESS,
+            },
+            "--out_archive_max_size": {
+                "help": """[ARCHIVE MODE ONLY] maximum size (MB, uncompressed) of
+                each archive, before starting a new one [ default: %d ]"""
+                % molstorage_default["archive_max_size"],
+                "action": "store",
+                "metavar": "MB",
+                "required": False,
+                "type": float,
+                "default": argparse.SUPPRESS,
+            },
             "--out_disable_name_sanitize": {
                 "help": """[SPLIT MODE ONLY] by default the molecule name used for
                 the output file name is sanitized by removing spaces, parentheses
@@ -309,6 +403,47 @@ cli_options = {
                 # "default": False,
                 "default": argparse.SUPPRESS,
             },
+            "--out_preserve_order": {
+                "help": """write the output molecules in the same order as the input
+                (isomers of the same molecule are written together) [ default: %s ]"""
+                % str(molstorage_default["preserve_order"]),
+                "action": "store",
+                "required": False,
+                "metavar": "TRUE|FALSE",
+                "choices": [True, False],
+                "type": lambda x: bool(strtobool(x)),
+                "default": argparse.SUPPRESS,
+            },
+            "--out_reorder_buffer_size": {
+                "help": """maximum number of molecules kept in memory while waiting
+                for slower molecules when preserving the input order; molecules in
+                excess are temporarily stored on disk [ default: %d ]"""
+                % molstorage_default["reorder_buffer_size"],
+                "action": "store",
+                "metavar": "INT",
+                "required": False,
+                "type": int,
+                "default": argparse.SUPPRESS,
+            },
+            "--out_compression_level": {
+                "help": """compression level of compressed output files (.gz,
+                .bz2, .xz, .zst) [ default: codec default ]""",
+                "action": "store",
+                "metavar": "INT",
+                "required": False,
+                "type": int,
+                "default": argparse.SUPPRESS,
+            },
+            "--out_compression_threads": {
+                "help": """number of compression threads (.zst output only)
+                [ default: %d ]"""
+                % molstorage_default["compression_threads"],
+                "action": "store",
+                "metavar": "INT",
+                "required": False,
+                "type": int,
+                "default": argparse.SUPPRESS,
+            },
         },
     },
     "isomers": {
@@ -666,6 +801,16 @@ cli_options = {
                 # "type": type(geom_default["strict"]),
                 "default": argparse.SUPPRESS,
             },
+            "--geom_timeout": {
+                "help": """maximum time (seconds) allowed to process a single molecule;
+                workers exceeding it are restarted and the molecule is reported as
+                failed (\"geom_timeout\") [ default: no timeout ]""",
+                "action": "store",
+                "metavar": "SEC",
+                "required": False,
+                "type": float,
+                "default": argparse.SUPPRESS,
+            },
         },
     },
     "general": {
@@ -691,6 +836,31 @@ cli_options = {
                 # "default": general_default["nice_level"],
                 "default": argparse.SUPPRESS,
             },
+            "--writers": {
+                "help": """number of writer processes, each writing an output shard
+                (e.g. output_000.sdf, output_001.sdf, ...; subdirectories
+                shard_000, shard_001, ... in split mode); input molecules are
+                assigned to the shards in turn (with all their isomers), and the
+                shards are listed in OUTPUT.shards.tsv [ default: %d ]"""
+                % general_default["writers"],
+                "action": "store",
+                "metavar": "INT",
+                "required": False,
+                "type": int,
+                "default": argparse.SUPPRESS,
+            },
+            "--merge_shards": {
+                "help": """merge the output shards in the output file when all
+                writers are done (single mode), or their manifests (archive
+                mode) [ default: %s ]"""
+                % str(general_default["merge_shards"]),
+                "action": "store",
+                "required": False,
+                "metavar": "TRUE|FALSE",
+                "choices": [True, False],
+                "type": lambda x: bool(strtobool(x)),
+                "default": argparse.SUPPRESS,
+            },
         },
     },
     "errors": {
@@ -0,0 +1,102 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+
+"""
+This file contains the transparent compression and decompression of input and
+output files, selected from the file extension (e.g., library.sdf.gz)
+
+    .gz     gzip
+    .bz2    bz2
+    .xz     xz (LZMA)
+    .zst    zstd (requires the optional `zstandard` package)
+
+Files are (de)compressed while streaming, so compressed libraries don't need
+to be decompressed to scratch first. Only zstd supports multi-threaded
+compression. Random access (seek) in compressed files is emulated by reading
+from the beginning (gzip, bz2, xz) or forward only (zstd), so byte-offset
+indices (see fileindex) are not supported for compressed files.
+"""
+
+COMPRESSION_EXTENSIONS = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".xz": "xz",
+    ".zst": "zstd",
+}
+
+# default compression levels
+DEFAULT_LEVELS = {
+    "gzip": 6,
+    "bz2": 9,
+    "xz": 6,
+    "zstd": 3,
+}
+
+
+def split_compression(fname: str) -> tuple:
+    """return the filename without the compression extension and the codec
+    (None if the file is not compressed)"""
+    base, ext = os.path.splitext(fname)
+    codec = COMPRESSION_EXTENSIONS.get(ext.lower())
+    if codec is None:
+        return fname, None
+    return base, codec
+
+
+def is_compressed(fname: str) -> bool:
+    return split_compression(fname)[1] is not None
+
+
+def open_compressed(
+    fname: str,
+    mode: str = "rb",
+    codec: str = None,
+    level: int = None,
+    threads: int = 1,
+):
+    """open a file, compressed or not (default: guessed from the extension);
+    mode is the same as open() (r, w, a; t or b), level is the compression
+    level (see DEFAULT_LEVELS) and threads the number of compression threads
+    (zstd only)"""
+    if codec is None:
+        _, codec = split_compression(fname)
+    if codec is None:
+        return open(fname, mode)
+    if not codec in DEFAULT_LEVELS:
+        raise ValueError(
+            "Invalid compression [%s], allowed: %s" % (codec, ", ".join(DEFAULT_LEVELS))
+        )
+    text = not "b" in mode
+    raw_mode = mode.replace("t", "").replace("b", "") + "b"
+    writing = not raw_mode.startswith("r")
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+    if codec == "gzip":
+        fp = gzip.open(fname, raw_mode, compresslevel=level)
+    elif codec == "bz2":
+        fp = bz2.open(fname, raw_mode, compresslevel=level)
+    elif codec == "xz":
+        # the preset can be specified only for writing
+        fp = lzma.open(fname, raw_mode, preset=level if writing else None)
+    else:
+        fp = _open_zstd(fname, raw_mode, level, threads)
+    if text:
+        return io.TextIOWrapper(fp, encoding="utf-8")
+    return fp
+
+
+def _open_zstd(fname: str, mode: str, level: int, threads: int):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst files requires zstandard (pip install zstandard)")
+    fh = open(fname, mode)
+    if mode.startswith("r"):
+        reader = zstandard.ZstdDecompressor().stream_reader(fh, closefd=True)
+        # line-oriented reading (readline) requires a buffered stream
+        return io.BufferedReader(reader)
+    compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+    return compressor.stream_writer(fh, closefd=True)
@@ -7,12 +7,18 @@ import multiprocessing
 
 # from time import sleep
 # import sys
+import collections
+import functools
+import queue
 import random
 import pathlib
+import signal
 import time
+import numpy as np
+import rdkit
 from rdkit.Chem.PropertyMol import PropertyMol
 from rdkit import Chem
-from rdkit.Chem import AllChem, rdMolAlign
+from rdkit.Chem import rdDepictor
 from rdkit.Chem import rdDistGeom
 from rdkit.Chem import rdForceFieldHelpers
 from rdkit.Geometry import Point3D
@@ -20,14 +26,28 @@ from rdkit.Geometry import Point3D
 from .storage import MoleculeProvider
 from .storage import MoleculeStorage
 from .storage import MoleculeIssueStorage
+from .storage import ReorderBuffer
+from .storage import ShardedQueue
+from .storage import get_shard_fname
+from .storage import get_shards_manifest_fname
+from .storage import merge_shards
+from .storage import write_shards_manifest
+from .database import is_database
+from .database import INPUT_ID_PROP
+from .pipe import claim_stdout
 from .geom.geometry import ParallelGeometryGenerator
 from .geom.geometry import GeometryGenerator
+from .geom.embedding import embed_with_fallbacks
+from .geom.embedding import EmbeddingError
 from .transform.isomer import MoleculeIsomers
 from .protonate import AcidBaseConjugator
 from .protonate import Tautomerizer
+from .protonate import default_pka_reactions_fn
+from .protonate import default_tautomers_fn
+from .cache import ScrubCache
 from .common import UniqueMoleculeContainer
 from .ringfix import fix_rings
-from .espaloma_minim import EspalomaMinimizer
+from .patterns import precompile
 
 
 """
@@ -59,7 +79,7 @@ class ScrubberCore(object):
         },
         "output": {
             "values": MoleculeStorage.get_defaults(),
-            "ignore": ["queue", "comm_pipe", "workers_count", "handbrake"],
+            "ignore": ["queue", "comm_pipe", "workers_count", "shard", "handbrake"],
         },
         "isomers": {
             "active": True,
@@ -82,6 +102,8 @@ class ScrubberCore(object):
             "values": {
                 "max_proc": multiprocessing.cpu_count(),
                 "nice_level": None,
+                "writers": 1,
+                "merge_shards": False,
             },
             "ignore": [],
         },
@@ -101,6 +123,9 @@ class ScrubberCore(object):
         if options is None:
             options = self.get_defaults()
         self.options = self._conditional_activation_isomers_geometry(options)
+        if self.options["output"]["values"].get("fname") == "-":
+            # molecules are streamed to stdout, messages are printed to stderr
+            claim_stdout()
         self.geometry_optimize = None
         self.isomer = None
         self._success_cutoff = 0
@@ -111,8 +136,10 @@ class ScrubberCore(object):
         self.handbrake = None
         self.mol_provider = None
         self.mol_writer = None
+        self.mol_writers = []
         self.mol_issues = None
         self.max_proc = self.options["general"]["values"]["max_proc"]
+        self._shard_counts = {}
         self.counter_data = {
             "input": 0,
             "err_input": 0,
@@ -158,14 +185,34 @@ class ScrubberCore(object):
             self.options["input"]["values"]["pipe_comm"] = self._pipe_remote
             self.options["input"]["values"]["handbrake"] = self.handbrake
             self.mol_provider = MoleculeProvider(**self.options["input"]["values"])
+        self.mol_writer = None
+        self.mol_writers = []
+        self._shard_counts = {}
         if not self.options["output"]["values"]["fname"] is None:
-            self.options["output"]["values"]["queue"] = self.queue_out
             self.options["output"]["values"]["comm_pipe"] = self._pipe_remote
             self.options["output"]["values"]["handbrake"] = self.handbrake
+            # each writer receives a poison pill from each worker
             self.options["output"]["values"]["workers_count"] = self.max_proc
-            self.mol_writer = MoleculeStorage(**self.options["output"]["values"])
-            self.mol_writer.start()
-            # self._registered_workers.append(self.mol_writer)
+            writers = self._get_writers_count()
+            if writers == 1:
+                self.options["output"]["values"]["queue"] = self.queue_out
+                self.mol_writer = MoleculeStorage(**self.options["output"]["values"])
+                self.mol_writer.start()
+                # self._registered_workers.append(self.mol_writer)
+            else:
+                print("[ setting up %d output shards ]" % writers)
+                queues = []
+                for shard in range(writers):
+                    opts = self.options["output"]["values"].copy()
+                    opts["fname"] = get_shard_fname(opts["fname"], shard, opts["mode"])
+                    opts["queue"] = multiprocessing.Queue(maxsize=self.max_proc * 3)
+                    opts["shard"] = shard
+                    writer = MoleculeStorage(**opts)
+                    writer.start()
+                    queues.append(opts["queue"])
+                    self.mol_writers.append(writer)
+                # molecules are sent to the writer of their shard
+                self.queue_out = ShardedQueue(queues)
         ###########################
         # geometry
         #
@@ -208,9 +255,63 @@ class ScrubberCore(object):
             )
         if self.mol_writer is not None:
             self._registered_workers.append(("results writer", self.mol_writer))
+        for shard, writer in enumerate(self.mol_writers):
+            self._registered_workers.append(("results writer %d" % shard, writer))
         if self.mol_issues is not None:
             self._registered_workers.append(("problematic writer", self.mol_issues))
 
+    def _get_writers_count(self) -> int:
+        """return the number of writer processes, each writing an output
+        shard; outputs that can't be sharded use a single writer"""
+        writers = self.options["general"]["values"]["writers"]
+        if writers <= 1:
+            return 1
+        out_opts = self.options["output"]["values"]
+        if out_opts["fname"] == "-" or out_opts["mode"] == "pipe":
+            print("Warning: output streams can't be sharded, a single writer will be used")
+            return 1
+        if out_opts["preserve_order"]:
+            print("Warning: the input order is preserved only by a single writer, a single writer will be used")
+            return 1
+        return writers
+
+    def _finalize_shards(self, quiet=False):
+        """merge the output shards (if requested) or write the manifest of the
+        shards"""
+        out_opts = self.options["output"]["values"]
+        fname = out_opts["fname"]
+        if is_database(fname):
+            # the shards share the database
+            return
+        shards = [
+            (shard, writer.fname, self._shard_counts.get(shard, 0))
+            for shard, writer in enumerate(self.mol_writers)
+        ]
+        if self.options["general"]["values"]["merge_shards"] and out_opts["mode"] in ("single", "archive"):
+            if not quiet:
+                t_start = time.time()
+                print("[ merging %d output shards ..." % len(shards), end="")
+            ftype = self.mol_writers[0].ftype
+            merge_shards(
+                [shard_fname for _, shard_fname, _ in shards],
+                fname,
+                mode=out_opts["mode"],
+                header=ftype == "smi"
+                and out_opts["format_opts"]["single"]["smi"].get("includeHeader", True),
+                format_opts=out_opts["format_opts"]["single"].get(ftype),
+                compression_level=out_opts["compression_level"],
+                compression_threads=out_opts["compression_threads"],
+            )
+            if not quiet:
+                print(" DONE (%2.3f s) ]" % (time.time() - t_start))
+            return
+        if self.options["general"]["values"]["merge_shards"]:
+            print("Warning: shards can be merged only in 'single' and 'archive' mode")
+        manifest_fname = get_shards_manifest_fname(fname)
+        write_shards_manifest(manifest_fname, shards)
+        if not quiet:
+            print("[ %d output shards listed in %s ]" % (len(shards), manifest_fname))
+
     def _check_still_alive(self):
         """check that all pending workers have terminated their job"""
         print(
@@ -353,6 +454,16 @@ class ScrubberCore(object):
         t_start = time.time()
         mol_sec = -1
         mol_step = 10
+        # sequence of the molecules sent to the pipeline, used to restore the
+        # input order in the writer
+        preserve_order = self.options["output"]["values"]["preserve_order"]
+        # the sequence is also used to assign the molecules to the output
+        # shards, and to store the inputs of databases when all their results
+        # have arrived
+        out_fname = self.options["output"]["values"]["fname"]
+        to_database = not out_fname is None and is_database(out_fname)
+        tag_input = preserve_order or len(self.mol_writers) > 0 or to_database
+        seq = 0
         try:
             for counter, mol in self.mol_provider:
                 if counter % mol_step == 0:
@@ -379,8 +490,19 @@ class ScrubberCore(object):
                     mol_pool = self.isomer.mol_pool
                 else:
                     mol_pool = [mol]
-                for mol_raw in mol_pool:
+                if tag_input:
+                    seq += 1
+                if tag_input and not len(mol_pool):
+                    # no isomers: the writer is told that the input is done
+                    ReorderBuffer.tag_mol(mol, seq)
+                    self.queue_out.put(ReorderBuffer.tombstone(mol, "no_isomers"), block=True)
+                for idx, mol_raw in enumerate(mol_pool):
                     mol_raw.SetProp("Scrubber_was_here", "Yes!")
+                    if tag_input:
+                        ReorderBuffer.tag_mol(mol_raw, seq, idx, len(mol_pool))
+                    if mol.HasProp(INPUT_ID_PROP) and not mol_raw.HasProp(INPUT_ID_PROP):
+                        # isomers are linked to the input in databases
+                        mol_raw.SetIntProp(INPUT_ID_PROP, mol.GetIntProp(INPUT_ID_PROP))
                     self._target_queue.put(PropertyMol(mol_raw), block=True)
 
             print(
@@ -416,10 +538,21 @@ class ScrubberCore(object):
                 print(".", end="")
             packet = self._pipe_listener.recv()
             label, value = packet.split(":")
+            if label.startswith("writer_"):
+                # molecules written in each output shard
+                self._shard_counts[int(label[len("writer_") :])] = int(value)
+                continue
             self.counter_data[label] = int(value)
         if not quiet:
             print(" DONE (%2.3f s) ]" % (time.time() - t_start))
+        if isinstance(self.geometry_optimize, ParallelGeometryGenerator):
+            # causes of the 3D embedding failures, summed over the workers
+            for cause, count in self.geometry_optimize.embed_failures.items():
+                self.counter_data["embed_" + cause] = count
         self._pipe_listener.close()
+        if self.mol_writers:
+            self.counter_data["writer"] = sum(self._shard_counts.values())
+            self._finalize_shards(quiet)
         for k, v in self.counter_data.items():
             if v is None:
                 self.counter_data[k] = "n/a"
@@ -445,6 +578,13 @@ class ScrubberCore(object):
             " Written        : %s  | %s"
             % (self.counter_data["writer"], self.counter_data["net_result"])
         )
+        embed_failures = [
+            (k[len("embed_") :], v) for k, v in sorted(self.counter_data.items()) if k.startswith("embed_")
+        ]
+        if embed_failures:
+            print(" 3D embedding failures (causes):")
+            for cause, count in embed_failures:
+                print("   %-20s: %s" % (cause, count))
         print("==============================================")
 
     def _send_poison_pills(self):
@@ -480,6 +620,36 @@ class ScrubberCore(object):
                 curr_target[k] = v
 
 
+# instance of Scrub used by the processes of Scrub.stream()
+_stream_scrub = None
+_stream_scheduler = None
+
+
+def _stream_init(scrub, scheduler):
+    """initializer of Scrub.stream() processes"""
+    global _stream_scrub, _stream_scheduler
+    _stream_scrub = scrub
+    _stream_scheduler = scheduler
+    # the pool stops its processes with SIGTERM, in case the parent installed a handler
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # results are sent back to the main process with their properties
+    Chem.SetDefaultPickleProperties(Chem.PropertyPickleOptions.AllProps)
+
+
+def _stream_process(chunk):
+    """process a chunk of input molecules, return a list of (isomers, error)"""
+    results = []
+    try:
+        for input_mol in chunk:
+            # threads are chosen when the molecule is started, so the cores
+            # left idle by the molecules completed in the meantime are used
+            _stream_scrub.num_threads = _stream_scheduler.get_threads()
+            results.append(_stream_scrub.process_one(input_mol))
+    finally:
+        _stream_scheduler.completed()
+    return results
+
+
 class Scrub:
 
     def __init__(
@@ -499,6 +669,13 @@ class Scrub:
         numconfs=1,
         etkdg_rng_seed=None,
         ff="mmff94s",
+        cache=None,
+        num_threads=1,
+        prune_rms=None,
+        prune_energy_window=None,
+        ff_schedule=None,
+        ring_library=None,
+        embed_max_attempts=1,
     ):
         self.acid_base_conjugator = AcidBaseConjugator.from_default_data_files()
         self.tautomerizer = Tautomerizer.from_default_data_files()
@@ -514,6 +691,10 @@ class Scrub:
         self.do_gen3d = not skip_gen3d
         self.template = template
         self.template_smarts = template_smarts
+        # template matches and coordinates are computed once for all molecules
+        self.embedding_template = None
+        if template is not None:
+            self.embedding_template = EmbeddingTemplate(template, template_smarts, ff)
         self.do_gen2d = do_gen2d
         self.max_ff_iter = max_ff_iter
         self.numconfs = numconfs
@@ -521,14 +702,82 @@ class Scrub:
             etkdg_rng_seed if etkdg_rng_seed else random.randint(0, 1000000)
         )
         self.ff = ff
+        # threads used by RDKit to generate and minimize conformers
+        self.num_threads = num_threads
+        self.prune_rms = prune_rms
+        self.prune_energy_window = prune_energy_window
+        if isinstance(ff_schedule, str):
+            ff_schedule = parse_ff_schedule(ff_schedule)
+        self.ff_schedule = ff_schedule
+        # RingConformerLibrary seeding the embedding of known ring systems
+        self.ring_library = ring_library
+        self.embed_max_attempts = embed_max_attempts
+        if ff_schedule and ff == "espaloma":
+            raise ValueError("ff_schedule can't be used with espaloma")
 
         if ff == "espaloma":
+            # imports the espaloma/OpenFF/OpenMM stack
+            from .espaloma_minim import EspalomaMinimizer
             self.espaloma = EspalomaMinimizer()
         else:
             self.espaloma = None
 
+        # cache of results (ScrubCache or filename); only results with new
+        # coordinates are cached, otherwise they'd depend on input coordinates
+        if isinstance(cache, str):
+            cache = ScrubCache(cache)
+        if not (self.do_gen3d or self.do_gen2d):
+            cache = None
+        self.cache = cache
+        if self.cache is not None:
+            self._cache_options = self._get_cache_options(etkdg_rng_seed)
+
+    def _get_cache_options(self, etkdg_rng_seed):
+        """return the hash of all the options affecting the results"""
+        options = {
+            "ph_low": self.ph_low,
+            "ph_high": self.ph_high,
+            "do_acidbase": self.do_acidbase,
+            "do_tautomers": self.do_tautomers,
+            "skip_ringfix": self.skip_ringfix,
+            "do_gen3d": self.do_gen3d,
+            "do_gen2d": self.do_gen2d,
+            "max_ff_iter": self.max_ff_iter,
+            "numconfs": self.numconfs,
+            "prune_rms": self.prune_rms,
+            "prune_energy_window": self.prune_energy_window,
+            "ff_schedule": self.ff_schedule,
+            # seeds depend on the content of the library
+            "ring_library": self.ring_library is not None,
+            "embed_max_attempts": self.embed_max_attempts,
+            # random seeds (not requested) are not part of the options
+            "etkdg_rng_seed": etkdg_rng_seed,
+            "ff": self.ff,
+            "template": None,
+            "template_smarts": None,
+            "rdkit": rdkit.__version__,
+        }
+        if self.template is not None:
+            options["template"] = Chem.MolToMolBlock(self.template)
+        if self.template_smarts is not None:
+            options["template_smarts"] = Chem.MolToSmarts(self.template_smarts)
+        return ScrubCache.options_hash(
+            options, [default_pka_reactions_fn, default_tautomers_fn]
+        )
+
     def __call__(self, input_mol):
 
+        if self.cache is not None:
+            output_mol_list = self.cache.get(input_mol, self._cache_options)
+            if output_mol_list is not None:
+                return output_mol_list
+            output_mol_list = self._scrub(input_mol)
+            self.cache.put(input_mol, self._cache_options, output_mol_list)
+            return output_mol_list
+        return self._scrub(input_mol)
+
+    def _scrub(self, input_mol):
+
         mol = Chem.RemoveHs(input_mol)
         pool = [input_mol]
 
@@ -559,20 +808,328 @@ class Scrub:
                     numconfs=self.numconfs,
                     ff=self.ff,
                     espaloma=self.espaloma,
-                    template=self.template,
+                    template=self.embedding_template,
                     template_smarts=self.template_smarts,
+                    num_threads=self.num_threads,
+                    prune_rms=self.prune_rms,
+                    prune_energy_window=self.prune_energy_window,
+                    ff_schedule=self.ff_schedule,
+                    ring_library=self.ring_library,
+                    embed_max_attempts=self.embed_max_attempts,
                 )
                 output_mol_list.append(mol_out)
         elif self.do_gen2d:  # useful to write SD files
             output_mol_list = []
             for mol in pool:
-                AllChem.Compute2DCoords(mol)
+                rdDepictor.Compute2DCoords(mol)
                 output_mol_list.append(mol)
         else:
             output_mol_list = pool
 
         return output_mol_list
 
+    def process_one(self, input_mol):
+        """process a molecule (or a SMILES string) catching the errors; return
+        (isomer_list, error), error is None if no exceptions were raised"""
+        try:
+            if isinstance(input_mol, str):
+                smiles = input_mol
+                input_mol = Chem.MolFromSmiles(smiles)
+                if input_mol is None:
+                    raise ValueError("invalid SMILES: %s" % smiles)
+            elif input_mol is None:
+                raise ValueError("invalid input molecule (None)")
+            return (self(input_mol), None)
+        except Exception as exc:
+            return ([], exc)
+
+    def stream(
+        self,
+        mols,
+        nr_proc: int = None,
+        chunksize: int = 1,
+        ordered: bool = True,
+        max_pending: int = None,
+        threads="auto",
+    ):
+        """process an iterable of molecules (RDKit molecules or SMILES strings)
+        using a pool of processes; results are generated as (input_mol,
+        isomer_list, error) tuples, where error is the exception raised while
+        processing the molecule (or None)
+
+            >>> scrub = Scrub(ph_low=7.4)
+            >>> for smiles, isomers, error in scrub.stream(smiles_list, chunksize=8):
+            ...     if error is None:
+            ...         writer.write(isomers[0])
+
+        Input molecules are read only when there are less than `max_pending`
+        chunks submitted to the pool and not yet consumed by the caller
+        (default: 4 chunks per process), so large (or infinite) iterables can
+        be processed with bounded memory; SMILES are parsed in the workers.
+
+        If `ordered` is False, results are generated as soon as they are ready,
+        otherwise the input order is preserved (a slow molecule will hold up
+        the results of the following ones until `max_pending` is reached)
+
+        With multiple conformers (numconfs > 1), `nr_proc` is the number of
+        cores used both by processes and RDKit threads: if `threads` is "auto",
+        the number of threads of each molecule is chosen when it's started,
+        from the molecules read and not completed yet, so that few molecules
+        with many conformers use all the cores (e.g., the tail of the input),
+        while many molecules use one core each; an integer sets a fixed number
+        of threads per molecule
+        """
+        if nr_proc is None:
+            nr_proc = multiprocessing.cpu_count()
+        if max_pending is None:
+            max_pending = 4 * nr_proc
+        if threads == "auto":
+            scheduler = ThreadScheduler(nr_proc, self.numconfs)
+        else:
+            scheduler = ThreadScheduler(nr_proc, num_threads=threads)
+        if nr_proc == 1:
+            self.num_threads = scheduler.get_threads(1)
+            for input_mol in mols:
+                isomer_list, error = self.process_one(input_mol)
+                yield (input_mol, isomer_list, error)
+            return
+        chunks = self._stream_chunks(mols, chunksize)
+        # forked processes inherit the compiled patterns
+        precompile()
+        pool = multiprocessing.Pool(nr_proc, initializer=_stream_init, initargs=(self, scheduler))
+        try:
+            chunks = scheduler.lookahead(chunks, nr_proc)
+            if ordered:
+                results = self._stream_ordered(pool, chunks, max_pending)
+            else:
+                results = self._stream_unordered(pool, chunks, max_pending)
+            for chunk, chunk_results in results:
+                for input_mol, (isomer_list, error) in zip(chunk, chunk_results):
+                    yield (input_mol, isomer_list, error)
+            pool.close()
+        finally:
+            # reached also if the caller stops iterating
+            pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def _stream_chunks(mols, chunksize):
+        """group the input in chunks; molecules are converted to PropertyMol
+        to preserve their properties"""
+        chunk = []
+        for input_mol in mols:
+            if isinstance(input_mol, str):
+                input_mol = input_mol.strip()
+            elif input_mol is not None:
+                input_mol = PropertyMol(input_mol)
+            chunk.append(input_mol)
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _stream_ordered(pool, chunks, max_pending):
+        """submit chunks to the pool and return results in order"""
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.apply_async(_stream_process, (chunk,))))
+            if len(pending) >= max_pending:
+                yield Scrub._stream_get(*pending.popleft())
+        while pending:
+            yield Scrub._stream_get(*pending.popleft())
+
+    @staticmethod
+    def _stream_get(chunk, result):
+        """wait for the results of a chunk"""
+        try:
+            return (chunk, result.get())
+        except Exception as exc:
+            # the whole chunk failed (e.g., the results couldn't be pickled)
+            return (chunk, [([], exc)] * len(chunk))
+
+    @staticmethod
+    def _stream_unordered(pool, chunks, max_pending):
+        """submit chunks to the pool and return results as they're completed"""
+        completed = queue.Queue()
+        inputs = {}
+        for job_id, chunk in enumerate(chunks):
+            inputs[job_id] = chunk
+            pool.apply_async(
+                _stream_process,
+                (chunk,),
+                callback=lambda result, job_id=job_id: completed.put((job_id, result, None)),
+                error_callback=lambda exc, job_id=job_id: completed.put((job_id, None, exc)),
+            )
+            while len(inputs) >= max_pending or not completed.empty():
+                yield Scrub._stream_completed(inputs, completed.get())
+        while inputs:
+            yield Scrub._stream_completed(inputs, completed.get())
+
+    @staticmethod
+    def _stream_completed(inputs, packet):
+        """return a chunk and its results from a completed job"""
+        job_id, result, exc = packet
+        chunk = inputs.pop(job_id)
+        if exc is not None:
+            # the whole chunk failed (e.g., the results couldn't be pickled)
+            result = [([], exc)] * len(chunk)
+        return (chunk, result)
+
+
+class ThreadScheduler(object):
+    """Split the cores between processes and RDKit threads: each molecule
+    gets the cores not used by the other active molecules, up to one thread
+    per conformer; if `num_threads` is set, it's used for all the molecules.
+
+        >>> scheduler = ThreadScheduler(nr_cores=16, numconfs=50)
+        >>> scheduler.get_threads(nr_active=2)
+        8
+
+    The chunks read by lookahead() are active until the processes call
+    completed(); the counter is shared with the processes (e.g. passed to
+    the pool initializer), where get_threads() is called when each molecule
+    is started.
+    """
+
+    def __init__(self, nr_cores: int, numconfs: int = 1, num_threads: int = None):
+        self.nr_cores = nr_cores
+        self.numconfs = numconfs
+        self.num_threads = num_threads
+        self.active = multiprocessing.Value("i", 0)
+
+    def get_threads(self, nr_active: int = None) -> int:
+        """number of threads for a molecule, with nr_active molecules (itself
+        included) processed at the same time (default: the active chunks)"""
+        if self.num_threads is not None:
+            return self.num_threads
+        if nr_active is None:
+            nr_active = self.active.value
+        nr_active = min(max(1, nr_active), self.nr_cores)
+        return max(1, min(self.numconfs, self.nr_cores // nr_active))
+
+    def completed(self):
+        """a chunk has been processed"""
+        with self.active.get_lock():
+            self.active.value -= 1
+
+    def lookahead(self, items, size: int):
+        """generate the items reading up to `size` items ahead, so the number
+        of molecules that are going to be processed together is known also
+        at the beginning of the input; items read are active until
+        completed"""
+        buffered = collections.deque()
+        for item in items:
+            with self.active.get_lock():
+                self.active.value += 1
+            buffered.append(item)
+            if len(buffered) > size:
+                yield buffered.popleft()
+        while buffered:
+            yield buffered.popleft()
+
+
+class EmbeddingTemplate:
+    """Template for constrained embedding (see constrained_embeding); the
+    template-side work (matches, coordinates, alignment indices) is done once
+    and reused for all the query molecules, e.g. a congeneric series.
+
+        >>> template = EmbeddingTemplate(core_mol, template_smarts)
+        >>> for query_mol in series:
+        ...     query_mol, cids = template.embed(query_mol, numconfs, ps)
+    """
+
+    force_constant = 1000
+
+    def __init__(self, core_mol, template_smarts=None, ff: str = "mmff94s"):
+        if ff not in ["uff", "mmff94", "mmff94s", "espaloma"]:
+            raise RuntimeError(
+                f"ff is {ff} but must be 'uff', 'mmff94', 'mmff94s', or 'espaloma'"
+            )
+        self.core_mol = core_mol
+        self.template_smarts = template_smarts
+        self.ff = ff
+        if template_smarts is None:
+            # query atoms are matched to the core atoms in order
+            self.query_pattern = core_mol
+            self.core_indices = list(range(core_mol.GetNumAtoms()))
+        else:
+            self.query_pattern = template_smarts
+            core_match = core_mol.GetSubstructMatches(template_smarts)
+            if not core_match:
+                raise ValueError("SMARTs doesn't match the template")
+            elif len(core_match) > 1:
+                raise RuntimeError("Expected one match but multiple matches were found.")
+            self.core_indices = list(core_match[0])
+        conf = core_mol.GetConformer()
+        self.core_points = []
+        for i in self.core_indices:
+            p = conf.GetAtomPosition(i)
+            self.core_points.append((p.x, p.y, p.z))
+
+    def get_alignment_map(self, query_mol) -> list:
+        """return the (query atom, core atom) pairs of the query molecule"""
+        query_match = query_mol.GetSubstructMatches(self.query_pattern)
+        if not query_match:
+            if self.template_smarts is None:
+                raise ValueError("molecule doesn't match the core")
+            raise ValueError("SMARTs doesn't match the molecule")
+        elif len(query_match) > 1:
+            raise RuntimeError("Expected one match but multiple matches were found.")
+        return list(zip(query_match[0], self.core_indices))
+
+    def _get_mmff_props(self, query_mol):
+        if self.ff == "uff":
+            return None
+        # If you chose espaloma as ff it will still minimize it at the end with that forcefield.
+        variant = "MMFF94" if self.ff == "mmff94" else "MMFF94s"
+        return rdForceFieldHelpers.MMFFGetMoleculeProperties(query_mol, mmffVariant=variant)
+
+    def _get_force_field(self, query_mol, conf_id, mmff_props):
+        if mmff_props is None:
+            return rdForceFieldHelpers.UFFGetMoleculeForceField(query_mol, confId=conf_id)
+        return rdForceFieldHelpers.MMFFGetMoleculeForceField(
+            query_mol, mmff_props, confId=conf_id
+        )
+
+    def embed(self, query_mol, numconfs: int = 1, ps=None):
+        """embed the query molecule, and restrain the matched atoms of each
+        conformer to the coordinates of the template; return the molecule and
+        the ids of the conformers"""
+
+        # only needed for template embedding
+        from rdkit.Chem import rdMolAlign
+
+        algMap = self.get_alignment_map(query_mol)
+
+        cids = rdDistGeom.EmbedMultipleConfs(query_mol, numconfs, ps)
+
+        # This is just is a minimization with restraints to force the querry mol to match the template.
+        mmff_props = self._get_mmff_props(query_mol) if len(cids) else None
+        rms = None
+        for cid in cids:
+            # rotate the embedded conformation onto the core:
+            rdMolAlign.AlignMol(query_mol, self.core_mol, prbCid=cid, atomMap=algMap)
+            ff = self._get_force_field(query_mol, cid, mmff_props)
+            for (query_idx, _), (x, y, z) in zip(algMap, self.core_points):
+                pIdx = ff.AddExtraPoint(x, y, z, fixed=True) - 1
+                ff.AddDistanceConstraint(pIdx, query_idx, 0, 0, self.force_constant)
+            ff.Initialize()
+            n = 4
+            more = ff.Minimize(energyTol=1e-4, forceTol=1e-3)
+            while more and n:
+                more = ff.Minimize(energyTol=1e-4, forceTol=1e-3)
+                n -= 1
+
+            # realign
+            rms = rdMolAlign.AlignMol(query_mol, self.core_mol, prbCid=cid, atomMap=algMap)
+
+        if rms is not None:
+            query_mol.SetProp("EmbedRMS", str(rms))
+
+        return query_mol, cids
+
 
 def constrained_embeding(
     query_mol,
@@ -584,82 +1141,82 @@ def constrained_embeding(
 ):
     """Generate an embedding of a query molecule where part of the molecule
     is constrained to have particular coordinates derived from a core.
-    Alternatively, a SMARTs pattern can be provided to match specific atoms from both molecules
+    Alternatively, a SMARTs pattern can be provided to match specific atoms from both molecules.
+    The core can also be an EmbeddingTemplate, to avoid repeating the template-side work.
     """
-
-    force_constant = 1000
-    confId = -1
-
-    if ff == "uff":
-        getForceField = AllChem.UFFGetMoleculeForceField
-    elif ff == "mmff94":
-        getForceField = lambda x: AllChem.MMFFGetMoleculeForceField(
-            x, AllChem.MMFFGetMoleculeProperties(x), confId=confId
-        )
-    # This is just is a minimization with restraints to force the querry mol to match the template. 
-    # If you chose espaloma as ff it will still minimize it at the end with that forcefield.
-    elif ff == "mmff94s" or ff == "espaloma":
-        getForceField = lambda x: AllChem.MMFFGetMoleculeForceField(
-            x,
-            AllChem.MMFFGetMoleculeProperties(x, mmffVariant="MMFF94s"),
-            confId=confId,
-        )
-
-    if template_smarts == None:
-        query_match = query_mol.GetSubstructMatches(core_mol)
-        if not query_match:
-            raise ValueError("molecule doesn't match the core")
-        elif len(query_match) > 1:
-            raise RuntimeError("Expected one match but multiple matches were found.")
-        else:
-            query_match = query_match[0]
-
-        algMap = [(j, i) for i, j in enumerate(query_match)]
-
+    if isinstance(core_mol, EmbeddingTemplate):
+        template = core_mol
     else:
-        query_match = query_mol.GetSubstructMatches(template_smarts)
+        template = EmbeddingTemplate(core_mol, template_smarts, ff)
+    return template.embed(query_mol, numconfs, ps)
 
-        if not query_match:
-            raise ValueError("SMARTs doesn't match the molecule")
-        elif len(query_match) > 1:
-            raise RuntimeError("Expected one match but multiple matches were found.")
-        else:
-            query_match = query_match[0]
 
-        core_match = core_mol.GetSubstructMatches(template_smarts)
+_series_template = None
 
-        if not core_match:
-            raise ValueError("SMARTs doesn't match the template")
-        elif len(core_match) > 1:
-            raise RuntimeError("Expected one match but multiple matches were found.")
-        else:
-            core_match = core_match[0]
 
-        algMap = [(j, i) for j, i in zip(query_match, core_match)]
+def _series_init(template):
+    """initializer of embed_series() processes"""
+    global _series_template
+    _series_template = template
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    Chem.SetDefaultPickleProperties(Chem.PropertyPickleOptions.AllProps)
+
 
-    cids = rdDistGeom.EmbedMultipleConfs(query_mol, numconfs, ps)
+def _series_embed(mol, numconfs=1, etkdg_rng_seed=42, template=None):
+    """embed a molecule on the template (default: the one of the process),
+    return (mol, error)"""
+    if template is None:
+        template = _series_template
+    try:
+        mol = Chem.AddHs(mol)
+        ps = get_etkdg_params(etkdg_rng_seed)
+        mol, cids = template.embed(mol, numconfs, ps)
+        if len(cids) == 0:
+            translate_failures(ps.GetFailureCounts())
+    except Exception as err:
+        return None, "%s: %s" % (type(err).__name__, err)
+    return PropertyMol(mol), None
 
-    # rotate the embedded conformation onto the core:
-    rms = rdMolAlign.AlignMol(query_mol, core_mol, atomMap=algMap)
-    ff = getForceField(query_mol, confId=confId)
-    conf = core_mol.GetConformer()
-    for atom in algMap:
-        p = conf.GetAtomPosition(atom[1])
-        pIdx = ff.AddExtraPoint(p.x, p.y, p.z, fixed=True) - 1
-        ff.AddDistanceConstraint(pIdx, atom[0], 0, 0, force_constant)
-    ff.Initialize()
-    n = 4
-    more = ff.Minimize(energyTol=1e-4, forceTol=1e-3)
-    while more and n:
-        more = ff.Minimize(energyTol=1e-4, forceTol=1e-3)
-        n -= 1
 
-    # realign
-    rms = rdMolAlign.AlignMol(query_mol, core_mol, atomMap=algMap)
+def embed_series(
+    mols,
+    template,
+    template_smarts=None,
+    numconfs: int = 1,
+    ff: str = "mmff94s",
+    etkdg_rng_seed: int = 42,
+    nr_proc: int = None,
+    chunksize: int = 1,
+):
+    """embed a series of molecules on the same template (a core molecule or
+    an EmbeddingTemplate); generate (mol, error) tuples, in input order.
 
-    query_mol.SetProp("EmbedRMS", str(rms))
+    With nr_proc > 1, molecules are embedded by a pool of processes, each
+    receiving the template once.
 
-    return query_mol, cids
+        >>> for mol, error in embed_series(mols, core_mol, nr_proc=8):
+        ...     if error is None:
+        ...         writer.write(mol)
+    """
+    if not isinstance(template, EmbeddingTemplate):
+        template = EmbeddingTemplate(template, template_smarts, ff)
+    if nr_proc is None:
+        nr_proc = multiprocessing.cpu_count()
+    if nr_proc <= 1:
+        for mol in mols:
+            yield _series_embed(mol, numconfs, etkdg_rng_seed, template)
+        return
+    func = functools.partial(
+        _series_embed, numconfs=numconfs, etkdg_rng_seed=etkdg_rng_seed
+    )
+    pool = multiprocessing.Pool(nr_proc, initializer=_series_init, initargs=(template,))
+    try:
+        for result in pool.imap(func, mols, chunksize=chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def _ConfToMol(mol, conf_id):
@@ -694,11 +1251,124 @@ def translate_failures(failure_counts):
             if failure_counts[i] != 0:
                 failure_msgs[k] = failure_counts[i]
 
-        raise RuntimeError(failure_msgs)
+        raise EmbeddingError(failure_msgs)
     else:
         return None
 
 
+def _kabsch_rmsd(coords_a, coords_b):
+    """RMSD of two sets of centered coordinates after optimal superposition"""
+    h = np.dot(coords_a.T, coords_b)
+    u, s, vt = np.linalg.svd(h)
+    if np.linalg.det(np.dot(u, vt)) < 0:
+        # no reflections
+        s[-1] = -s[-1]
+    e0 = (coords_a * coords_a).sum() + (coords_b * coords_b).sum()
+    return np.sqrt(max(0.0, (e0 - 2.0 * s.sum()) / len(coords_a)))
+
+
+def _get_energy_func(mol, ff):
+    """return a function calculating the energy of a conformer"""
+    if ff == "uff":
+        return lambda conf_id: rdForceFieldHelpers.UFFGetMoleculeForceField(
+            mol, confId=conf_id
+        ).CalcEnergy()
+    # espaloma conformers are pre-screened with MMFF94s
+    variant = "MMFF94" if ff == "mmff94" else "MMFF94s"
+    props = rdForceFieldHelpers.MMFFGetMoleculeProperties(mol, mmffVariant=variant)
+    return lambda conf_id: rdForceFieldHelpers.MMFFGetMoleculeForceField(
+        mol, props, confId=conf_id
+    ).CalcEnergy()
+
+
+def prune_conformers(
+    mol,
+    rms_threshold: float = None,
+    energy_window: float = None,
+    ff: str = "mmff94s",
+):
+    """remove conformers before minimization (at least one is kept):
+
+    - energy_window: conformers with (pre-minimization) energy higher than the
+      lowest one by more than the window (kcal/mol) are removed; embedded
+      geometries have high energies, so the window should be large (>50)
+    - rms_threshold: conformers with heavy atoms RMSD (after superposition, no
+      symmetry) from a lower energy conformer below the threshold are removed;
+      conformers are compared only if their radius of gyration (Rg) hashes to
+      the same or to adjacent buckets of size rms_threshold, since conformers
+      with RMSD < threshold can't have Rg differing by more than the threshold
+
+    return the number of conformers removed"""
+    conf_ids = [conf.GetId() for conf in mol.GetConformers()]
+    if len(conf_ids) < 2 or (rms_threshold is None and energy_window is None):
+        return 0
+    # energies are used also to keep the best of similar conformers
+    energy_func = _get_energy_func(mol, ff)
+    energies = {conf_id: energy_func(conf_id) for conf_id in conf_ids}
+    conf_ids.sort(key=lambda conf_id: energies[conf_id])
+    keep = conf_ids
+    if energy_window is not None:
+        lowest = energies[conf_ids[0]]
+        keep = [conf_id for conf_id in conf_ids if energies[conf_id] - lowest <= energy_window]
+    if rms_threshold is not None and len(keep) > 1:
+        heavy = [atom.GetIdx() for atom in mol.GetAtoms() if atom.GetAtomicNum() > 1]
+        buckets = {}
+        unique = []
+        for conf_id in keep:
+            coords = mol.GetConformer(conf_id).GetPositions()[heavy]
+            coords = coords - coords.mean(axis=0)
+            rg = np.sqrt((coords * coords).sum() / len(coords))
+            bucket = int(rg / rms_threshold)
+            is_duplicate = False
+            for near in (bucket - 1, bucket, bucket + 1):
+                for other in buckets.get(near, []):
+                    if _kabsch_rmsd(coords, other) < rms_threshold:
+                        is_duplicate = True
+                        break
+                if is_duplicate:
+                    break
+            if not is_duplicate:
+                buckets.setdefault(bucket, []).append(coords)
+                unique.append(conf_id)
+        keep = unique
+    removed = set(conf_ids) - set(keep)
+    for conf_id in removed:
+        mol.RemoveConformer(conf_id)
+    return len(removed)
+
+
+def get_etkdg_params(etkdg_rng_seed: int = 42, num_threads: int = 1):
+    """return the ETKDG parameters used for embedding"""
+    ps = rdDistGeom.ETKDGv3()
+    ps.randomSeed = etkdg_rng_seed
+    ps.trackFailures = True
+    ps.enforceChirality = True
+    ps.useSmallRingTorsions = True
+    ps.useMacrocycleTorsions = True
+    ps.clearConfs = True
+    # conformers are embedded in parallel (0: all the cores)
+    ps.numThreads = num_threads
+    return ps
+
+
+def parse_ff_schedule(schedule: str) -> list:
+    """parse a staged minimization schedule "iters:keep,iters:keep,...", e.g.
+    "50:5,200:1": all conformers are minimized for 50 steps, then the best 5
+    for 200 more steps; the last "keep" is optional"""
+    stages = []
+    for stage in schedule.split(","):
+        fields = stage.strip().split(":")
+        try:
+            max_iters = int(fields[0])
+            keep = int(fields[1]) if len(fields) > 1 and fields[1] else None
+        except ValueError:
+            raise ValueError("Invalid minimization stage [%s], expected iters:keep" % stage)
+        if len(fields) > 2 or max_iters < 1 or (keep is not None and keep < 1):
+            raise ValueError("Invalid minimization stage [%s], expected iters:keep" % stage)
+        stages.append((max_iters, keep))
+    return stages
+
+
 def gen3d(
     mol,
     skip_ringfix: bool = False,
@@ -709,18 +1379,27 @@ def gen3d(
     espaloma=None,
     template=None,
     template_smarts=None,
+    num_threads: int = 1,
+    prune_rms: float = None,
+    prune_energy_window: float = None,
+    ff_schedule: list = None,
+    ring_library=None,
+    embed_max_attempts: int = 1,
 ):
+    """ff_schedule: list of minimization stages (max_iters, keep); after each
+    stage only the `keep` conformers with lowest energy are minimized further
+    (see parse_ff_schedule); if None, all conformers are minimized for
+    max_ff_iter steps
+
+    ring_library: RingConformerLibrary; known ring systems are embedded from
+    the stored coordinates, new ones are added to the library
+
+    embed_max_attempts: if the embedding fails, fallbacks are tried (see
+    geom.embedding.EMBED_LADDER) up to this number of attempts"""
     mol.RemoveAllConformers()
     mol = Chem.AddHs(mol)
 
-    # Set up the ETKDG parameters
-    ps = rdDistGeom.ETKDGv3()
-    ps.randomSeed = etkdg_rng_seed
-    ps.trackFailures = True
-    ps.enforceChirality = True
-    ps.useSmallRingTorsions = True
-    ps.useMacrocycleTorsions = True
-    ps.clearConfs = True
+    ps = get_etkdg_params(etkdg_rng_seed, num_threads)
 
     if template is not None:
         mol, cids = constrained_embeding(
@@ -732,11 +1411,22 @@ def gen3d(
             ps=ps,
         )
 
-    else:
-        cids = rdDistGeom.EmbedMultipleConfs(mol, numconfs, ps)
+        if len(cids) == 0:
+            translate_failures(ps.GetFailureCounts())
 
-    if len(cids) == 0:
-        translate_failures(ps.GetFailureCounts())
+    else:
+        coord_map = None
+        if ring_library is not None:
+            coord_map = ring_library.get_coord_map(mol)
+        # if the seeded embedding fails (e.g. stereo of the substituents
+        # doesn't fit) the fallbacks start from the regular embedding
+        cids = embed_with_fallbacks(
+            mol,
+            numconfs,
+            lambda: get_etkdg_params(etkdg_rng_seed, num_threads),
+            max_attempts=embed_max_attempts,
+            coord_map=coord_map,
+        )
 
     etkdg_coords = [c.GetPositions() for c in mol.GetConformers()]
 
@@ -759,6 +1449,10 @@ def gen3d(
             f"ff is {ff} but must be 'uff', 'mmff94', 'mmff94s', or 'espaloma'"
         )
 
+    prune_conformers(
+        mol, rms_threshold=prune_rms, energy_window=prune_energy_window, ff=ff
+    )
+
     if ff == "espaloma":
         if espaloma is None:
             raise ValueError("espaloma minimizer needs to be passed")
@@ -767,16 +1461,30 @@ def gen3d(
         optimize_func = {
             "uff": rdForceFieldHelpers.UFFOptimizeMoleculeConfs,
             "mmff94": rdForceFieldHelpers.MMFFOptimizeMoleculeConfs,
-            "mmff94s": lambda mol, maxIters: rdForceFieldHelpers.MMFFOptimizeMoleculeConfs(
-                mol, maxIters=maxIters, mmffVariant="mmff94s"
+            "mmff94s": lambda mol, maxIters, numThreads: rdForceFieldHelpers.MMFFOptimizeMoleculeConfs(
+                mol, maxIters=maxIters, mmffVariant="mmff94s", numThreads=numThreads
             ),
         }[ff]
-        _energies = optimize_func(mol, maxIters=max_ff_iter)
-        energies = [e[1] for e in _energies]
-
-    best_energy_index = min(zip(cids, energies), key=lambda x: x[1])[0]
+        stages = ff_schedule if ff_schedule else [(max_ff_iter, None)]
+        for i, (max_iters, keep) in enumerate(stages):
+            _energies = optimize_func(mol, maxIters=max_iters, numThreads=num_threads)
+            energies = [e[1] for e in _energies]
+            if i == len(stages) - 1 or keep is None or keep >= len(energies):
+                continue
+            # minimization continues from the current coordinates
+            stage_ids = [conf.GetId() for conf in mol.GetConformers()]
+            ranked = sorted(zip(energies, stage_ids))
+            for _, conf_id in ranked[keep:]:
+                mol.RemoveConformer(conf_id)
+
+    # conformer ids after ring fixes and pruning (renumbered by espaloma)
+    conf_ids = [conf.GetId() for conf in mol.GetConformers()]
+    best_energy_index = min(zip(conf_ids, energies), key=lambda x: x[1])[0]
     final_mol = _ConfToMol(mol, best_energy_index)
 
+    if ring_library is not None:
+        ring_library.add(final_mol)
+
     return final_mol
 
 
@@ -0,0 +1,479 @@
+import array
+import os
+import sqlite3
+import time
+
+from rdkit import Chem
+from rdkit.Geometry import Point3D
+
+"""
+This file contains the SQLite database used to track a campaign (input
+molecules, results and errors) in a single file, and to resume it
+
+    sources     input files imported (path, size, modification time)
+    inputs      input molecules: name, canonical SMILES, molecule, status
+    isomers     isomers of each input: name, SMILES, molecule (no conformers)
+    conformers  coordinates of the conformers of each isomer
+    errors      errors of each input
+
+Input molecules are imported once as pending; they become done when their
+isomers are stored, failed when an error is stored. Re-running a campaign
+processes only the pending molecules. Inputs, isomers and errors are written
+in large transactions (`batch_size` molecules); results not committed when a
+run is interrupted are lost, and their input molecules are still pending.
+"""
+
+STATUS_PENDING = 0
+STATUS_DONE = 1
+STATUS_FAILED = 2
+STATUS_DUPLICATE = 3
+
+STATUS_NAMES = {
+    STATUS_PENDING: "pending",
+    STATUS_DONE: "done",
+    STATUS_FAILED: "failed",
+    STATUS_DUPLICATE: "duplicate",
+}
+
+# property set on input molecules (copied by Scrub to the isomers)
+INPUT_ID_PROP = "scrubber_input_id"
+
+DATABASE_EXTENSIONS = (".db", ".sqlite")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS sources ("
+    "id INTEGER PRIMARY KEY, fname TEXT, size INTEGER, mtime REAL, count INTEGER, imported REAL)",
+    "CREATE TABLE IF NOT EXISTS inputs ("
+    "id INTEGER PRIMARY KEY, source_id INTEGER, name TEXT, smiles TEXT, mol BLOB, "
+    "status INTEGER DEFAULT 0, updated REAL)",
+    "CREATE INDEX IF NOT EXISTS inputs_name ON inputs (name)",
+    "CREATE INDEX IF NOT EXISTS inputs_smiles ON inputs (smiles)",
+    "CREATE INDEX IF NOT EXISTS inputs_status ON inputs (status, id)",
+    "CREATE TABLE IF NOT EXISTS isomers ("
+    "id INTEGER PRIMARY KEY, input_id INTEGER, name TEXT, smiles TEXT, mol BLOB, num_conformers INTEGER)",
+    "CREATE INDEX IF NOT EXISTS isomers_input ON isomers (input_id)",
+    "CREATE INDEX IF NOT EXISTS isomers_name ON isomers (name)",
+    "CREATE INDEX IF NOT EXISTS isomers_smiles ON isomers (smiles)",
+    "CREATE TABLE IF NOT EXISTS conformers ("
+    "isomer_id INTEGER, conf_idx INTEGER, coords BLOB, PRIMARY KEY (isomer_id, conf_idx))",
+    "CREATE TABLE IF NOT EXISTS errors ("
+    "id INTEGER PRIMARY KEY, input_id INTEGER, message TEXT, created REAL)",
+    "CREATE INDEX IF NOT EXISTS errors_input ON errors (input_id)",
+]
+
+
+def is_database(fname: str) -> bool:
+    return os.path.splitext(fname)[1].lower() in DATABASE_EXTENSIONS
+
+
+class MoleculeDatabase(object):
+    """SQLite database of a campaign.
+
+        >>> db = MoleculeDatabase("campaign.db")
+        >>> db.import_molecules(Chem.SmilesMolSupplier("library.smi"), "library.smi")
+        >>> for mol in DatabaseMolSupplier(db):
+        ...     ...
+        >>> db.find(name="ZINC000001")
+        >>> db.get_isomers(input_id)
+
+    As for ScrubCache, the database uses write-ahead logging and each process
+    opens its own connection.
+    """
+
+    def __init__(self, fname: str, batch_size: int = 10000, timeout: float = 60.0):
+        self.fname = fname
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        # connections can't be shared by processes
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        return state
+
+    def _connect(self) -> sqlite3.Connection:
+        """return the connection of the current process"""
+        if self._pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.fname, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    def _transaction(self, statements: list):
+        """execute the (sql, rows) statements in a single transaction"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, rows in statements:
+                conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def find_source(self, fname: str) -> int:
+        """return the id of the source, if the file was already imported and
+        didn't change, or None"""
+        row = self._connect().execute(
+            "SELECT id FROM sources WHERE fname=? AND size=? AND mtime=? AND imported IS NOT NULL",
+            (os.path.abspath(fname), os.path.getsize(fname), os.path.getmtime(fname)),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def import_molecules(self, mols, fname: str = None) -> int:
+        """store the molecules (None if not parsed) as pending inputs; with
+        the name of the input file, files already imported are skipped.
+        Return the number of molecules imported"""
+        conn = self._connect()
+        source_id = None
+        if fname is not None:
+            if self.find_source(fname) is not None:
+                return 0
+            # remove the molecules of interrupted imports of the file
+            self._transaction([
+                (
+                    "DELETE FROM inputs WHERE source_id IN "
+                    "(SELECT id FROM sources WHERE fname=? AND imported IS NULL)",
+                    [(os.path.abspath(fname),)],
+                ),
+                ("DELETE FROM sources WHERE fname=? AND imported IS NULL", [(os.path.abspath(fname),)]),
+            ])
+            source_id = conn.execute(
+                "INSERT INTO sources (fname, size, mtime, count, imported) VALUES (?, ?, ?, 0, NULL)",
+                (os.path.abspath(fname), os.path.getsize(fname), os.path.getmtime(fname)),
+            ).lastrowid
+        sql = (
+            "INSERT INTO inputs (source_id, name, smiles, mol, status, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?)"
+        )
+        count = 0
+        rows = []
+        for mol in mols:
+            now = time.time()
+            if mol is None:
+                rows.append((source_id, None, None, None, STATUS_FAILED, now))
+            else:
+                name = mol.GetProp("_Name") if mol.HasProp("_Name") else None
+                data = mol.ToBinary(Chem.PropertyPickleOptions.AllProps)
+                rows.append((source_id, name, Chem.MolToSmiles(mol), data, STATUS_PENDING, now))
+            if len(rows) >= self.batch_size:
+                self._transaction([(sql, rows)])
+                count += len(rows)
+                rows = []
+        self._transaction([(sql, rows)])
+        count += len(rows)
+        if source_id is not None:
+            # the import is complete, an interrupted one is repeated
+            conn.execute(
+                "UPDATE sources SET count=?, imported=? WHERE id=?", (count, time.time(), source_id)
+            )
+        return count
+
+    def pending(self, start_id: int = 0, limit: int = None):
+        """return (input id, molecule) of the pending inputs, in pages of
+        `batch_size` rows, so the inputs can be updated while iterating"""
+        conn = self._connect()
+        last_id = start_id
+        while True:
+            page = conn.execute(
+                "SELECT id, mol FROM inputs WHERE status=? AND id>? ORDER BY id LIMIT ?",
+                (STATUS_PENDING, last_id, self.batch_size if limit is None else min(limit, self.batch_size)),
+            ).fetchall()
+            if not page:
+                return
+            for input_id, data in page:
+                yield input_id, Chem.Mol(data)
+                if limit is not None:
+                    limit -= 1
+                    if limit == 0:
+                        return
+            last_id = page[-1][0]
+
+    def store_results(self, results: list, errors: list = None, statuses: list = None):
+        """store in a single transaction the results, as (input id, isomers),
+        the errors, as (input id, message), and other statuses, as
+        (input id, status)"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for input_id, isomers in results:
+                for mol in isomers:
+                    self._insert_isomer(conn, input_id, mol)
+            conn.executemany(
+                "UPDATE inputs SET status=?, updated=? WHERE id=?",
+                [(STATUS_DONE, now, input_id) for input_id, _ in results],
+            )
+            conn.executemany(
+                "INSERT INTO errors (input_id, message, created) VALUES (?, ?, ?)",
+                [(input_id, message, now) for input_id, message in errors or []],
+            )
+            conn.executemany(
+                "UPDATE inputs SET status=?, updated=? WHERE id=?",
+                [(STATUS_FAILED, now, input_id) for input_id, _ in errors or []]
+                + [(status, now, input_id) for input_id, status in statuses or []],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _insert_isomer(conn, input_id: int, mol):
+        data = Chem.Mol(mol)
+        data.RemoveAllConformers()
+        if data.HasProp(INPUT_ID_PROP):
+            data.ClearProp(INPUT_ID_PROP)
+        isomer_id = conn.execute(
+            "INSERT INTO isomers (input_id, name, smiles, mol, num_conformers) VALUES (?, ?, ?, ?, ?)",
+            (
+                input_id,
+                mol.GetProp("_Name") if mol.HasProp("_Name") else None,
+                Chem.MolToSmiles(mol),
+                data.ToBinary(Chem.PropertyPickleOptions.AllProps),
+                mol.GetNumConformers(),
+            ),
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO conformers (isomer_id, conf_idx, coords) VALUES (?, ?, ?)",
+            [
+                (isomer_id, i, array.array("d", conf.GetPositions().ravel()).tobytes())
+                for i, conf in enumerate(mol.GetConformers())
+            ],
+        )
+
+    def reset_status(self, status: int = STATUS_FAILED) -> int:
+        """set the inputs with the status back to pending (e.g., to retry the
+        failed ones with other options); return the number of inputs. Inputs
+        that could not be parsed stay failed"""
+        return self._connect().execute(
+            "UPDATE inputs SET status=?, updated=? WHERE status=? AND mol IS NOT NULL",
+            (STATUS_PENDING, time.time(), status),
+        ).rowcount
+
+    def counts(self) -> dict:
+        """return the number of inputs by status name"""
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM inputs GROUP BY status")
+        return {STATUS_NAMES.get(status, str(status)): count for status, count in rows}
+
+    def find(self, name: str = None, smiles: str = None) -> list:
+        """return the inputs with the name or the SMILES (canonicalized), as
+        dictionaries (id, name, smiles, status)"""
+        if name is not None:
+            where, value = "name=?", name
+        elif smiles is not None:
+            mol = Chem.MolFromSmiles(smiles)
+            where, value = "smiles=?", smiles if mol is None else Chem.MolToSmiles(mol)
+        else:
+            raise ValueError("Either name or smiles must be specified")
+        rows = self._connect().execute(
+            "SELECT id, name, smiles, status FROM inputs WHERE %s ORDER BY id" % where, (value,)
+        )
+        return [
+            {"id": i, "name": n, "smiles": s, "status": STATUS_NAMES.get(st, st)}
+            for i, n, s, st in rows
+        ]
+
+    def get_input(self, input_id: int):
+        row = self._connect().execute("SELECT mol FROM inputs WHERE id=?", (input_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return Chem.Mol(row[0])
+
+    def get_isomers(self, input_id: int) -> list:
+        """return the isomers of the input, with their conformers"""
+        conn = self._connect()
+        mols = []
+        for isomer_id, data in conn.execute(
+            "SELECT id, mol FROM isomers WHERE input_id=? ORDER BY id", (input_id,)
+        ).fetchall():
+            mol = Chem.Mol(data)
+            num_atoms = mol.GetNumAtoms()
+            for (coords,) in conn.execute(
+                "SELECT coords FROM conformers WHERE isomer_id=? ORDER BY conf_idx", (isomer_id,)
+            ):
+                xyz = array.array("d", coords)
+                conf = Chem.Conformer(num_atoms)
+                for i in range(num_atoms):
+                    conf.SetAtomPosition(i, Point3D(xyz[3 * i], xyz[3 * i + 1], xyz[3 * i + 2]))
+                conf.Set3D(True)
+                mol.AddConformer(conf, assignId=True)
+            mols.append(mol)
+        return mols
+
+    def get_errors(self, input_id: int) -> list:
+        rows = self._connect().execute(
+            "SELECT message FROM errors WHERE input_id=? ORDER BY id", (input_id,)
+        )
+        return [message for (message,) in rows]
+
+
+class DatabaseMolSupplier(object):
+    """Supply the pending input molecules of the database, with the input id
+    in the `scrubber_input_id` property, used by DatabaseMolWriter to link the
+    results to the inputs.
+
+        >>> supplier = DatabaseMolSupplier(MoleculeDatabase("campaign.db"))
+    """
+
+    def __init__(self, database: MoleculeDatabase, limit: int = None):
+        self.database = database
+        self.limit = limit
+        self.reset()
+
+    def __iter__(self):
+        return self
+
+    def reset(self):
+        self._pending = self.database.pending(limit=self.limit)
+        self._count = 0
+
+    def tell(self) -> int:
+        """return the number of molecules supplied"""
+        return self._count
+
+    def __next__(self):
+        input_id, mol = next(self._pending)
+        mol.SetIntProp(INPUT_ID_PROP, input_id)
+        self._count += 1
+        return mol
+
+    def _close_fp(self):
+        pass
+
+
+def get_input_id(mol) -> int:
+    """return the input id of a molecule (input or isomer) from the database,
+    or None"""
+    if mol is None or not mol.HasProp(INPUT_ID_PROP):
+        return None
+    return int(mol.GetProp(INPUT_ID_PROP))
+
+
+class DatabaseMolWriter(object):
+    """Store the results (isomers, errors) of the inputs supplied by
+    DatabaseMolSupplier, in transactions of `batch_size` inputs.
+
+        >>> with DatabaseMolWriter(database) as writer:
+        ...     writer.write_isomers(isomers)
+        ...     writer.write_error(input_mol, "embedding failed")
+
+    Isomers are linked to the input by the `scrubber_input_id` property,
+    copied by Scrub from the input molecule; write() stores a single isomer,
+    and the input is set as done when the batch is committed, so the isomers
+    of an input must be written one after the other (as scrub.py does).
+    When the isomers of different inputs are interleaved (e.g. by the
+    geometry workers of ScrubberCore), write_tagged() keeps the results of
+    each input until all of them have arrived.
+    """
+
+    def __init__(self, database: MoleculeDatabase, batch_size: int = None):
+        self.database = database
+        self.batch_size = database.batch_size if batch_size is None else batch_size
+        self._results = {}
+        self._errors = []
+        self._statuses = []
+        # seq : [ total, received, input id, isomers, errors ]
+        self._incomplete = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _pending(self) -> int:
+        return len(self._results) + len(self._errors) + len(self._statuses)
+
+    def _check_flush(self):
+        if self._pending() >= self.batch_size:
+            self.flush()
+
+    def write(self, mol):
+        input_id = get_input_id(mol)
+        if input_id is None:
+            raise ValueError("Molecule without %s property" % INPUT_ID_PROP)
+        if not input_id in self._results:
+            # flushed only between inputs, so all the isomers of an input
+            # written one after the other are stored in the same transaction
+            self._check_flush()
+        self._results.setdefault(input_id, []).append(mol)
+
+    def write_tagged(self, tag: tuple, mol=None, input_id: int = None, error: str = None):
+        """add a result of an input tagged with (seq, idx, total) (see
+        storage.ReorderBuffer): an isomer, or a discarded isomer (`mol` None)
+        with the input id and the error; when all the `total` results of the
+        input have arrived, the input is stored as done (with the isomers
+        accepted) or as failed (if none was accepted)"""
+        seq, _, total = tag
+        entry = self._incomplete.setdefault(seq, [total, 0, None, [], []])
+        entry[1] += 1
+        if not mol is None:
+            entry[2] = get_input_id(mol)
+            entry[3].append(mol)
+        else:
+            if not input_id is None:
+                entry[2] = input_id
+            entry[4].append(error or "discarded")
+        if entry[1] < total:
+            return
+        del self._incomplete[seq]
+        _, _, input_id, isomers, errors = entry
+        if input_id is None:
+            return
+        if isomers:
+            self._check_flush()
+            self._results.setdefault(input_id, []).extend(isomers)
+        else:
+            self._errors.append((input_id, ", ".join(errors)))
+            self._check_flush()
+
+    def write_isomers(self, isomers: list, input_mol=None):
+        """store the isomers of an input molecule (default: the input of the
+        first isomer)"""
+        input_id = get_input_id(isomers[0] if input_mol is None else input_mol)
+        if input_id is None:
+            raise ValueError("Molecule without %s property" % INPUT_ID_PROP)
+        self._results.setdefault(input_id, []).extend(isomers)
+        self._check_flush()
+
+    def write_error(self, input_mol, message: str):
+        input_id = get_input_id(input_mol)
+        if input_id is None:
+            return
+        self._errors.append((input_id, str(message)))
+        self._check_flush()
+
+    def set_status(self, input_mol, status: int):
+        input_id = get_input_id(input_mol)
+        if input_id is None:
+            return
+        self._statuses.append((input_id, status))
+        self._check_flush()
+
+    def flush(self):
+        if not self._pending():
+            return
+        self.database.store_results(list(self._results.items()), self._errors, self._statuses)
+        self._results = {}
+        self._errors = []
+        self._statuses = []
+
+    def close(self):
+        # inputs with missing results (e.g. interrupted runs) stay pending
+        self._incomplete = {}
+        self.flush()
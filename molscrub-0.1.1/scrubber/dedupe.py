@@ -0,0 +1,202 @@
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+
+from rdkit import Chem
+
+from .checkpoint import open_for_resume
+
+"""
+This file contains the suppression of duplicate input molecules (e.g., the
+same structure sold with different IDs in merged vendor catalogs)
+
+Each input molecule is identified by the hash of its canonical SMILES; keys
+are stored either in an exact set (moved to a temporary database when too
+large to be kept in memory) or in a Bloom filter (fixed memory, for libraries
+of billions of molecules, at the cost of a small rate of false duplicates).
+"""
+
+
+def smiles_key(smiles: str) -> bytes:
+    """return the key (16 bytes) of a canonical SMILES"""
+    return hashlib.blake2b(smiles.encode(), digest_size=16).digest()
+
+
+class ExactKeySet(object):
+    """Set of molecule keys, each associated with the name of the first
+    occurrence. When more than `max_memory` keys are stored, they are moved to
+    a temporary SQLite database."""
+
+    def __init__(self, max_memory: int = 5000000, tmpdir: str = None):
+        self.max_memory = max_memory
+        self.tmpdir = tmpdir
+        self._keys = {}
+        self._db = None
+        self._db_fname = None
+
+    def check_add(self, key: bytes, name: str) -> str:
+        """add the key, if new; return the name of the first occurrence if
+        the key has been seen already, otherwise None"""
+        first = self._keys.get(key)
+        if first is None and self._db is not None:
+            row = self._db.execute("SELECT name FROM mol_keys WHERE key=?", (key,)).fetchone()
+            if row is not None:
+                first = row[0]
+        if first is not None:
+            return first
+        self._keys[key] = name
+        if len(self._keys) >= self.max_memory:
+            self._spill()
+        return None
+
+    def _spill(self):
+        """move the keys from memory to the database"""
+        if self._db is None:
+            fd, self._db_fname = tempfile.mkstemp(
+                prefix="scrubber_keys_", suffix=".sqlite", dir=self.tmpdir
+            )
+            os.close(fd)
+            self._db = sqlite3.connect(self._db_fname)
+            self._db.execute("PRAGMA journal_mode=OFF")
+            self._db.execute("PRAGMA synchronous=OFF")
+            self._db.execute("CREATE TABLE mol_keys (key BLOB PRIMARY KEY, name TEXT)")
+        with self._db:
+            self._db.executemany("INSERT INTO mol_keys VALUES (?, ?)", self._keys.items())
+        self._keys = {}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            os.remove(self._db_fname)
+            self._db = None
+
+
+class BloomKeySet(object):
+    """Bloom filter of molecule keys; memory usage is defined by the expected
+    number of molecules (`capacity`) and the rate of false positives (new
+    molecules reported as duplicates), e.g. ~3 GB for 1e9 molecules with
+    `error_rate` 1e-5. The first occurrence of a duplicate is not known, so
+    its key (hex) is returned instead of the name."""
+
+    def __init__(self, capacity: int = 100000000, error_rate: float = 1e-5):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.nr_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.nr_hashes = max(1, int(round(self.nr_bits / capacity * math.log(2))))
+        self._bits = bytearray((self.nr_bits + 7) // 8)
+
+    def check_add(self, key: bytes, name: str = None) -> str:
+        """add the key; return the key (hex) if it has been seen already
+        (or it's a false positive), otherwise None"""
+        # double hashing from the two halves of the key
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:], "little") | 1
+        seen = True
+        for i in range(self.nr_hashes):
+            pos = (h1 + i * h2) % self.nr_bits
+            byte, bit = divmod(pos, 8)
+            if not self._bits[byte] & (1 << bit):
+                seen = False
+                self._bits[byte] |= 1 << bit
+        if seen:
+            return key.hex()
+        return None
+
+    def close(self):
+        pass
+
+
+class Deduplicator(object):
+    """Detect duplicate input molecules; duplicates are written as alias
+    records (tab-separated: name of the duplicate, name of the first occurrence
+    or its key, SMILES) so results can be mapped back to all their IDs.
+
+        >>> dedupe = Deduplicator("exact", aliases_fname="aliases.tsv")
+        >>> for mol in dedupe.filter(supplier):
+        ...     isomers = scrub(mol)
+        >>> dedupe.close()
+    """
+
+    def __init__(
+        self,
+        method: str = "exact",
+        aliases_fname: str = None,
+        resume_offset: int = None,
+        isomeric: bool = True,
+        capacity: int = 100000000,
+        error_rate: float = 1e-5,
+        max_memory: int = 5000000,
+    ):
+        if method == "exact":
+            self.keys = ExactKeySet(max_memory=max_memory)
+        elif method == "bloom":
+            self.keys = BloomKeySet(capacity=capacity, error_rate=error_rate)
+        else:
+            raise ValueError("Invalid dedupe method [%s], allowed: exact, bloom" % method)
+        self.method = method
+        self.isomeric = isomeric
+        self.duplicates = 0
+        self.aliases_fp = None
+        if aliases_fname is not None:
+            # when resuming a run, records after the checkpoint are discarded
+            self.aliases_fp = open_for_resume(aliases_fname, resume_offset)
+            self._position = self.aliases_fp.tell()
+
+    def _check_add(self, mol):
+        """add the key of the molecule; return the name (or key) of the first
+        occurrence if already seen, and the SMILES"""
+        smiles = Chem.MolToSmiles(mol, isomericSmiles=self.isomeric)
+        name = mol.GetProp("_Name") if mol.HasProp("_Name") else ""
+        return self.keys.check_add(smiles_key(smiles), name), name, smiles
+
+    def is_duplicate(self, mol) -> bool:
+        """check if the molecule has been seen already"""
+        first, name, smiles = self._check_add(mol)
+        if first is None:
+            return False
+        self.duplicates += 1
+        if self.aliases_fp is not None:
+            record = "%s\t%s\t%s\n" % (name, first, smiles)
+            self.aliases_fp.write(record)
+            self._position += len(record.encode(self.aliases_fp.encoding))
+        return True
+
+    def filter(self, mols):
+        """generate the molecules that are not duplicates; None (molecules
+        that could not be parsed) are passed through"""
+        for mol in mols:
+            if mol is None or not self.is_duplicate(mol):
+                yield mol
+
+    def restore(self, mols) -> int:
+        """add the keys of molecules processed by a previous run (e.g., before
+        the checkpoint of a resumed run), without writing alias records;
+        return the number of molecules read"""
+        count = 0
+        for mol in mols:
+            if mol is None:
+                continue
+            self._check_add(mol)
+            count += 1
+        return count
+
+    def tell(self) -> int:
+        """return the position in the alias file after the records written so
+        far, without flushing them"""
+        if self.aliases_fp is None:
+            return None
+        return self._position
+
+    def flush(self) -> int:
+        """flush the alias records, return the position in the file"""
+        if self.aliases_fp is None:
+            return None
+        self.aliases_fp.flush()
+        return self.aliases_fp.tell()
+
+    def close(self):
+        self.keys.close()
+        if self.aliases_fp is not None:
+            self.aliases_fp.close()
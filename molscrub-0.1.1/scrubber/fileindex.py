@@ -0,0 +1,191 @@
+import array
+import os
+import struct
+
+from .compression import is_compressed
+
+"""
+This file contains the byte-offset index of SDF and SMILES files, used to
+jump directly to any record of large input files (e.g., to split a library in
+shards processed independently by cluster array jobs)
+
+The index is saved in a sidecar file (INPUT.idx) with a small header followed
+by the offsets (uint64) of each record, plus the end offset of the last record:
+
+    magic | data file size | data file mtime (ns) | record count | flags |
+    offset_0 ... offset_n
+
+An index is reused only if the size and the modification time of the data
+file, and the title line flag, are the same as when it was built.
+"""
+
+INDEX_MAGIC = b"SCRUBID2"
+INDEX_HEADER = struct.Struct("<8sQQQQ")
+INDEX_EXT = ".idx"
+FLAG_TITLE_LINE = 1
+# size of the read buffer used when scanning files
+IO_BUFFER = 1 << 20
+
+
+class MoleculeFileIndex(object):
+    """Random access to the record offsets stored in an index file; offsets
+    are read from disk on request, so opening the index of a very large file
+    is cheap.
+
+        >>> index = MoleculeFileIndex.get("library.smi")
+        >>> len(index)
+        50000000
+        >>> index.offset(1000000)  # byte offset of the 1,000,001st molecule
+        71203998
+        >>> shards = index.shards(64)
+    """
+
+    def __init__(self, index_fname: str):
+        self.index_fname = index_fname
+        self._fp = open(index_fname, "rb")
+        data = self._fp.read(INDEX_HEADER.size)
+        if len(data) < INDEX_HEADER.size or data[:8] != INDEX_MAGIC:
+            self._fp.close()
+            raise ValueError("File [%s] is not a valid index" % index_fname)
+        _, self.data_size, self.data_mtime, self.count, self.flags = INDEX_HEADER.unpack(data)
+
+    def is_current(self, fname: str, titleLine: bool = False) -> bool:
+        """return True if the index matches the data file and the title line
+        option"""
+        stat = os.stat(fname)
+        return (
+            self.data_size == stat.st_size
+            and self.data_mtime == stat.st_mtime_ns
+            and bool(self.flags & FLAG_TITLE_LINE) == bool(titleLine)
+        )
+
+    @classmethod
+    def get(cls, fname: str, ftype: str = None, titleLine: bool = False, rebuild: bool = True):
+        """return the index of a data file, (re)building it if it does not
+        exist, if it was built with a different title line option or if the
+        data file changed since it was built"""
+        if is_compressed(fname):
+            raise ValueError("Compressed file [%s] can't be indexed" % fname)
+        index_fname = fname + INDEX_EXT
+        if os.path.exists(index_fname):
+            try:
+                index = cls(index_fname)
+            except ValueError:
+                # e.g. an index of an older version
+                index = None
+            if not index is None and index.is_current(fname, titleLine):
+                return index
+            if not index is None:
+                index.close()
+            if not rebuild:
+                raise ValueError("Index [%s] is out of date" % index_fname)
+        elif not rebuild:
+            raise FileNotFoundError("Index [%s] not found" % index_fname)
+        build_index(fname, ftype=ftype, titleLine=titleLine)
+        return cls(index_fname)
+
+    def __len__(self):
+        return self.count
+
+    def offset(self, record: int) -> int:
+        """return the byte offset of a record (0-based); `offset(len(index))`
+        is the end of the last record"""
+        if record < 0 or record > self.count:
+            raise IndexError("record %d out of range (0-%d)" % (record, self.count))
+        self._fp.seek(INDEX_HEADER.size + 8 * record)
+        return struct.unpack("=Q", self._fp.read(8))[0]
+
+    def offsets(self) -> array.array:
+        """load all the offsets in memory"""
+        data = array.array("Q")
+        self._fp.seek(INDEX_HEADER.size)
+        data.fromfile(self._fp, self.count + 1)
+        return data
+
+    def shards(self, nr_shards: int) -> list:
+        """split the records in `nr_shards` contiguous shards with balanced
+        number of molecules; counts follow the MoleculeProvider convention
+        (1-based, included)"""
+        size, extra = divmod(self.count, nr_shards)
+        shards = []
+        start = 0
+        for i in range(nr_shards):
+            end = start + size + int(i < extra)
+            shards.append(
+                {
+                    "shard": i,
+                    "start_count": start + 1,
+                    "end_count": end,
+                    "start_offset": self.offset(start),
+                    "end_offset": self.offset(end),
+                }
+            )
+            start = end
+        return shards
+
+    def close(self):
+        self._fp.close()
+
+
+def _scan_offsets(fname: str, ftype: str, titleLine: bool = False):
+    """generate the byte offsets of each record; empty lines are skipped in
+    SMILES files, as done by SMIMolSupplierWrapper"""
+    offset = 0
+    with open(fname, "rb", buffering=IO_BUFFER) as fp:
+        if ftype == "smi":
+            if titleLine:
+                offset += len(fp.readline())
+            for line in fp:
+                if line.strip():
+                    yield offset
+                offset += len(line)
+        elif ftype == "sdf":
+            record_start = 0
+            has_data = False
+            for line in fp:
+                offset += len(line)
+                has_data |= bool(line.strip())
+                if b"$$$$" in line:
+                    yield record_start
+                    record_start = offset
+                    has_data = False
+            # last record without "$$$$" terminator
+            if has_data:
+                yield record_start
+        else:
+            raise ValueError("Cannot index files of type [%s]" % ftype)
+
+
+def build_index(fname: str, ftype: str = None, titleLine: bool = False) -> str:
+    """scan a SDF or SMILES file and save the offsets of its records in the
+    index sidecar file; return the index filename"""
+    if is_compressed(fname):
+        raise ValueError("Compressed file [%s] can't be indexed" % fname)
+    if ftype is None:
+        ftype = os.path.splitext(fname)[1][1:].lower()
+        if ftype == "cxsmiles":
+            ftype = "smi"
+    # the file is checked before scanning, so changes while scanning make the
+    # index out of date
+    stat = os.stat(fname)
+    data_size = stat.st_size
+    index_fname = fname + INDEX_EXT
+    tmp_fname = "%s.tmp%d" % (index_fname, os.getpid())
+    count = 0
+    buff = array.array("Q")
+    with open(tmp_fname, "wb") as fp:
+        fp.write(INDEX_HEADER.pack(INDEX_MAGIC, 0, 0, 0, 0))
+        for offset in _scan_offsets(fname, ftype, titleLine):
+            buff.append(offset)
+            count += 1
+            if len(buff) == 65536:
+                buff.tofile(fp)
+                buff = array.array("Q")
+        buff.append(data_size)
+        buff.tofile(fp)
+        fp.seek(0)
+        flags = FLAG_TITLE_LINE if titleLine else 0
+        fp.write(INDEX_HEADER.pack(INDEX_MAGIC, data_size, stat.st_mtime_ns, count, flags))
+    # concurrent jobs building the same index do not clash
+    os.replace(tmp_fname, index_fname)
+    return index_fname
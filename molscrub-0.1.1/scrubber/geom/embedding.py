@@ -0,0 +1,140 @@
+import collections
+import json
+
+from rdkit.Chem import rdDistGeom
+
+"""
+This file contains the fallback ladder used when ETKDG fails to embed a
+molecule, and the statistics of the embedding failures
+
+When the first embedding fails, the fallbacks are tried in order of cost
+(and of how much they relax the ETKDG terms), until one succeeds or the
+maximum number of attempts is reached. The fallback used and the failures of
+the previous attempts are stored in the private properties of the molecule
+(`_embed_fallback`, `_embed_failures`), so they survive pickling and can be
+aggregated by the main process with EmbedStats.
+"""
+
+# name, ETKDG parameters changed (in addition to a different random seed)
+EMBED_LADDER = [
+    ("new_seed", {}),
+    ("random_coords", {"useRandomCoords": True}),
+    # maximum number of embedding attempts per conformer (default: 10 x atoms)
+    ("more_iterations", {"useRandomCoords": True, "maxIterations": 5000}),
+    (
+        "no_torsion_prefs",
+        {
+            "useRandomCoords": True,
+            "useExpTorsionAnglePrefs": False,
+            "useSmallRingTorsions": False,
+            "useMacrocycleTorsions": False,
+        },
+    ),
+    # chirality is always enforced: a conformer whose stereo doesn't match
+    # the input isomer is worse than a failure
+]
+
+
+class EmbeddingError(RuntimeError):
+    """raised when all the embedding attempts fail; failure_counts are the
+    failure causes (see translate_failures) summed over all attempts"""
+
+    def __init__(self, failure_counts: dict):
+        super().__init__(failure_counts)
+        self.failure_counts = failure_counts
+
+
+def get_failure_counts(ps) -> dict:
+    """return the non-zero failure counts of the ETKDG parameters"""
+    failure_counts = {}
+    for name, count in zip(rdDistGeom.EmbedFailureCauses.names, ps.GetFailureCounts()):
+        if count:
+            failure_counts[name] = count
+    return failure_counts
+
+
+def embed_with_fallbacks(
+    mol,
+    numconfs: int,
+    get_params,
+    max_attempts: int = 1,
+    coord_map: dict = None,
+    ladder: list = None,
+) -> list:
+    """embed the molecule, trying the fallbacks of the ladder (default:
+    EMBED_LADDER) if the embedding fails; return the conformer ids or raise
+    EmbeddingError.
+
+    get_params is a function returning new ETKDG parameters (with
+    trackFailures enabled); max_attempts includes the first attempt, so with
+    1 no fallbacks are tried. With coord_map (e.g. from RingConformerLibrary)
+    a seeded attempt is made first, not counted in max_attempts."""
+    if ladder is None:
+        ladder = EMBED_LADDER
+    attempts = []
+    if coord_map:
+        attempts.append(("coord_map", {}, 0))
+    attempts.append(("etkdg", {}, 0))
+    for i, (name, changes) in enumerate(ladder[: max(0, max_attempts - 1)]):
+        attempts.append((name, changes, i + 1))
+    failures = collections.Counter()
+    for name, changes, seed_offset in attempts:
+        ps = get_params()
+        if seed_offset and ps.randomSeed >= 0:
+            ps.randomSeed += seed_offset
+        for key, value in changes.items():
+            setattr(ps, key, value)
+        if name == "coord_map":
+            ps.SetCoordMap(coord_map)
+        cids = rdDistGeom.EmbedMultipleConfs(mol, numconfs, ps)
+        if len(cids):
+            if name not in ("coord_map", "etkdg"):
+                mol.SetProp("_embed_fallback", name)
+            if failures:
+                mol.SetProp("_embed_failures", json.dumps(failures))
+            return list(cids)
+        failures.update(get_failure_counts(ps))
+    raise EmbeddingError(dict(failures))
+
+
+class EmbedStats(object):
+    """Statistics of the embedding over a run: molecules embedded using each
+    fallback, molecules that could not be embedded, and the failure causes
+    (including those of attempts followed by a successful fallback).
+
+        >>> stats = EmbedStats()
+        >>> for mol in isomer_list:
+        ...     stats.add_mol(mol)
+        >>> print(stats.summary())
+    """
+
+    def __init__(self, counts: dict = None):
+        self.counts = collections.Counter(counts or {})
+
+    def add_mol(self, mol):
+        if mol.HasProp("_embed_fallback"):
+            self.counts["fallback:" + mol.GetProp("_embed_fallback")] += 1
+        if mol.HasProp("_embed_failures"):
+            for cause, count in json.loads(mol.GetProp("_embed_failures")).items():
+                self.counts["cause:" + cause] += count
+
+    def add_error(self, error):
+        if not isinstance(error, EmbeddingError):
+            return
+        self.counts["failed"] += 1
+        for cause, count in error.failure_counts.items():
+            self.counts["cause:" + cause] += count
+
+    def summary(self) -> str:
+        """return a description of the statistics, or an empty string"""
+        fallbacks = [(k[9:], v) for k, v in sorted(self.counts.items()) if k.startswith("fallback:")]
+        causes = [(k[6:], v) for k, v in self.counts.most_common() if k.startswith("cause:")]
+        if not fallbacks and not causes and not self.counts["failed"]:
+            return ""
+        s = "embedding: %d recovered by fallbacks, %d failed\n" % (
+            sum(v for _, v in fallbacks), self.counts["failed"])
+        if fallbacks:
+            s += "  fallbacks: %s\n" % ", ".join("%s %d" % item for item in fallbacks)
+        if causes:
+            s += "  failure causes: %s\n" % ", ".join("%s %d" % item for item in causes)
+        return s
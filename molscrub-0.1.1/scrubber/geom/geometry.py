@@ -1,5 +1,10 @@
+import collections
 import multiprocessing
+import multiprocessing.connection
 import os
+import queue
+import threading
+import time
 
 from rdkit import Chem
 from rdkit.Chem import rdDistGeom
@@ -8,6 +13,12 @@ from rdkit.Chem import rdMolTransforms
 from rdkit.Chem.PropertyMol import PropertyMol
 
 from ..common import ScrubberBase, copy_mol_properties
+from ..storage import ReorderBuffer
+from ..storage import ShardedQueue
+from ..patterns import get_smarts
+from ..patterns import precompile
+from .embedding import embed_with_fallbacks
+from .embedding import EmbeddingError
 # from .ringcorners import RingManager
 
 
@@ -39,7 +50,7 @@ class GeometryGenerator(ScrubberBase):
         max_iterations: int = 200,
         auto_iter_cycles: int = 10,
         gen3d: bool = True,
-        gen3d_max_attempts: int = 3,
+        gen3d_max_attempts: int = 1,
         fix_ring_corners: bool = False,
         preserve_mol_properties: bool = True,
         _stop_at_defaults: bool = False,
@@ -50,7 +61,8 @@ class GeometryGenerator(ScrubberBase):
                             minimization with max_iterations will be repeated
         gen3d           :   generate 3D coordinates (using the ETKDGv3 method)
         gen3d_max_attempts  : how many times distance geometry attempts in case
-                            of failure in generating 3D coords
+                            of failure in generating 3D coords (see
+                            embedding.EMBED_LADDER); 1: no fallbacks
         """
         self.add_h = add_h
         self.force_trans_amide = force_trans_amide
@@ -113,8 +125,13 @@ class GeometryGenerator(ScrubberBase):
                 if not self.gen3d_engine is None:
                     report["gen3d_max_attempts"] = self.gen3d_max_attempts
                     try:
-                        rdDistGeom.EmbedMolecule(
-                            mol, self.gen3d_engine)
+                        embed_with_fallbacks(
+                            mol, 1, self._get_gen3d_params, self.gen3d_max_attempts)
+                    except EmbeddingError as err:
+                        report["state"] = "fail_3d"
+                        report["embed_failures"] = err.failure_counts
+                        report["accepted"] = -1
+                        break
                     except Exception as err:
                         report["state"] = err.__str__()
                         report["accepted"] = -1
@@ -157,11 +174,16 @@ class GeometryGenerator(ScrubberBase):
             print("RING CORNERS FLIPPED HERE")
         return report
 
+    def _get_gen3d_params(self):
+        """return new ETKDG parameters for each embedding attempt"""
+        ps = rdDistGeom.ETKDGv3()
+        ps.trackFailures = True
+        return ps
+
     def _fix_amide(self, mol):
         """check that secondary amides are in trans (~180 deg) or trans-like ()
         configuration"""
-        pattern = "[H][NX3;R0]([!#1])[CX3;R0](=[OX1])[#6]"
-        found_amides = mol.GetSubstructMatches(Chem.MolFromSmarts(pattern))
+        found_amides = mol.GetSubstructMatches(get_smarts("secondary_amide"))
         if not found_amides:
             return
         conf = mol.GetConformer(0)
@@ -180,6 +202,15 @@ class GeometryGeneratorMPWorker(multiprocessing.Process, GeometryGenerator):
     self.queue_in   :  source of molecules to process
     self.queue_out  :  destination of processed molecules
 
+    If a status connection is provided, each molecule is sent through it
+    before processing, and the start time is stored in `busy_since` (0 when
+    idle), so a watchdog can stop workers stuck on a single molecule; the
+    results (and poison pills) are also sent through it, and forwarded to the
+    queues by the watchdog (see ParallelGeometryGenerator).
+
+    The causes of the 3D embedding failures are counted and sent to
+    `stats_queue` when the worker is done (or through the status connection
+    after each failure, since the worker can be killed).
     """
 
     def __init__(
@@ -190,6 +221,9 @@ class GeometryGeneratorMPWorker(multiprocessing.Process, GeometryGenerator):
         nice_level: int = None,
         strict: bool = False,
         handbrake: multiprocessing.Event=None,
+        status_conn=None,
+        busy_since: multiprocessing.Value=None,
+        stats_queue: multiprocessing.Queue=None,
         # geom_opts: dict = GeometryGenerator.get_defaults(),
         add_h: bool = geom_default["add_h"],
         force_trans_amide: bool = geom_default["force_trans_amide"],
@@ -226,40 +260,87 @@ class GeometryGeneratorMPWorker(multiprocessing.Process, GeometryGenerator):
         self.queue_err = queue_err
         self.strict = strict
         self.handbrake = handbrake
+        self.status_conn = status_conn
+        self.busy_since = busy_since
+        self.stats_queue = stats_queue
+        self.embed_failures = collections.Counter()
         if self.strict:
             self._success_cutoff = 0
         else:
             self._success_cutoff = -1
 
+    def _put(self, kind: str, packet):
+        """push the packet to the output ("out") or error ("err") queue;
+        with a status connection the packet is sent through it (and
+        forwarded by the watchdog), so when the worker returns nothing is left
+        in the buffers of the queue feeder threads, that would be lost (or
+        leave the queue locked) if the worker is killed"""
+        if self.status_conn is not None:
+            self.status_conn.send((kind, packet))
+        elif kind == "out":
+            self.queue_out.put(packet, block=True)
+        else:
+            self.queue_err.put(packet, block=True)
+
+    def _count_embed_failures(self, failure_counts: dict):
+        """count the causes of an embedding failure"""
+        if self.status_conn is not None:
+            self.status_conn.send(("embed", failure_counts))
+        else:
+            self.embed_failures.update(failure_counts)
+
+    def _exit(self):
+        """send the statistics and the poison pill for the writers"""
+        if self.stats_queue is not None:
+            self.stats_queue.put(dict(self.embed_failures))
+        self._put("out", None)
+
     def run(self):
         """overload of multiprocessing run method"""
         while True:
             try:
                 if self.handbrake.is_set():
                     # print("WORKER__NAME: trying to exit gracefully...")
-                    self.queue_out.put(None, block=True)
+                    self._exit()
                     break
                 mol = self.queue_in.get()
                 if mol is None: # or self.handbrake.is_set():
                     # print("FOUND POISON PILL INGEOMETRY")
-                    self.queue_out.put(None, block=True)
+                    self._exit()
                     break
                 # print("MOL", mol.GetPropsAsDict())
+                if self.status_conn is not None:
+                    self.status_conn.send(("mol", mol))
+                    with self.busy_since.get_lock():
+                        self.busy_since.value = time.time()
                 report = self.process(mol)
+                if self.status_conn is not None:
+                    # the watchdog holds the lock while killing a worker, and
+                    # kills only busy workers: nothing is sent while busy
+                    with self.busy_since.get_lock():
+                        self.busy_since.value = 0.0
+                if mol.HasProp(ReorderBuffer.TAG_PROP):
+                    # private properties are not copied with the others
+                    report["mol"].SetProp(ReorderBuffer.TAG_PROP, mol.GetProp(ReorderBuffer.TAG_PROP))
                 if report["accepted"] > self._success_cutoff:
                     # report["name"] = mol_name
-                    self.queue_out.put(report, block=True)
+                    self._put("out", report)
                 else:
+                    if "embed_failures" in report:
+                        self._count_embed_failures(report["embed_failures"])
+                    tombstone = ReorderBuffer.tombstone(mol, "geom_" + report['state'])
+                    if not tombstone is None:
+                        self._put("out", tombstone)
                     if self.queue_err is None:
                         continue
-                    self.queue_err.put( ("geom_" + report['state'], report['mol']), block=True)
+                    self._put("err", ("geom_" + report['state'], report['mol']))
                             # , report['mol'].GetProp("_Name")) )
                 # except:
                 #     print("PROBLEMATIC MOLECULE captured...")
                 #     continue
             except KeyboardInterrupt:
                 # print("[geom] Caught Ctrl-C...")
-                self.queue_out.put(None, block=True)
+                self._exit()
                 return
         return
 
@@ -275,6 +356,12 @@ class ParallelGeometryGenerator():
          strict     : flag to define which molecules are accepted; if True,
                       only converged molecules are accepted, otherwise any minimized
                       molecule is accepted
+         timeout    : max time (seconds) allowed to process a molecule; workers
+                      exceeding it are killed and replaced, and the molecule is
+                      sent to the error queue ("geom_timeout")
+
+    After join(), `embed_failures` contains the causes of the 3D embedding
+    failures counted by all the workers.
     """
 
     def __init__(
@@ -296,6 +383,7 @@ class ParallelGeometryGenerator():
         nice_level: int = None,
         handbrake: multiprocessing.Event = None,
         strict: bool = False,
+        timeout: float = None,
         _stop_at_defaults=False,
     ):
         self.queue_in = queue_in
@@ -314,6 +402,7 @@ class ParallelGeometryGenerator():
         self.nice_level = nice_level
         self.strict = strict
         self.handbrake = handbrake
+        self.timeout = timeout
         if _stop_at_defaults:
             return
         # print("============================= PARELL GEOM")
@@ -343,34 +432,178 @@ class ParallelGeometryGenerator():
             )
         else:
             self._queue_size = self.max_proc
+        # forked workers inherit the compiled patterns
+        precompile()
+        # watchdog data for each worker: [status connection (None when the
+        # worker is done), busy_since, current molecule]
+        self.__status = []
+        self.embed_failures = collections.Counter()
+        # with a watchdog the counts are sent through the status connections
+        self._stats_queue = multiprocessing.Queue() if self.timeout is None else None
         for i in range(self.max_proc):
-            w = GeometryGeneratorMPWorker(
-                queue_in = self.queue_in,
-                queue_out = self.queue_out,
-                queue_err = self.queue_err,
-                nice_level = self.nice_level,
-                strict = self.strict,
-                add_h = self.add_h,
-                force_trans_amide = self.force_trans_amide,
-                force_field = self.force_field,
-                max_iterations = self.max_iterations,
-                auto_iter_cycles = self.auto_iter_cycles,
-                gen3d = self.gen3d,
-                gen3d_max_attempts = self.gen3d_max_attempts,
-                fix_ring_corners = self.fix_ring_corners,
-                preserve_mol_properties = self.preserve_mol_properties,
-                handbrake = self.handbrake,
-            )
-            self.__workers.append(w)
-            # w.daemon = True
-            w.start()
+            self.__workers.append(None)
+            self.__status.append(None)
+            self._start_worker(i, self.nice_level)
         print("[ %d geometry workers initialized ]" % len(self.__workers))
+        self.timed_out = 0
+        # packets received by the watchdog, waiting for space in the queues
+        self._pending = collections.deque()
+        if self.timeout is not None:
+            self._watchdog = threading.Thread(target=self._watchdog_loop, daemon=True)
+            self._watchdog.start()
+
+    def _start_worker(self, idx, nice_level=None):
+        """start the idx-th worker (or replace it)"""
+        status_conn, busy_since = None, None
+        if self.timeout is not None:
+            parent_conn, status_conn = multiprocessing.Pipe(False)
+            busy_since = multiprocessing.Value("d", 0.0)
+            self.__status[idx] = [parent_conn, busy_since, None]
+        w = GeometryGeneratorMPWorker(
+            queue_in = self.queue_in,
+            queue_out = self.queue_out,
+            queue_err = self.queue_err,
+            nice_level = nice_level,
+            strict = self.strict,
+            add_h = self.add_h,
+            force_trans_amide = self.force_trans_amide,
+            force_field = self.force_field,
+            max_iterations = self.max_iterations,
+            auto_iter_cycles = self.auto_iter_cycles,
+            gen3d = self.gen3d,
+            gen3d_max_attempts = self.gen3d_max_attempts,
+            fix_ring_corners = self.fix_ring_corners,
+            preserve_mol_properties = self.preserve_mol_properties,
+            handbrake = self.handbrake,
+            status_conn = status_conn,
+            busy_since = busy_since,
+            stats_queue = self._stats_queue,
+        )
+        self.__workers[idx] = w
+        # w.daemon = True
+        w.start()
+        if status_conn is not None:
+            # only the worker can write, so the end of the connection (or of
+            # the worker) is detected by the watchdog
+            status_conn.close()
+
+    def _receive(self, idx) -> bool:
+        """receive a packet from the status connection of the idx-th worker:
+        store the molecule being processed, or forward the results to the
+        queues; return False when the worker is done"""
+        status = self.__status[idx]
+        try:
+            kind, packet = status[0].recv()
+        except EOFError:
+            status[0].close()
+            status[0] = None
+            return False
+        if kind == "mol":
+            status[2] = packet
+        elif kind == "embed":
+            self.embed_failures.update(packet)
+        elif kind == "out":
+            self._forward(self.queue_out, packet)
+        else:
+            self._forward(self.queue_err, packet)
+        return True
+
+    def _forward(self, target, packet):
+        """add the packet to the ones waiting to be put in the target queue;
+        sharded queues are resolved to the queue of the shard, so a poison
+        pill broadcast can be resumed without duplicates"""
+        if not isinstance(target, ShardedQueue):
+            self._pending.append((target, packet))
+        elif packet is None:
+            for shard_queue in target.queues:
+                self._pending.append((shard_queue, None))
+        else:
+            self._pending.append((target.queues[target.get_shard(packet)], packet))
+
+    def _drain(self, timeout: float = 0.1) -> bool:
+        """put the pending packets in the queues, waiting at most `timeout`
+        seconds for each; return True if nothing is left"""
+        while self._pending:
+            target, packet = self._pending[0]
+            try:
+                target.put(packet, block=True, timeout=timeout)
+            except queue.Full:
+                return False
+            self._pending.popleft()
+        return True
+
+    def _watchdog_loop(self):
+        """forward the results of the workers to the queues, and check
+        periodically for workers exceeding the time allowed for a single
+        molecule, then kill and replace them; workers send nothing while
+        busy, so killed workers have no pending results.
+
+        Packets are put in the queues with short timeouts, so the checks
+        continue when the queues are full: meanwhile nothing else is received,
+        and the workers wait (not busy) to send their results"""
+        interval = min(1.0, self.timeout / 4.0)
+        while True:
+            conns = {status[0]: idx for idx, status in enumerate(self.__status) if status[0] is not None}
+            if not conns:
+                # all workers are done
+                break
+            if self._drain(timeout=interval / 4.0):
+                for conn in multiprocessing.connection.wait(list(conns), timeout=interval):
+                    self._receive(conns[conn])
+                self._drain(timeout=interval / 4.0)
+            for idx, status in enumerate(self.__status):
+                _, busy_since, _ = status
+                if status[0] is None:
+                    continue
+                with busy_since.get_lock():
+                    started = busy_since.value
+                    if not started or (time.time() - started) < self.timeout:
+                        continue
+                    w = self.__workers[idx]
+                    w.kill()
+                    w.join()
+                # get the results sent before the molecule being processed
+                while self._receive(idx):
+                    pass
+                mol = status[2]
+                self.timed_out += 1
+                print(
+                    "\n[ geometry worker %d killed after %2.1f s: %s ]"
+                    % (idx, time.time() - started, mol.GetProp("_Name") if mol.HasProp("_Name") else "")
+                )
+                tombstone = ReorderBuffer.tombstone(mol, "geom_timeout")
+                if tombstone is not None:
+                    self._forward(self.queue_out, tombstone)
+                if self.queue_err is not None:
+                    self._forward(self.queue_err, ("geom_timeout", mol))
+                # the process is already niced, children inherit the nice level
+                self._start_worker(idx)
+        # nothing else to check (the writers don't read anymore after an
+        # emergency stop)
+        while not self._drain(timeout=interval):
+            if self.handbrake is not None and self.handbrake.is_set():
+                break
 
     def join(self):
         """function to wrap the join functions of the workers """
-        for w in self.__workers:
-            # print("ParallelGeometryGenerator> sub-join:", w)
-            w.join()
+        # workers can be replaced by the watchdog until they're all done
+        while self.is_alive():
+            for w in self.__workers:
+                # print("ParallelGeometryGenerator> sub-join:", w)
+                w.join(timeout=1.0)
+        if self.timeout is not None:
+            # results are forwarded until all the workers are done, including
+            # the ones replaced in the meantime
+            self._watchdog.join()
+            for w in self.__workers:
+                w.join()
+        else:
+            for _ in self.__workers:
+                try:
+                    self.embed_failures.update(self._stats_queue.get(timeout=1.0))
+                except queue.Empty:
+                    # worker terminated
+                    break
 
     @classmethod
     def get_defaults(cls):
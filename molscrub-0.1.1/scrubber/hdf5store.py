@@ -0,0 +1,397 @@
+import json
+
+import numpy as np
+from rdkit import Chem
+from rdkit.Geometry import Point3D
+
+"""
+This file contains the columnar HDF5 store of molecules (.hdf5), for
+downstream stages that read the coordinates and the atom types in bulk
+(e.g., machine learning pipelines); h5py is imported only when a store is
+opened
+
+Molecules are stored as tables (datasets), appended in chunks:
+
+    mols        name, group_id, isomer_id, atom_start, num_atoms, bond_start,
+                num_bonds, coord_start, num_confs, props (JSON)
+    atoms       atomic_num, formal_charge, num_hs, aromatic, chiral_tag,
+                isotope, radicals
+    bonds       begin, end, bond_type, stereo, stereo_begin, stereo_end
+    coords      x, y, z (float32), num_atoms rows per conformer
+
+Atom and bond indices are relative to the molecule; the *_start columns are
+the first row of the molecule in the atoms, bonds and coords tables, so a
+slice of molecules maps to a contiguous slice of each table.
+"""
+
+HDF5_VERSION = 1
+
+MOL_COLUMNS = [
+    ("group_id", "i8"),
+    ("isomer_id", "i4"),
+    ("atom_start", "i8"),
+    ("num_atoms", "i4"),
+    ("bond_start", "i8"),
+    ("num_bonds", "i4"),
+    ("coord_start", "i8"),
+    ("num_confs", "i4"),
+]
+
+ATOM_DTYPE = np.dtype([
+    ("atomic_num", "u1"),
+    ("formal_charge", "i1"),
+    ("num_hs", "u1"),
+    ("aromatic", "u1"),
+    ("chiral_tag", "u1"),
+    ("isotope", "u2"),
+    ("radicals", "u1"),
+])
+
+BOND_DTYPE = np.dtype([
+    ("begin", "i4"),
+    ("end", "i4"),
+    ("bond_type", "u1"),
+    ("stereo", "u1"),
+    ("stereo_begin", "i4"),
+    ("stereo_end", "i4"),
+])
+
+
+def _import_h5py():
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("Reading or writing .hdf5 files requires h5py (pip install h5py)")
+    return h5py
+
+
+class HDF5MolWriter(object):
+    """Write molecules to a columnar HDF5 store; molecules are buffered and
+    appended to the datasets every `chunk_size` molecules, so the datasets
+    are resized once per chunk. The header is any JSON-serializable
+    dictionary (e.g., the options used to generate the molecules).
+
+        >>> with HDF5MolWriter("output.hdf5", header={"ph": 7.4}) as writer:
+        ...     writer.write(mol, group_id=0)
+
+    compression is passed to h5py (e.g., "gzip", "lzf" or None).
+    """
+
+    def __init__(
+        self,
+        fname: str,
+        header: dict = None,
+        chunk_size: int = 10000,
+        compression: str = "gzip",
+    ):
+        h5py = _import_h5py()
+        self.fname = fname
+        self.header = header or {}
+        self.chunk_size = chunk_size
+        self._h5file = h5py.File(fname, "w")
+        self._h5file.attrs["version"] = HDF5_VERSION
+        self._h5file.attrs["header"] = json.dumps(self.header)
+        opts = {"compression": compression}
+        string_dtype = h5py.string_dtype()
+        # about 30 atoms per molecule
+        self._datasets = {
+            "name": self._create("name", string_dtype, (chunk_size,), opts),
+            "props": self._create("props", string_dtype, (chunk_size,), opts),
+            "atoms": self._create("atoms", ATOM_DTYPE, (chunk_size * 32,), opts),
+            "bonds": self._create("bonds", BOND_DTYPE, (chunk_size * 32,), opts),
+            "coords": self._create("coords", "f4", (chunk_size * 32, 3), opts),
+        }
+        for column, dtype in MOL_COLUMNS:
+            self._datasets[column] = self._create(column, dtype, (chunk_size,), opts)
+        self._count = 0
+        self._num_atoms = 0
+        self._num_bonds = 0
+        self._num_coords = 0
+        self._reset_buffers()
+
+    def _create(self, name, dtype, chunks, opts):
+        shape = (0,) + chunks[1:]
+        maxshape = (None,) + chunks[1:]
+        return self._h5file.create_dataset(
+            name, shape, maxshape=maxshape, dtype=dtype, chunks=chunks, **opts
+        )
+
+    def _reset_buffers(self):
+        self._buffers = {name: [] for name in self._datasets}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._count + len(self._buffers["name"])
+
+    def write(self, mol, group_id: int = None, isomer_id: int = 0):
+        """buffer a molecule (with all conformers and public properties);
+        group_id defaults to the position of the molecule"""
+        buf = self._buffers
+        if group_id is None:
+            group_id = len(self)
+        num_atoms = mol.GetNumAtoms()
+        num_bonds = mol.GetNumBonds()
+        num_confs = mol.GetNumConformers()
+        buf["name"].append(mol.GetProp("_Name") if mol.HasProp("_Name") else "")
+        buf["props"].append(json.dumps(mol.GetPropsAsDict(includePrivate=False, includeComputed=False), default=str))
+        buf["group_id"].append(group_id)
+        buf["isomer_id"].append(isomer_id)
+        buf["atom_start"].append(self._num_atoms)
+        buf["num_atoms"].append(num_atoms)
+        buf["bond_start"].append(self._num_bonds)
+        buf["num_bonds"].append(num_bonds)
+        buf["coord_start"].append(self._num_coords)
+        buf["num_confs"].append(num_confs)
+        for atom in mol.GetAtoms():
+            buf["atoms"].append((
+                atom.GetAtomicNum(),
+                atom.GetFormalCharge(),
+                atom.GetTotalNumHs(),
+                atom.GetIsAromatic(),
+                int(atom.GetChiralTag()),
+                atom.GetIsotope(),
+                atom.GetNumRadicalElectrons(),
+            ))
+        for bond in mol.GetBonds():
+            stereo_atoms = list(bond.GetStereoAtoms()) or [-1, -1]
+            buf["bonds"].append((
+                bond.GetBeginAtomIdx(),
+                bond.GetEndAtomIdx(),
+                int(bond.GetBondType()),
+                int(bond.GetStereo()),
+                stereo_atoms[0],
+                stereo_atoms[1],
+            ))
+        for conf in mol.GetConformers():
+            buf["coords"].append(conf.GetPositions().astype(np.float32))
+        self._num_atoms += num_atoms
+        self._num_bonds += num_bonds
+        self._num_coords += num_atoms * num_confs
+        if len(buf["name"]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """append the buffered molecules to the datasets"""
+        buf = self._buffers
+        if not buf["name"]:
+            return
+        arrays = {
+            "name": np.array(buf["name"], dtype=object),
+            "props": np.array(buf["props"], dtype=object),
+            "atoms": np.array(buf["atoms"], dtype=ATOM_DTYPE),
+            "bonds": np.array(buf["bonds"], dtype=BOND_DTYPE),
+            "coords": (
+                np.concatenate(buf["coords"]) if buf["coords"] else np.zeros((0, 3), dtype=np.float32)
+            ),
+        }
+        for column, dtype in MOL_COLUMNS:
+            arrays[column] = np.array(buf[column], dtype=dtype)
+        for name, data in arrays.items():
+            if not len(data):
+                continue
+            dataset = self._datasets[name]
+            size = dataset.shape[0]
+            dataset.resize(size + len(data), axis=0)
+            dataset[size:] = data
+        self._count += len(buf["name"])
+        self._reset_buffers()
+        self._h5file.flush()
+
+    def close(self):
+        if self._h5file is None:
+            return
+        self.flush()
+        self._h5file.close()
+        self._h5file = None
+
+
+class HDF5MolReader(object):
+    """Read molecules from a columnar HDF5 store, as RDKit molecules (one at
+    a time, by position or slice, or as a molecule supplier) or as arrays
+    (the columns of the mols table, the coordinates).
+
+        >>> reader = HDF5MolReader("output.hdf5")
+        >>> table = reader.read_table(0, 1000)
+        >>> table["name"], table["num_atoms"]
+        >>> coords = reader.coordinates(5)  # (num_confs, num_atoms, 3)
+        >>> mols = reader[1000:2000]
+        >>> for mol in reader:
+        ...     pass
+
+    Each read of a slice of molecules reads a contiguous slice of each
+    table; iteration reads `block_size` molecules at a time.
+    """
+
+    def __init__(self, fname: str, block_size: int = 1000):
+        h5py = _import_h5py()
+        self.fname = fname
+        self.block_size = block_size
+        self._h5file = h5py.File(fname, "r")
+        version = int(self._h5file.attrs.get("version", 0))
+        if not 0 < version <= HDF5_VERSION:
+            raise ValueError(
+                "File [%s] is not a molecule store (version %d, supported up to %d)"
+                % (fname, version, HDF5_VERSION)
+            )
+        self.header = json.loads(self._h5file.attrs["header"])
+        self._count = self._h5file["name"].shape[0]
+        self._block = []
+        self._block_start = 0
+        self._next = 0
+
+    def __len__(self):
+        return self._count
+
+    def read_table(self, start: int = 0, stop: int = None) -> dict:
+        """return the columns of the mols table (numpy arrays; name and props
+        as lists of str) for the molecules in [start, stop)"""
+        if stop is None:
+            stop = self._count
+        table = {column: self._h5file[column][start:stop] for column, _ in MOL_COLUMNS}
+        table["name"] = list(self._h5file["name"].asstr()[start:stop])
+        table["props"] = list(self._h5file["props"].asstr()[start:stop])
+        return table
+
+    @property
+    def names(self) -> list:
+        return list(self._h5file["name"].asstr()[:])
+
+    def coordinates(self, idx: int):
+        """return the coordinates of the conformers of the molecule at the
+        specified position, as a (num_confs, num_atoms, 3) float32 array"""
+        start = int(self._h5file["coord_start"][idx])
+        num_atoms = int(self._h5file["num_atoms"][idx])
+        num_confs = int(self._h5file["num_confs"][idx])
+        coords = self._h5file["coords"][start : start + num_atoms * num_confs]
+        return coords.reshape((num_confs, num_atoms, 3))
+
+    def read_mols(self, start: int, stop: int) -> list:
+        """return the molecules in [start, stop)"""
+        stop = min(stop, self._count)
+        if start >= stop:
+            return []
+        table = self.read_table(start, stop)
+        atom_offset = int(table["atom_start"][0])
+        bond_offset = int(table["bond_start"][0])
+        coord_offset = int(table["coord_start"][0])
+        last = len(table["name"]) - 1
+        atoms = self._h5file["atoms"][
+            atom_offset : int(table["atom_start"][last]) + int(table["num_atoms"][last])
+        ]
+        bonds = self._h5file["bonds"][
+            bond_offset : int(table["bond_start"][last]) + int(table["num_bonds"][last])
+        ]
+        coords = self._h5file["coords"][
+            coord_offset : int(table["coord_start"][last])
+            + int(table["num_atoms"][last]) * int(table["num_confs"][last])
+        ]
+        mols = []
+        for i in range(len(table["name"])):
+            a = int(table["atom_start"][i]) - atom_offset
+            b = int(table["bond_start"][i]) - bond_offset
+            c = int(table["coord_start"][i]) - coord_offset
+            num_atoms = int(table["num_atoms"][i])
+            num_confs = int(table["num_confs"][i])
+            mol = self._build_mol(
+                atoms[a : a + num_atoms],
+                bonds[b : b + int(table["num_bonds"][i])],
+                coords[c : c + num_atoms * num_confs].reshape((num_confs, num_atoms, 3)),
+            )
+            mol.SetProp("_Name", table["name"][i])
+            self._set_props(mol, json.loads(table["props"][i]))
+            mols.append(mol)
+        return mols
+
+    @staticmethod
+    def _build_mol(atoms, bonds, coords):
+        rwmol = Chem.RWMol()
+        for row in atoms:
+            atom = Chem.Atom(int(row["atomic_num"]))
+            atom.SetFormalCharge(int(row["formal_charge"]))
+            atom.SetNumExplicitHs(int(row["num_hs"]))
+            atom.SetNoImplicit(True)
+            atom.SetIsAromatic(bool(row["aromatic"]))
+            atom.SetChiralTag(Chem.ChiralType.values[int(row["chiral_tag"])])
+            atom.SetIsotope(int(row["isotope"]))
+            atom.SetNumRadicalElectrons(int(row["radicals"]))
+            rwmol.AddAtom(atom)
+        # bonds are added in the original order, so the chiral tags (relative
+        # to the order of the bonds of each atom) are preserved
+        for row in bonds:
+            bond_type = Chem.BondType.values[int(row["bond_type"])]
+            rwmol.AddBond(int(row["begin"]), int(row["end"]), bond_type)
+            bond = rwmol.GetBondWithIdx(rwmol.GetNumBonds() - 1)
+            if bond_type == Chem.BondType.AROMATIC:
+                bond.SetIsAromatic(True)
+            if row["stereo_begin"] >= 0:
+                bond.SetStereoAtoms(int(row["stereo_begin"]), int(row["stereo_end"]))
+                bond.SetStereo(Chem.BondStereo.values[int(row["stereo"])])
+        for positions in coords:
+            conf = Chem.Conformer(len(atoms))
+            for i, xyz in enumerate(positions.tolist()):
+                conf.SetAtomPosition(i, Point3D(*xyz))
+            conf.Set3D(True)
+            rwmol.AddConformer(conf, assignId=True)
+        mol = rwmol.GetMol()
+        Chem.SanitizeMol(mol)
+        return mol
+
+    @staticmethod
+    def _set_props(mol, props: dict):
+        for key, value in props.items():
+            if isinstance(value, bool):
+                mol.SetBoolProp(key, value)
+            elif isinstance(value, int):
+                mol.SetIntProp(key, value)
+            elif isinstance(value, float):
+                mol.SetDoubleProp(key, value)
+            else:
+                mol.SetProp(key, str(value))
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self._count)
+            if step != 1:
+                return self.read_mols(start, stop)[::step] if stop > start else []
+            return self.read_mols(start, stop)
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError("hdf5 index out of range")
+        return self.read_mols(idx, idx + 1)[0]
+
+    def __iter__(self):
+        return self
+
+    def reset(self):
+        self.seek(0)
+
+    def tell(self) -> int:
+        """return the position of the next molecule to be read"""
+        return self._next
+
+    def seek(self, idx: int):
+        self._next = idx
+        self._block = []
+        self._block_start = idx
+
+    def __next__(self):
+        if self._h5file is None or self._next >= self._count:
+            raise StopIteration
+        i = self._next - self._block_start
+        if not 0 <= i < len(self._block):
+            self._block = self.read_mols(self._next, self._next + self.block_size)
+            self._block_start = self._next
+            i = 0
+        self._next += 1
+        return self._block[i]
+
+    def close(self):
+        if self._h5file is not None:
+            self._h5file.close()
+            self._h5file = None
@@ -0,0 +1,224 @@
+import array
+import json
+import os
+import struct
+
+from rdkit import Chem
+
+"""
+This file contains the binary container of molecules (.molbin), used to pass
+the output to downstream stages without writing and parsing text formats
+
+Molecules are stored as length-prefixed RDKit binary molecules, with all the
+properties (including private ones) and all the conformers:
+
+    header      magic | version | header size | header (JSON, e.g. scrub options)
+    records     size (uint32) | RDKit binary molecule
+    index       offset of each record (uint64) | names size (uint64) | names (JSON)
+    trailer     index offset | record count | end magic
+
+The index and the trailer are written when the writer is closed; files
+without them (e.g., interrupted runs) can still be read, the records are
+scanned to rebuild the index.
+"""
+
+MOLBIN_MAGIC = b"SCRUBMOL"
+MOLBIN_END = b"SCRUBEND"
+MOLBIN_VERSION = 1
+MOLBIN_HEADER = struct.Struct("<8sII")
+MOLBIN_RECORD = struct.Struct("<I")
+MOLBIN_TRAILER = struct.Struct("<QQ8s")
+MOLBIN_OFFSET = struct.Struct("<Q")
+
+
+class MolbinWriter(object):
+    """Write molecules to a .molbin file; the header is any JSON-serializable
+    dictionary (e.g., the options used to generate the molecules).
+
+        >>> with MolbinWriter("output.molbin", header={"ph": 7.4}) as writer:
+        ...     writer.write(mol)
+    """
+
+    def __init__(self, fname: str, header: dict = None):
+        self.fname = fname
+        self.header = header or {}
+        self._fp = open(fname, "wb")
+        header_data = json.dumps(self.header).encode()
+        self._fp.write(MOLBIN_HEADER.pack(MOLBIN_MAGIC, MOLBIN_VERSION, len(header_data)))
+        self._fp.write(header_data)
+        self._offset = MOLBIN_HEADER.size + len(header_data)
+        self._offsets = array.array("Q")
+        self._names = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def write(self, mol):
+        """append a molecule (with all properties and conformers)"""
+        data = mol.ToBinary(Chem.PropertyPickleOptions.AllProps)
+        self._offsets.append(self._offset)
+        self._names.append(mol.GetProp("_Name") if mol.HasProp("_Name") else "")
+        self._fp.write(MOLBIN_RECORD.pack(len(data)))
+        self._fp.write(data)
+        self._offset += MOLBIN_RECORD.size + len(data)
+
+    def flush(self):
+        self._fp.flush()
+
+    def tell(self) -> int:
+        return self._offset
+
+    def close(self):
+        """write the index and the trailer"""
+        if self._fp is None:
+            return
+        self._fp.write(self._offsets.tobytes())
+        names_data = json.dumps(self._names).encode()
+        self._fp.write(MOLBIN_OFFSET.pack(len(names_data)))
+        self._fp.write(names_data)
+        self._fp.write(MOLBIN_TRAILER.pack(self._offset, len(self._offsets), MOLBIN_END))
+        self._fp.close()
+        self._fp = None
+
+
+class MolbinReader(object):
+    """Read molecules from a .molbin file, sequentially (as a molecule
+    supplier, with `tell()` and `seek()` to the offset of a record) or by
+    position and name in constant time.
+
+        >>> reader = MolbinReader("output.molbin")
+        >>> reader.header
+        {'ph': 7.4}
+        >>> mol = reader[1000]
+        >>> isomers = reader.get("ZINC000001")
+        >>> for mol in reader:
+        ...     pass
+    """
+
+    def __init__(self, fname: str, start_offset: int = None, end_offset: int = None):
+        self.fname = fname
+        self._fp = open(fname, "rb")
+        magic, version, header_size = MOLBIN_HEADER.unpack(self._fp.read(MOLBIN_HEADER.size))
+        if magic != MOLBIN_MAGIC:
+            raise ValueError("File [%s] is not a valid molbin file" % fname)
+        if version > MOLBIN_VERSION:
+            raise ValueError(
+                "File [%s] has version %d, supported up to %d" % (fname, version, MOLBIN_VERSION)
+            )
+        self.header = json.loads(self._fp.read(header_size))
+        self.data_offset = MOLBIN_HEADER.size + header_size
+        self._offsets = None
+        self._names = None
+        if not self._read_trailer():
+            # incomplete file
+            self._scan()
+        self.end_offset = self._data_end if end_offset is None else min(end_offset, self._data_end)
+        self.seek(self.data_offset if start_offset is None else start_offset)
+
+    def _read_trailer(self) -> bool:
+        size = os.path.getsize(self.fname)
+        if size < self.data_offset + MOLBIN_TRAILER.size:
+            return False
+        self._fp.seek(size - MOLBIN_TRAILER.size)
+        self._data_end, self._count, magic = MOLBIN_TRAILER.unpack(self._fp.read(MOLBIN_TRAILER.size))
+        return magic == MOLBIN_END
+
+    def _scan(self):
+        """rebuild the offsets of the records of an incomplete file"""
+        size = os.path.getsize(self.fname)
+        self._offsets = array.array("Q")
+        offset = self.data_offset
+        self._fp.seek(offset)
+        while offset + MOLBIN_RECORD.size <= size:
+            (record_size,) = MOLBIN_RECORD.unpack(self._fp.read(MOLBIN_RECORD.size))
+            if offset + MOLBIN_RECORD.size + record_size > size:
+                break
+            self._offsets.append(offset)
+            offset += MOLBIN_RECORD.size + record_size
+            self._fp.seek(offset)
+        self._data_end = offset
+        self._count = len(self._offsets)
+
+    def __len__(self):
+        return self._count
+
+    def offset(self, idx: int) -> int:
+        """return the offset of the record at the specified position"""
+        if self._offsets is not None:
+            return self._offsets[idx]
+        self._fp.seek(self._data_end + idx * MOLBIN_OFFSET.size)
+        return MOLBIN_OFFSET.unpack(self._fp.read(MOLBIN_OFFSET.size))[0]
+
+    def _read_at(self, offset: int):
+        """return the molecule of the record at the offset, and the offset of
+        the next record"""
+        self._fp.seek(offset)
+        (record_size,) = MOLBIN_RECORD.unpack(self._fp.read(MOLBIN_RECORD.size))
+        mol = Chem.Mol(self._fp.read(record_size))
+        return mol, offset + MOLBIN_RECORD.size + record_size
+
+    def __getitem__(self, idx: int):
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError("molbin index out of range")
+        return self._read_at(self.offset(idx))[0]
+
+    def _load_names(self):
+        if self._offsets is not None:
+            # incomplete file, names are read from the molecules
+            names = []
+            for offset in self._offsets:
+                mol = self._read_at(offset)[0]
+                names.append(mol.GetProp("_Name") if mol.HasProp("_Name") else "")
+        else:
+            self._fp.seek(self._data_end + self._count * MOLBIN_OFFSET.size)
+            (names_size,) = MOLBIN_OFFSET.unpack(self._fp.read(MOLBIN_OFFSET.size))
+            names = json.loads(self._fp.read(names_size))
+        self._names = {}
+        for idx, name in enumerate(names):
+            self._names.setdefault(name, []).append(idx)
+
+    def index_of(self, name: str) -> list:
+        """return the positions of the molecules with the specified name"""
+        if self._names is None:
+            self._load_names()
+        return self._names.get(name, [])
+
+    def get(self, name: str) -> list:
+        """return the molecules with the specified name"""
+        return [self[idx] for idx in self.index_of(name)]
+
+    def __iter__(self):
+        return self
+
+    def reset(self):
+        self.seek(self.data_offset)
+
+    def tell(self) -> int:
+        """return the offset of the next record to be read"""
+        return self._next_offset
+
+    def seek(self, offset: int):
+        """move to the record starting at the specified offset"""
+        self._next_offset = offset
+
+    def __next__(self):
+        if self._fp is None or self._next_offset >= self.end_offset:
+            raise StopIteration
+        mol, self._next_offset = self._read_at(self._next_offset)
+        return mol
+
+    def _close_fp(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def close(self):
+        self._close_fp()
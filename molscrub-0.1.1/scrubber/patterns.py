@@ -0,0 +1,62 @@
+from rdkit import Chem
+from rdkit.Chem import rdChemReactions
+
+"""
+This file contains the registry of the SMARTS patterns and reactions used in
+the package
+
+Patterns and reactions are compiled only once per process, the first time they
+are requested, and then reused; call `precompile()` before starting worker
+processes (e.g., multiprocessing with fork) so they inherit the compiled
+patterns instead of compiling them again.
+
+    >>> from scrubber.patterns import get_smarts
+    >>> mol.GetSubstructMatches(get_smarts("amide"))
+    >>> mol.GetSubstructMatches(get_smarts("[#6]=[#8]"))  # any SMARTS
+"""
+
+# named patterns used in the package
+SMARTS = {
+    # does NOT match 2-Pyridone (intentionally)
+    "amide": "[OX1,SX1]=[CX3][NX3]",
+    # amides (and amidines, thioamides) excluded from ring flips
+    "amide_ringfix": "[NX3]-[CX3]=[O,N,SX1]",
+    "ring6": "[*]1[*][*][*][*][*]1",
+    "anomeric": "[*]-[OX2,SX2]-[CX4]-[OX2,SX2,#9,#17,#35,#53]",
+    "secondary_amide": "[H][NX3;R0]([!#1])[CX3;R0](=[OX1])[#6]",
+    # source: http://www.rdkit.org/docs/Cookbook.html#neutralizing-molecules
+    "neutralize": "[+1!h0!$([*]~[-1,-2,-3,-4]),-1!$([*]~[+1,+2,+3,+4])]",
+    "aromatic": "[a]",
+}
+
+_smarts_cache = {}
+_reactions_cache = {}
+
+
+def get_smarts(smarts: str) -> Chem.Mol:
+    """return the compiled query of a named pattern or of a SMARTS string"""
+    pattern = _smarts_cache.get(smarts)
+    if pattern is None:
+        pattern = Chem.MolFromSmarts(SMARTS.get(smarts, smarts))
+        if pattern is None:
+            raise ValueError("Invalid SMARTS pattern [%s]" % smarts)
+        _smarts_cache[smarts] = pattern
+    return pattern
+
+
+def get_reaction(smarts: str) -> rdChemReactions.ChemicalReaction:
+    """return the compiled reaction of a reaction SMARTS string"""
+    rxn = _reactions_cache.get(smarts)
+    if rxn is None:
+        rxn = rdChemReactions.ReactionFromSmarts(smarts)
+        rxn.Initialize()
+        _reactions_cache[smarts] = rxn
+    return rxn
+
+
+def precompile(extra_smarts: list = None):
+    """compile all the named patterns (and optional extra SMARTS)"""
+    for name in SMARTS:
+        get_smarts(name)
+    for smarts in extra_smarts or []:
+        get_smarts(smarts)
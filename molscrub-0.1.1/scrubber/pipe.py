@@ -0,0 +1,194 @@
+import json
+import os
+import struct
+import sys
+
+from rdkit import Chem
+
+"""
+This file contains the streaming protocol used to chain processes through
+pipes (e.g. scrub.py input.smi -o - | scrub.py - -o output.sdf), on the same
+host or across hosts (ssh, netcat)
+
+The stream starts with a magic string and the protocol version, followed by
+length-prefixed frames:
+
+    stream      magic | version
+    frame       type (1 byte) | payload size (uint32) | payload
+
+    H   header, JSON (e.g. the options of the upstream process)
+    M   molecule, RDKit binary with all properties and conformers
+    E   end of stream, JSON with the number of molecules
+
+Frames are read and written one at a time, so memory use doesn't depend on
+the size of the stream; writes block when the pipe is full (the reader is
+slower), so the writer is slowed down instead of buffering (backpressure).
+A stream without the end frame has been truncated (e.g. the upstream
+process failed) and raises an error. Unknown frame types are skipped.
+"""
+
+PIPE_MAGIC = b"SCRUBPIP"
+PIPE_VERSION = 1
+PIPE_HEADER = struct.Struct("<8sI")
+PIPE_FRAME = struct.Struct("<cI")
+
+FRAME_HEADER = b"H"
+FRAME_MOL = b"M"
+FRAME_END = b"E"
+
+_stdout_fp = None
+
+
+def claim_stdout():
+    """return a binary file object writing to the standard output, and
+    redirect the standard output to the standard error, so that printing
+    (e.g. progress reports, also by child processes) doesn't corrupt the
+    stream; later calls return the same file object"""
+    global _stdout_fp
+    if _stdout_fp is None:
+        sys.stdout.flush()
+        _stdout_fp = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return _stdout_fp
+
+
+class PipeMolWriter(object):
+    """Write molecules to a framed stream (default: the standard output).
+
+        >>> with PipeMolWriter(header={"ph": 7.4}) as writer:
+        ...     writer.write(mol)
+
+    The standard output is claimed (see claim_stdout) when the writer is
+    created, so anything printed afterwards goes to the standard error; the
+    stream starts when the first frame is written, so the writer can be
+    created in a process and used in a child process (e.g. by
+    MoleculeStorage). Frames are flushed every `flush_every` molecules.
+
+    The end of the stream is written only when the writer is closed without
+    errors, so readers can tell an interrupted stream from a complete one.
+    """
+
+    def __init__(self, fp=None, header: dict = None, flush_every: int = 64):
+        self.fp = claim_stdout() if fp is None else fp
+        self.header = header
+        self.flush_every = flush_every
+        self._count = 0
+        self._started = False
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self.close(aborted=not exc_type is None)
+
+    def _write_frame(self, frame_type: bytes, payload: bytes):
+        if not self._started:
+            self._started = True
+            self.fp.write(PIPE_HEADER.pack(PIPE_MAGIC, PIPE_VERSION))
+            if self.header is not None:
+                self._write_frame(FRAME_HEADER, json.dumps(self.header).encode())
+        self.fp.write(PIPE_FRAME.pack(frame_type, len(payload)))
+        self.fp.write(payload)
+
+    def write(self, mol):
+        self._write_frame(FRAME_MOL, mol.ToBinary(Chem.PropertyPickleOptions.AllProps))
+        self._count += 1
+        if self._count % self.flush_every == 0:
+            self.fp.flush()
+
+    def flush(self):
+        if self._started:
+            self.fp.flush()
+
+    def close(self, aborted: bool = False):
+        """write the end of the stream, unless `aborted`"""
+        if self._closed:
+            return
+        self._closed = True
+        if not aborted:
+            self._write_frame(FRAME_END, json.dumps({"count": self._count}).encode())
+        self.fp.flush()
+        self.fp.close()
+
+
+class PipeMolSupplier(object):
+    """Read molecules from a framed stream (default: the standard input),
+    one frame at a time.
+
+        >>> supplier = PipeMolSupplier()
+        >>> for mol in supplier:
+        ...     pass
+        >>> supplier.header
+        {'ph': 7.4}
+    """
+
+    def __init__(self, fp=None):
+        self.fp = sys.stdin.buffer if fp is None else fp
+        self.header = None
+        self._count = 0
+        self._started = False
+        self._ended = False
+
+    def __iter__(self):
+        return self
+
+    def reset(self):
+        # streams can't be rewound
+        pass
+
+    def tell(self) -> int:
+        """return the number of molecules read"""
+        return self._count
+
+    def _read(self, size: int) -> bytes:
+        data = self.fp.read(size)
+        while 0 < len(data) < size:
+            chunk = self.fp.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def _start(self):
+        self._started = True
+        data = self._read(PIPE_HEADER.size)
+        if len(data) < PIPE_HEADER.size:
+            raise EOFError("The input stream is empty or truncated")
+        magic, version = PIPE_HEADER.unpack(data)
+        if magic != PIPE_MAGIC:
+            raise ValueError("The input stream is not a scrubber stream")
+        if version > PIPE_VERSION:
+            raise ValueError("Stream version %d, supported up to %d" % (version, PIPE_VERSION))
+
+    def __next__(self):
+        if not self._started:
+            self._start()
+        while not self._ended:
+            data = self._read(PIPE_FRAME.size)
+            if len(data) < PIPE_FRAME.size:
+                raise EOFError("The input stream is truncated after %d molecules" % self._count)
+            frame_type, size = PIPE_FRAME.unpack(data)
+            payload = self._read(size)
+            if len(payload) < size:
+                raise EOFError("The input stream is truncated after %d molecules" % self._count)
+            if frame_type == FRAME_MOL:
+                self._count += 1
+                return Chem.Mol(payload)
+            elif frame_type == FRAME_HEADER:
+                self.header = json.loads(payload)
+            elif frame_type == FRAME_END:
+                self._ended = True
+                count = json.loads(payload).get("count")
+                if not count is None and count != self._count:
+                    raise EOFError(
+                        "The input stream has %d molecules, %d expected" % (self._count, count)
+                    )
+        raise StopIteration
+
+    def _close_fp(self):
+        pass
+
+    def close(self):
+        if self.fp is not sys.stdin.buffer:
+            self.fp.close()
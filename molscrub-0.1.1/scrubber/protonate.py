@@ -1,9 +1,9 @@
 import pathlib
 from .common import UniqueMoleculeContainer
 from .common import DATA_PATH
+from .patterns import get_smarts
+from .patterns import get_reaction
 from rdkit import Chem
-from rdkit.Chem import AllChem
-from rdkit.Chem import rdChemReactions
 
 datapath = pathlib.Path(DATA_PATH) # convert from str to Path
 default_tautomers_fn = datapath / "tautomers.txt"
@@ -64,8 +64,8 @@ class AcidBaseConjugator:
                 r = {}
                 r["name"] = name
                 r["pka"] = float(pka)
-                r["rxn_lose_h"] = AllChem.ReactionFromSmarts("%s >> %s" % (rxn_left, rxn_right))
-                r["rxn_gain_h"] = AllChem.ReactionFromSmarts("%s >> %s" % (rxn_right, rxn_left))
+                r["rxn_lose_h"] = get_reaction("%s >> %s" % (rxn_left, rxn_right))
+                r["rxn_gain_h"] = get_reaction("%s >> %s" % (rxn_right, rxn_left))
                 reactions.append(r)
         return reactions
 
@@ -102,7 +102,7 @@ class Tautomerizer:
         # count occurences of each SMARTS
         smarts_count = [[0]*len(tautomers) for _ in self.keepmax_smarts]
         for i, smarts in enumerate(self.keepmax_smarts):
-            smarts_mol = Chem.MolFromSmarts(smarts["smarts"])
+            smarts_mol = get_smarts(smarts["smarts"])
             for j, mol in enumerate(tautomers):
                 smarts_count[i][j] = len(mol.GetSubstructMatches(smarts_mol))
     
@@ -136,7 +136,7 @@ class Tautomerizer:
                     keepmax_smarts.append({"smarts": smarts, "name": name, "fn": fn})
                 else:
                     smirks, name = line.split()
-                    reactions.append({"rxn": rdChemReactions.ReactionFromSmarts(smirks), "name": name})
+                    reactions.append({"rxn": get_reaction(smirks), "name": name})
         return reactions, keepmax_smarts
             
 
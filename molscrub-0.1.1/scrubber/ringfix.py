@@ -2,6 +2,8 @@ import numpy as np
 import math
 from rdkit import Chem
 
+from .patterns import get_smarts
+
 def norm(v):
     return v / np.sqrt(np.dot(v, v))
 
@@ -143,8 +145,7 @@ def calc_axial_likeliness_old(ringinfo, substituents, coords):
     return axial_likeliness
 
 def calc_anomeric_penalty(mol, substituents, coords):
-    pattern = Chem.MolFromSmarts("[*]-[OX2,SX2]-[CX4]-[OX2,SX2,#9,#17,#35,#53]")
-    matches = mol.GetSubstructMatches(pattern)
+    matches = mol.GetSubstructMatches(get_smarts("anomeric"))
     penalty = 0.
     for i,j,k,l in matches:
         if (
@@ -187,12 +188,10 @@ def calc_axial_likeliness(substituents, coords):
 def fix_rings(mol, coords, debug=False):
     #one_ring_atom_smarts = "[$([R1]),$([R2;x4]);!$([#6;R2;x3]);!$([#6;R1;X3](@=*));!$([#6](=*)(@N))]"
     #smarts = "{s}1{s}{s}{s}{s}{s}1".format(s=one_ring_atom_smarts)
-    ring6_smarts = "[*]1[*][*][*][*][*]1"
-    amide_smarts = "[NX3]-[CX3]=[O,N,SX1]"
-    amide_idxs = mol.GetSubstructMatches(Chem.MolFromSmarts(amide_smarts))
+    amide_idxs = mol.GetSubstructMatches(get_smarts("amide_ringfix"))
     ring6_rot6_idxs = []
     ring6_rot5_idxs = []
-    for idxs in mol.GetSubstructMatches(Chem.MolFromSmarts(ring6_smarts)):
+    for idxs in mol.GetSubstructMatches(get_smarts("ring6")):
         is_bond_rotatable = []
         for i in range(len(idxs)):
             a = idxs[i]
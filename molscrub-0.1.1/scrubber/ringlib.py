@@ -0,0 +1,142 @@
+import os
+import sqlite3
+
+import numpy as np
+from rdkit import Chem
+from rdkit.Geometry import Point3D
+
+"""
+This file contains the library of ring-system conformers used to seed the 3D
+embedding of molecules containing ring systems already seen
+
+Ring systems (rings sharing atoms) are identified by the canonical SMILES of
+their atoms; the coordinates of the ring atoms of the final conformer of the
+first molecule containing a ring system are stored in a SQLite database, in
+canonical atom order, and used as coordinate map (coordMap) by ETKDG for the
+following molecules. Aromatic ring systems are skipped, since they are
+embedded reliably.
+"""
+
+
+class RingConformerLibrary(object):
+    """Persistent library of ring-system conformers.
+
+        >>> ring_library = RingConformerLibrary("rings.sqlite")
+        >>> scrub = Scrub(ph_low=7.4, ring_library=ring_library)
+
+    As for ScrubCache, the database uses write-ahead logging and each process
+    opens its own connection, so the library can be shared by the workers of
+    Scrub.stream(). Entries found in the database are also kept in memory.
+    With `read_only`, new ring systems are not stored.
+    """
+
+    def __init__(self, fname: str, read_only: bool = False, timeout: float = 60.0):
+        self.fname = fname
+        self.read_only = read_only
+        self.timeout = timeout
+        self.seeded = 0
+        self.added = 0
+        self._coords = {}
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        # connections can't be shared by processes
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        return state
+
+    def _connect(self) -> sqlite3.Connection:
+        """return the connection of the current process"""
+        if self._pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.fname, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS ring_systems ("
+            "smiles TEXT PRIMARY KEY, num_atoms INTEGER, coords BLOB)"
+        )
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    @staticmethod
+    def get_ring_systems(mol) -> list:
+        """return the atom indices of the ring systems, largest first"""
+        systems = []
+        for ring in mol.GetRingInfo().AtomRings():
+            ring = set(ring)
+            for system in [s for s in systems if s & ring]:
+                ring |= system
+                systems.remove(system)
+            systems.append(ring)
+        return sorted((sorted(s) for s in systems), key=len, reverse=True)
+
+    @staticmethod
+    def canonical_ring_system(mol, atoms: list):
+        """return the canonical SMILES of the ring system and its atom
+        indices in canonical order"""
+        smiles = Chem.MolFragmentToSmiles(mol, atomsToUse=atoms, canonical=True)
+        order = mol.GetProp("_smilesAtomOutputOrder").strip("[]").split(",")
+        return smiles, [int(i) for i in order if i]
+
+    def _lookup(self, smiles: str):
+        if smiles in self._coords:
+            return self._coords[smiles]
+        row = self._connect().execute(
+            "SELECT num_atoms, coords FROM ring_systems WHERE smiles=?", (smiles,)
+        ).fetchone()
+        if row is None:
+            # not memorized, other processes may add it
+            return None
+        coords = np.frombuffer(row[1], dtype=np.float64).reshape((row[0], 3))
+        self._coords[smiles] = coords
+        return coords
+
+    def get_coord_map(self, mol) -> dict:
+        """return the coordinate map (atom index: Point3D) of the largest ring
+        system of the molecule found in the library, or None; ring systems
+        can't be combined, since the coordinate map also fixes the distances
+        between them"""
+        for atoms in self.get_ring_systems(mol):
+            if all(mol.GetAtomWithIdx(i).GetIsAromatic() for i in atoms):
+                continue
+            smiles, order = self.canonical_ring_system(mol, atoms)
+            coords = self._lookup(smiles)
+            if coords is None:
+                continue
+            self.seeded += 1
+            return {i: Point3D(*xyz) for i, xyz in zip(order, coords.tolist())}
+        return None
+
+    def add(self, mol, conf_id: int = -1):
+        """store the conformation of the ring systems not in the library"""
+        if self.read_only:
+            return
+        positions = mol.GetConformer(conf_id).GetPositions()
+        for atoms in self.get_ring_systems(mol):
+            if all(mol.GetAtomWithIdx(i).GetIsAromatic() for i in atoms):
+                continue
+            smiles, order = self.canonical_ring_system(mol, atoms)
+            if self._lookup(smiles) is not None:
+                continue
+            coords = np.ascontiguousarray(positions[order], dtype=np.float64)
+            cursor = self._connect().execute(
+                "INSERT OR IGNORE INTO ring_systems (smiles, num_atoms, coords) VALUES (?, ?, ?)",
+                (smiles, len(order), coords.tobytes()),
+            )
+            # another process may have stored it first
+            if cursor.rowcount:
+                self.added += 1
+                self._coords[smiles] = coords
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM ring_systems").fetchone()[0]
@@ -1,20 +1,31 @@
 import sys
-from io import BytesIO
+import hashlib
+import io
 # import cPickle as pickle
 import pickle
 import re
 
 import time
 
-import threading
 import multiprocessing
+import collections
 import queue
 import os
+import shutil
+import tempfile
 import rdkit
 from rdkit import Chem, RDLogger
 from rdkit.Chem.PropertyMol import PropertyMol
 
 from .common import ScrubberBase
+from .fileindex import MoleculeFileIndex
+from .compression import open_compressed, split_compression
+from .molbin import MolbinReader, MolbinWriter
+from .archive import ArchiveMolSupplier, ArchiveWriter, is_archive, split_archive
+from .archive import MANIFEST_EXT, read_manifest
+from .pipe import PipeMolSupplier, PipeMolWriter
+from .database import DatabaseMolSupplier, DatabaseMolWriter, MoleculeDatabase, is_database
+from .database import get_input_id
 
 """ this file contains all the  molecule providers
     - files
@@ -25,7 +36,7 @@ from .common import ScrubberBase
 should be implemented here
 
 """
-VALID_FORMATS = ["smi", "sdf"]
+VALID_FORMATS = ["smi", "sdf", "molbin"]
 
 # TODO implement a non-strict parsing to use molvis-like fixing operations (i.e.: nitro-fixes?)
 
@@ -36,11 +47,16 @@ class MoleculeProvider(ScrubberBase):
 
     - an optional property can be specified to set the molecule name (often the vendor catalog id)
     - if the molecule has no name ("_Name" property), a default ("MOL") will be assigned
+    - if the input file has been indexed (see fileindex.build_index), molecules
+      before `start_count` are skipped without parsing them
+    - compressed files (e.g. .sdf.gz, .smi.zst, see compression) are read
+      while streaming; they can't be indexed
+    - archives of per-ligand files (e.g. .sdf.tar, see archive) are read
+      from the archive or from the manifest (all the archives)
+    - from SQLite databases (.db, .sqlite, see database) the pending input
+      molecules are read
     """
 
-    # TODO add multithreaded mol supplier
-    #  - https://iwatobipen.wordpress.com/2021/05/04/read-sdf-with-multi-thread-rdkit-memo-chemoinformatics/
-    # TODO add gz support (custom func for extension)
     # TODO add desalting method/options
     default_mol_name = "MOL"
 
@@ -48,7 +64,7 @@ class MoleculeProvider(ScrubberBase):
         self,
         fname=None,
         ftype=None,
-        use_pipe: bool = False,  # not yet supported...
+        use_pipe: bool = False,  # read from the standard input (see pipe)
         sanitize: bool = True,
         removeHs: bool = False,
         strictParsing: bool = True,
@@ -62,6 +78,9 @@ class MoleculeProvider(ScrubberBase):
         # use_PropertyMol: bool = True,
         start_count: int = 0,
         end_count: int = -1,
+        start_offset: int = 0,
+        use_index: bool = True,
+        nr_parsers: int = 1,
         quiet=False,
         _stop_at_defaults: bool = False,
     ):
@@ -81,11 +100,17 @@ class MoleculeProvider(ScrubberBase):
         # self.use_PropertyMol = use_PropertyMol
         self.start_count = start_count
         self.end_count = end_count
+        self.start_offset = start_offset
+        self.use_index = use_index
+        self.nr_parsers = nr_parsers
         if _stop_at_defaults:
             return
         self._counter = 0
         self._counter_problematic = 0
         assert self.handbrake
+        if self.fname == "-":
+            self.fname = fname = None
+            self.use_pipe = True
         # self._build_opts_dict()
         if not int(self.fname is not None) + (self.use_pipe) == 1:
             msg = (
@@ -96,22 +121,47 @@ class MoleculeProvider(ScrubberBase):
             raise ValueError(msg)
         # check extension and activate proper source
         if self.use_pipe:
-            self._source = PipeMolSupplier2()
+            self._source = PipeMolSupplier()
         elif fname is not None:
             if not quiet:
                 print("[ storage initialized in FILE MODE ]")
-            _, ext = os.path.splitext(fname)
+            uncompressed_fname, codec = split_compression(fname)
+            _, ext = os.path.splitext(uncompressed_fname)
             ext = ext[1:].lower()
-            if self.ftype is None:
+            if is_archive(fname):
+                self.ftype = "archive"
+                codec = None
+            elif is_database(fname):
+                self.ftype = "database"
+            elif self.ftype is None:
                 self.ftype = ext
-            if not self.ftype in VALID_FORMATS:
+            if self.ftype == "archive":
+                self._source = ArchiveMolSupplier(fname, sanitize=self.sanitize, removeHs=self.removeHs)
+            elif self.ftype == "database":
+                self._source = DatabaseMolSupplier(MoleculeDatabase(fname))
+            elif not self.ftype in VALID_FORMATS:
                 msg = (
                     "Error: the specified format [ %s ] is not valid. "
                     "Allowed values: [ %s ]" % (self.ftype, ",".join(VALID_FORMATS))
                 )
                 raise ValueError(msg)
-            if self.ftype == "sdf":
-                if self.safeparsing:
+            elif self.ftype == "molbin":
+                if codec is not None:
+                    raise ValueError("Compressed molbin files are not supported")
+                self._source = MolbinReader(fname, start_offset=self.start_offset or None)
+            elif self.ftype == "sdf":
+                if self.safeparsing and self.nr_parsers > 1:
+                    self._source = ParallelSDFMolSupplier(
+                        fname,
+                        sanitize=self.sanitize,
+                        removeHs=self.removeHs,
+                        strictParsing=self.strictParsing,
+                        discarded_datafile=self.discarded_datafile,
+                        queue_err=self.queue_err,
+                        start_offset=self.start_offset,
+                        nr_proc=self.nr_parsers,
+                    )
+                elif self.safeparsing:
                     self._source = SDFMolSupplierWrapper(
                         fname,
                         sanitize=self.sanitize,
@@ -119,6 +169,14 @@ class MoleculeProvider(ScrubberBase):
                         strictParsing=self.strictParsing,
                         discarded_datafile=self.discarded_datafile,
                         queue_err=self.queue_err,
+                        start_offset=self.start_offset,
+                    )
+                elif codec is not None:
+                    self._source = Chem.ForwardSDMolSupplier(
+                        open_compressed(fname, "rb"),
+                        sanitize=self.sanitize,
+                        removeHs=self.removeHs,
+                        strictParsing=self.strictParsing,
                     )
                 else:
                     self._source = Chem.SDMolSupplier(
@@ -128,13 +186,27 @@ class MoleculeProvider(ScrubberBase):
                         strictParsing=self.strictParsing,
                     )
             elif self.ftype == "smi":
-                if self.safeparsing:
+                if self.safeparsing and self.nr_parsers > 1:
+                    self._source = ParallelSMIMolSupplier(
+                        fname,
+                        sanitize=self.sanitize,
+                        titleLine=False,
+                        queue_err=self.queue_err,
+                        discarded_input_fname=self.discarded_datafile,
+                        start_offset=self.start_offset,
+                        nr_proc=self.nr_parsers,
+                    )
+                elif self.safeparsing:
                     self._source = SMIMolSupplierWrapper(
                         fname,
                         sanitize=self.sanitize,
                         titleLine=False,
                         queue_err=self.queue_err,
+                        discarded_input_fname=self.discarded_datafile,
+                        start_offset=self.start_offset,
                     )
+                elif codec is not None:
+                    raise ValueError("Compressed SMILES files require safe parsing")
                 else:
                     self._source = Chem.SmilesMolSupplier(
                         fname,
@@ -142,10 +214,48 @@ class MoleculeProvider(ScrubberBase):
                         titleLine=False,
                         discarded_datafile=self.discarded_datafile,
                     )
+            if self.start_offset and not self.safeparsing:
+                raise ValueError("Starting from a byte offset requires safe parsing")
+            if (
+                self.use_index
+                and codec is None
+                and self.safeparsing
+                and self.start_count > 1
+                and not self.start_offset
+            ):
+                self._seek_start_count(quiet)
+
+    def _seek_start_count(self, quiet=False):
+        """jump to the first requested molecule using the byte-offset index of
+        the input file, if available and up to date"""
+        if isinstance(self._source, (ArchiveMolSupplier, DatabaseMolSupplier)):
+            # members are counted while reading
+            return
+        if isinstance(self._source, MolbinReader):
+            # molbin files contain their own index
+            if self.start_count - 1 < len(self._source):
+                self._source.seek(self._source.offset(self.start_count - 1))
+                self._counter = self.start_count - 1
+            return
+        try:
+            index = MoleculeFileIndex.get(self.fname, rebuild=False)
+        except (FileNotFoundError, ValueError):
+            return
+        if self.start_count - 1 <= len(index):
+            self._source.seek(index.offset(self.start_count - 1))
+            self._counter = self.start_count - 1
+            if not quiet:
+                print("[ using index %s to skip %d molecules ]" % (index.index_fname, self._counter))
+        index.close()
 
     def __iter__(self):
         return self
 
+    def tell(self) -> int:
+        """return the byte offset of the next molecule in the input file
+        (requires safe parsing)"""
+        return self._source.tell()
+
     def __next__(self):
         """return the next molecule"""
         # try:
@@ -212,6 +322,433 @@ class MoleculeProvider(ScrubberBase):
             self.pipe_comm.send("err_input:%d" % (self._counter_problematic ))
 
 
+class _SpilledItem(object):
+    """placeholder of a result stored in the spill file"""
+
+    __slots__ = ("offset",)
+
+    def __init__(self, offset):
+        self.offset = offset
+
+
+class ReorderBuffer(object):
+    """Restore the input order of results generated in parallel.
+
+    Each result is pushed with a tag (seq, idx, total): `seq` is the sequence
+    number of the input molecule (starting from 1, no gaps), `idx` is the index
+    of the result among the `total` results generated from that input (e.g.,
+    isomers). Results are released when all the results of the previous inputs
+    have been released; results that have been discarded must be pushed as
+    tombstones (None) to let the buffer move on.
+
+    When more than `max_size` results are held in memory (e.g., a slow
+    molecule is holding up the head), new results are spilled to a temporary
+    file until the head is released, so memory usage stays bounded.
+
+        >>> buff = ReorderBuffer(max_size=1000)
+        >>> for tag, mol in results:
+        ...     for mol in buff.push(tag, mol):
+        ...         writer.write(mol)
+        >>> for mol in buff.flush():
+        ...     writer.write(mol)
+    """
+
+    # private property used to tag molecules sent through the pipeline
+    TAG_PROP = "_scrubber_seq"
+
+    def __init__(self, max_size: int = 10000, tmpdir: str = None):
+        self.max_size = max_size
+        self.tmpdir = tmpdir
+        self._head = 1
+        # seq : [ total, received, {idx: result} ]
+        self._pending = {}
+        self._in_memory = 0
+        self._spill_fp = None
+        self.spilled = 0
+
+    @classmethod
+    def tag_mol(cls, mol, seq: int, idx: int = 0, total: int = 1):
+        """store the tag in a molecule"""
+        mol.SetProp(cls.TAG_PROP, "%d:%d:%d" % (seq, idx, total))
+
+    @classmethod
+    def get_tag(cls, package) -> tuple:
+        """return the tag of a molecule or of a package (report or tombstone);
+        None is returned if the molecule has not been tagged"""
+        if isinstance(package, dict):
+            if package.get("mol") is None:
+                return package.get("tag")
+            package = package["mol"]
+        if not package.HasProp(cls.TAG_PROP):
+            return None
+        return tuple(int(x) for x in package.GetProp(cls.TAG_PROP).split(":"))
+
+    @classmethod
+    def tombstone(cls, mol, error: str = None) -> dict:
+        """return the package to send in place of a tagged molecule that has
+        been discarded, or None if the molecule is not tagged; the input id
+        (see database) and the error are stored for DatabaseMolWriter"""
+        tag = cls.get_tag(mol)
+        if tag is None:
+            return None
+        return {"mol": None, "tag": tag, "input_id": get_input_id(mol), "error": error}
+
+    def __len__(self):
+        """number of inputs waiting to be released"""
+        return len(self._pending)
+
+    def push(self, tag: tuple, result) -> list:
+        """add a result (or a tombstone) and return the list of results that
+        can be released, in order"""
+        seq, idx, total = tag
+        if seq < self._head:
+            raise ValueError("result with sequence %d already released" % seq)
+        entry = self._pending.setdefault(seq, [total, 0, {}])
+        entry[1] += 1
+        if result is not None:
+            if self._in_memory >= self.max_size and seq != self._head:
+                result = self._spill(result)
+            else:
+                self._in_memory += 1
+            entry[2][idx] = result
+        if seq != self._head or entry[1] < total:
+            return []
+        return self._release()
+
+    def flush(self) -> list:
+        """release everything still in the buffer, including inputs that did
+        not receive all their results"""
+        missing = [seq for seq, entry in self._pending.items() if entry[1] < entry[0]]
+        if missing:
+            print(
+                "Warning: %d input molecules with incomplete results (first: %d)"
+                % (len(missing), min(missing))
+            )
+        ready = []
+        for seq in sorted(self._pending):
+            self._head = seq
+            self._pending[seq][1] = self._pending[seq][0]
+            ready.extend(self._release())
+        self._close_spill()
+        return ready
+
+    def _release(self) -> list:
+        """release the results of consecutive inputs complete from the head"""
+        ready = []
+        while self._head in self._pending:
+            total, received, results = self._pending[self._head]
+            if received < total:
+                break
+            del self._pending[self._head]
+            self._head += 1
+            for idx in sorted(results):
+                result = results[idx]
+                if isinstance(result, _SpilledItem):
+                    result = self._unspill(result)
+                else:
+                    self._in_memory -= 1
+                ready.append(result)
+        if not self._pending and self.spilled:
+            # nothing left on disk, the spill file can be recycled
+            self._spill_fp.seek(0)
+            self._spill_fp.truncate()
+        return ready
+
+    def _spill(self, result) -> _SpilledItem:
+        """write the result in the spill file"""
+        if self._spill_fp is None:
+            self._spill_fp = tempfile.TemporaryFile(
+                prefix="scrubber_reorder_", dir=self.tmpdir
+            )
+        self._spill_fp.seek(0, os.SEEK_END)
+        item = _SpilledItem(self._spill_fp.tell())
+        if isinstance(result, Chem.rdchem.Mol):
+            # preserve properties
+            result = PropertyMol(result)
+        pickle.dump(result, self._spill_fp, pickle.HIGHEST_PROTOCOL)
+        self.spilled += 1
+        return item
+
+    def _unspill(self, item: _SpilledItem):
+        """read a result from the spill file"""
+        self._spill_fp.seek(item.offset)
+        return pickle.load(self._spill_fp)
+
+    def _close_spill(self):
+        if self._spill_fp is not None:
+            self._spill_fp.close()
+            self._spill_fp = None
+
+
+class SplitWriter(object):
+    """Write each molecule to its own file (MoleculeStorage "split" mode)
+    without probing the filesystem for every molecule:
+
+    - collision-free names are reserved in an in-memory registry of the
+      files of each directory (the files already present in a directory are
+      listed once, when the directory is first used), adding _v1, _v2, ...
+      to repeated names;
+    - with `fanout` > 0, files are distributed in `fanout` levels of
+      subdirectories named after the hash of the file name (256 per level,
+      e.g. 3f/a2/name.sdf), so directories stay small;
+    - molecules are rendered in memory and written in batches of
+      `batch_size` molecules, each file with a single write; with `sync`,
+      the files of each batch (and their directories) are synced to disk
+      after the batch is written.
+
+        >>> writer = SplitWriter("output", "sdf", fanout=2)
+        >>> writer.write(mol, writer.reserve("mol_1"))
+        >>> writer.close()
+    """
+
+    def __init__(
+        self,
+        basedir: str,
+        ftype: str,
+        fanout: int = 0,
+        batch_size: int = 1000,
+        sync: bool = False,
+        codec: str = None,
+        compression_ext: str = "",
+        compression_level: int = None,
+        compression_threads: int = 1,
+    ):
+        self.basedir = basedir
+        self.ftype = ftype
+        self.fanout = fanout
+        self.batch_size = batch_size
+        self.sync = sync
+        self.codec = codec
+        self.compression_ext = compression_ext
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
+        self._ext = ftype + compression_ext
+        self._registry = {}
+        self._batch = []
+
+    def _get_registry(self, dirname: str) -> set:
+        """return the file names in use in the directory, creating it"""
+        registry = self._registry.get(dirname)
+        if registry is None:
+            os.makedirs(dirname, exist_ok=True)
+            registry = set(os.listdir(dirname))
+            self._registry[dirname] = registry
+        return registry
+
+    def reserve(self, basename: str, subdir: str = None) -> str:
+        """return a collision-free path for the molecule name"""
+        dirname = self.basedir if subdir is None else os.path.join(self.basedir, subdir)
+        if self.fanout > 0:
+            digest = hashlib.md5(basename.encode()).hexdigest()
+            dirname = os.path.join(dirname, *[digest[2 * i : 2 * i + 2] for i in range(self.fanout)])
+        registry = self._get_registry(dirname)
+        fname = "%s.%s" % (basename, self._ext)
+        attempt = 0
+        while fname in registry:
+            attempt += 1
+            fname = "%s_v%d.%s" % (basename, attempt, self._ext)
+        registry.add(fname)
+        return os.path.join(dirname, fname)
+
+    def _render(self, mol):
+        if self.ftype == "molbin":
+            # binary, written by MolbinWriter
+            return mol
+        buff = io.StringIO()
+        if self.ftype == "sdf":
+            writer = Chem.SDWriter(buff)
+        else:
+            writer = Chem.SmilesWriter(buff)
+        writer.write(mol)
+        writer.close()
+        return buff.getvalue()
+
+    def write(self, mol, path: str):
+        """buffer the molecule to be written to the (reserved) path"""
+        self._batch.append((path, self._render(mol)))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """write the buffered molecules"""
+        for path, data in self._batch:
+            if self.ftype == "molbin":
+                with MolbinWriter(path) as writer:
+                    writer.write(data)
+            elif self.codec is None:
+                with open(path, "w") as fp:
+                    fp.write(data)
+            else:
+                with open_compressed(
+                    path,
+                    "wt",
+                    codec=self.codec,
+                    level=self.compression_level,
+                    threads=self.compression_threads,
+                ) as fp:
+                    fp.write(data)
+        if self.sync:
+            self._sync_batch()
+        self._batch = []
+
+    def _sync_batch(self):
+        """sync the files of the batch and the directories where they were
+        created (only the files written by this writer, os.sync() would
+        flush the whole system)"""
+        dirnames = set()
+        for path, _ in self._batch:
+            fd = os.open(path, os.O_RDWR)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            dirnames.add(os.path.dirname(path) or ".")
+        if os.name != "posix":
+            # directories can't be opened
+            return
+        for dirname in dirnames:
+            fd = os.open(dirname, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        self.flush()
+
+
+def get_shard_fname(fname: str, shard: int, mode: str = "single") -> str:
+    """return the output file name of a shard (see ShardedQueue): the shard
+    number is added before the extensions (output_003.sdf.gz,
+    ligands_003.sdf.tar), in split mode it's a subdirectory
+    (output/shard_003/mol.sdf); databases are shared by all the shards"""
+    if mode == "split":
+        return os.path.join(os.path.dirname(fname), "shard_%03d" % shard, os.path.basename(fname))
+    if is_database(fname):
+        return fname
+    basename, extensions = _split_extensions(fname)
+    return "%s_%03d%s" % (basename, shard, extensions)
+
+
+def get_shards_manifest_fname(fname: str) -> str:
+    """return the file name of the manifest of the shards of the output"""
+    return _split_extensions(fname)[0] + ".shards.tsv"
+
+
+def _split_extensions(fname: str) -> tuple:
+    """return the file name without the format, compression and archive
+    extensions, and the extensions"""
+    base, _ = split_archive(fname)
+    base, _ = split_compression(base)
+    base, _ = os.path.splitext(base)
+    return base, fname[len(base) :]
+
+
+def write_shards_manifest(fname: str, shards: list):
+    """write the manifest of the (shard, file name, molecules) shards; file
+    names are relative to the manifest"""
+    dirname = os.path.dirname(fname)
+    with open(fname, "w") as fp:
+        fp.write("shard\tfname\tmolecules\n")
+        for shard, shard_fname, count in shards:
+            fp.write("%d\t%s\t%d\n" % (shard, os.path.relpath(shard_fname, dirname or os.path.curdir), count))
+
+
+def merge_shards(
+    fnames: list,
+    fname: str,
+    mode: str = "single",
+    header: bool = False,
+    format_opts: dict = None,
+    compression_level: int = None,
+    compression_threads: int = 1,
+):
+    """merge the output shards in `fname` and remove them; in single mode the
+    files are concatenated (the first line of smi files is skipped after the
+    first shard with `header`), in archive mode the manifests of the shards
+    are merged, the archives are left in place"""
+    if mode == "archive":
+        basename, _ = _split_extensions(fname)
+        dirname = os.path.dirname(fname)
+        manifests = [_split_extensions(shard_fname)[0] + MANIFEST_EXT for shard_fname in fnames]
+        with open(basename + MANIFEST_EXT, "w") as fp:
+            fp.write("name\tarchive\tmember\n")
+            for manifest in manifests:
+                for name, archive, member in read_manifest(manifest):
+                    fp.write("%s\t%s\t%s\n" % (name, os.path.relpath(archive, dirname or os.path.curdir), member))
+        for manifest in manifests:
+            os.remove(manifest)
+        return
+    if mode != "single":
+        raise ValueError("Shards can be merged only in 'single' and 'archive' mode")
+    if format_opts is None:
+        format_opts = {}
+    if fname.lower().endswith(".molbin"):
+        with MolbinWriter(fname, **format_opts) as writer:
+            for shard_fname in fnames:
+                reader = MolbinReader(shard_fname)
+                for mol in reader:
+                    writer.write(mol)
+                reader.close()
+    else:
+        # shards are decompressed and compressed again, so that the output
+        # has a single stream
+        with open_compressed(fname, "wt", level=compression_level, threads=compression_threads) as out:
+            for idx, shard_fname in enumerate(fnames):
+                with open_compressed(shard_fname, "rt") as fp:
+                    if header and idx > 0:
+                        fp.readline()
+                    shutil.copyfileobj(fp, out)
+    for shard_fname in fnames:
+        os.remove(shard_fname)
+
+
+class ShardedQueue(object):
+    """Send the molecules to the queues of multiple writers (MoleculeStorage),
+    each writing its own output shard; it replaces the output queue of the
+    pipeline, so the geometry workers are not aware of the shards.
+
+        >>> queue_out = ShardedQueue([multiprocessing.Queue() for _ in range(4)])
+        >>> queue_out.put(mol)
+
+    The shard of a molecule is the sequence number of its input (see
+    ReorderBuffer.tag_mol) modulo the number of shards, so the assignment is
+    deterministic (the same in every run, with any number of workers), the
+    shards are balanced even if names are missing or repeated, and all the
+    isomers of an input are written in the same shard. Molecules that are not
+    tagged are assigned by the hash of their name, or in turn if they have no
+    name. Poison pills (None) are sent to all the shards, so each writer
+    expects one poison pill from each worker, as with a single writer.
+    """
+
+    def __init__(self, queues: list):
+        self.queues = queues
+        self._counter = 0
+
+    def __len__(self):
+        return len(self.queues)
+
+    def get_shard(self, package) -> int:
+        """return the shard of the molecule (or of the report, or of the
+        tombstone)"""
+        tag = ReorderBuffer.get_tag(package)
+        if not tag is None:
+            return tag[0] % len(self.queues)
+        mol = package if isinstance(package, Chem.rdchem.Mol) else package["mol"]
+        if not mol is None and mol.HasProp("_Name") and mol.GetProp("_Name"):
+            name = mol.GetProp("_Name")
+            return int(hashlib.md5(name.encode()).hexdigest()[:8], 16) % len(self.queues)
+        self._counter += 1
+        return self._counter % len(self.queues)
+
+    def put(self, package, block: bool = True, timeout: float = None):
+        if package is None:
+            for shard_queue in self.queues:
+                shard_queue.put(None, block, timeout)
+            return
+        self.queues[self.get_shard(package)].put(package, block, timeout)
+
+
 class MoleculeStorage(ScrubberBase, multiprocessing.Process):
     """Class to write molecules processed;
 
@@ -223,18 +760,37 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
     # write molecules in a SDF file
     >>> ms = MoleculeStorage(out_fname = 'output.sdf', out_fname_format = 'auto')
 
-    # write molecules in to a database (must have a compatible write() method)
-    >>> ms = MoleculeStorage(out_container = db_object)
+    # write molecules in a binary container (see molbin), with a header
+    >>> ms = MoleculeStorage(out_fname = 'output.molbin',
+    ...     format_opts = {"single": {"molbin": {"header": options}}})
+
+    # write each molecule in its own file, in two levels of hashed subdirectories
+    >>> ms = MoleculeStorage(fname = 'output/mol.sdf', mode = 'split', split_fanout = 2)
+
+    # write each molecule as a member of rotating archives, with a manifest
+    >>> ms = MoleculeStorage(fname = 'output/ligands.sdf.tar', mode = 'archive',
+    ...     archive_max_members = 10000)
+
+    # store the results of the inputs read from a SQLite database (see database)
+    >>> ms = MoleculeStorage(fname = 'campaign.db')
+
+    # write to STDOUT, as a framed stream (see pipe) read by another process
+    >>> ms = MoleculeStorage(fname = '-')
+
+    Output files are compressed if the filename has a compression extension
+    (e.g. output.sdf.gz, see compression), in split mode each file is
+    compressed; `compression_threads` is used only by zstd.
 
-    # write to STOUD
-    >>> ms = MoleculeStorage(pipe=True)
+    If `preserve_order` is requested, molecules are written in the order of
+    the input; molecules must be tagged (see ReorderBuffer.tag_mol) and any
+    discarded molecule must be replaced by a tombstone (ReorderBuffer.tombstone)
     """
     out_format_opts_default = {
-        "single": {"smi": {}, "sdf": {}},
-        "split": {"smi": {}, "sdf": {}},
+        "single": {"smi": {}, "sdf": {}, "molbin": {}},
+        "split": {"smi": {}, "sdf": {}, "molbin": {}},
     }
     out_format_file_writers = {
-        "single": {"smi": Chem.SmilesWriter, "sdf": Chem.SDWriter},
+        "single": {"smi": Chem.SmilesWriter, "sdf": Chem.SDWriter, "molbin": MolbinWriter},
         "split": {"smi": Chem.MolToSmiles, "sdf": Chem.MolToMolBlock},
     }
 
@@ -242,14 +798,24 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
         self,
         fname: str = None,
         ftype: str = None,  # smi, sdf, None (auto)
-        mode: str = "single",  # "single", "split", "pipe"
+        mode: str = "single",  # "single", "split", "archive", "pipe"
         format_opts: dict = out_format_opts_default,
         naming: str = "auto",  # auto, (progressive), name (molname)
         naming_field: str = "",
         max_lig_per_dir=0,  # it not 0, create automatically subdirectories each [max_lig_per_dir] ligands
+        split_fanout: int = 0,  # if not 0, levels of hashed subdirectories (see SplitWriter)
+        split_batch_size: int = 1000,  # molecules written at once in split mode
+        split_sync: bool = False,  # sync the output to disk after each batch
+        archive_max_members: int = 10000,  # members per archive in archive mode
+        archive_max_size: float = 1024,  # MB per archive in archive mode
         disable_name_sanitize: bool = False,  # disable sanitizing output filename (based on mol name)
         disable_preserve_properties: bool = False,  # disable preserving any extra properties found in the molecule
         workers_count: int = 1,
+        shard: int = None,  # number of the output shard, if multiple writers are used (see ShardedQueue)
+        preserve_order: bool = False,  # write molecules in the same order as the input
+        reorder_buffer_size: int = 10000,  # max molecules kept in memory before spilling to disk
+        compression_level: int = None,  # None: default level of the codec
+        compression_threads: int = 1,
         # disable_rdkit_warnings: bool = True,
         queue: multiprocessing.Queue = None,
         comm_pipe: multiprocessing.Pipe = None,
@@ -262,9 +828,19 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
         self.format_opts = format_opts
         self.naming = naming
         self.max_lig_per_dir = max_lig_per_dir
+        self.split_fanout = split_fanout
+        self.split_batch_size = split_batch_size
+        self.split_sync = split_sync
+        self.archive_max_members = archive_max_members
+        self.archive_max_size = archive_max_size
         self.disable_name_sanitize = disable_name_sanitize
         self.disable_preserve_properties = disable_preserve_properties
         self.workers_count = workers_count
+        self.shard = shard
+        self.preserve_order = preserve_order
+        self.reorder_buffer_size = reorder_buffer_size
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
         self.queue = queue
         self.comm_pipe = comm_pipe
         self.handbrake = handbrake
@@ -275,6 +851,17 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
         self._counter = 0
         self._dir_counter = 0
         self.writer = None
+        self._split_writer = None
+        self._archive_writer = None
+        self._fp = None
+        self._codec = None
+        self._compression_ext = ""
+        if self.preserve_order:
+            self._reorder = ReorderBuffer(max_size=self.reorder_buffer_size)
+        else:
+            self._reorder = None
+        if self.fname == "-":
+            self.mode = "pipe"
         # in single mode, filename is mandatory
         if self.mode == "single":
             if not self.naming == "auto":
@@ -284,7 +871,12 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
                 )
             if self.fname is None:
                 raise ValueError("Filename must be specified in 'single' mode")
-            self._basename, self._ext = os.path.splitext(self.fname)
+            if is_database(self.fname):
+                self.ftype = "database"
+                self.writer = DatabaseMolWriter(MoleculeDatabase(self.fname))
+                return
+            uncompressed_fname, self._codec = split_compression(self.fname)
+            self._basename, self._ext = os.path.splitext(uncompressed_fname)
             self._ext = self._ext[1:].lower()
             if self.ftype is None:
                 self.ftype = self._ext
@@ -293,8 +885,16 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
                     "Invalid outpuf file format: current(%s), "
                     "accepted (%s)" % (self._ext, ",".join(VALID_FORMATS))
                 )
+            if self._codec is None:
+                destination = self.fname
+            elif self.ftype == "molbin":
+                raise ValueError("Compressed molbin files are not supported")
+            else:
+                # the RDKit writers accept Python file objects
+                self._fp = self._open_compressed(self.fname)
+                destination = self._fp
             self.writer = self.out_format_file_writers[self.mode][self.ftype](
-                self.fname, **self.format_opts[self.mode][self.ftype]
+                destination, **self.format_opts[self.mode][self.ftype]
             )
         # in single mode many things can happen...
         elif self.mode == "split":
@@ -304,7 +904,10 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
                 self._ext = None
             else:
                 self._basedir = os.path.dirname(self.fname)
-                name, ext = os.path.splitext(self.fname)
+                uncompressed_fname, self._codec = split_compression(self.fname)
+                if self._codec is not None:
+                    self._compression_ext = self.fname[len(uncompressed_fname) :]
+                name, ext = os.path.splitext(uncompressed_fname)
                 self._basename = [os.path.basename(name)]
                 self._ext = ext[1:].lower()
             if self.ftype is None:
@@ -314,17 +917,58 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
                     "Invalid outpuf file format: current(%s), "
                     "accepted (%s)" % (self._ext, ",".join(VALID_FORMATS))
                 )
+            if self.ftype == "molbin" and self._codec is not None:
+                raise ValueError("Compressed molbin files are not supported")
+            self._split_writer = SplitWriter(
+                self._basedir or os.path.curdir,
+                self.ftype,
+                fanout=self.split_fanout,
+                batch_size=self.split_batch_size,
+                sync=self.split_sync,
+                codec=self._codec,
+                compression_ext=self._compression_ext,
+                compression_level=self.compression_level,
+                compression_threads=self.compression_threads,
+            )
+        elif self.mode == "archive":
+            if self.fname is None:
+                raise ValueError("Filename must be specified in 'archive' mode")
+            self._archive_writer = ArchiveWriter(
+                self.fname,
+                max_members=self.archive_max_members,
+                max_size=self.archive_max_size,
+            )
+            self._basename = [os.path.basename(self._archive_writer.basename)]
+            self.ftype = self._archive_writer.ftype
         elif self.mode == "pipe":
-            # write to pipe
-            pass
+            self.writer = PipeMolWriter()
 
-    def close(self):
-        """wrap up operations when code is completed"""
+    def close(self, aborted: bool = False):
+        """wrap up operations when code is completed; if `aborted` (e.g. by
+        the handbrake) the output stream is left without its end, so readers
+        detect that it's incomplete"""
         # TODO CHECK THAT THE WRITER QUEUE IS NOT EMPTY?
+        if not self._reorder is None:
+            for mol in self._reorder.flush():
+                self._write_mol(mol)
+            if self._reorder.spilled:
+                print("[ reorder buffer: %d molecules spilled to disk ]" % self._reorder.spilled)
         if not self.writer is None:
-            self.writer.close()
+            if self.mode == "pipe":
+                self.writer.close(aborted=aborted)
+            else:
+                self.writer.close()
+        if not self._split_writer is None:
+            self._split_writer.close()
+        if not self._archive_writer is None:
+            self._archive_writer.close()
+        if not self._fp is None:
+            self._fp.close()
         if not self.comm_pipe is None:
-            self.comm_pipe.send("writer:%d" % self._counter)
+            if self.shard is None:
+                self.comm_pipe.send("writer:%d" % self._counter)
+            else:
+                self.comm_pipe.send("writer_%d:%d" % (self.shard, self._counter))
 
     def run(self):
         """multithreading default function with listening loop that waits for
@@ -333,16 +977,15 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
         while True:
             try:
                 if self.handbrake is not None and self.handbrake.is_set():
-                    self.close()
+                    self.close(aborted=True)
                     return
                 package = self.queue.get()
             except KeyboardInterrupt:
-                self.close()
+                self.close(aborted=True)
                 return
             # print(Q)
 
             if package is None:
-                print("RECEIVED A POISON PILL?")
                 # poison pill
                 self.workers_count -= 1
                 if self.workers_count == 0:
@@ -364,32 +1007,74 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
             except Exception as exc:
                 print("\n\n\n\nPROBLEMATIC PACKAGE!", package, exc, "\n\n\n\n")
                 sys.exit(1)
-            if self.mode == "single":
-                # save all non-private properties in the current molecule
-                if not self.disable_preserve_properties and self.ftype == "sdf":
-                    self.writer.SetProps(mol.GetPropNames())
-                self._counter += 1
-                self.writer.write(mol)
-            elif self.mode == "split":
-                outfname = self._get_outfname(mol)
-                writer = self.out_format_file_writers["single"][self.ftype]
-                self._counter += 1
-                with writer(outfname) as fp:
-                    fp.write(mol)
-            elif self.mode == "pipe":
-                pickle.dump(mol, sys.stdout.buffer)
+            if self.ftype == "database" and not ReorderBuffer.get_tag(package) is None:
+                # inputs are stored when all their results have arrived, the
+                # order doesn't matter
+                if not mol is None:
+                    self._counter += 1
+                self.writer.write_tagged(
+                    ReorderBuffer.get_tag(package),
+                    mol,
+                    input_id=package.get("input_id") if isinstance(package, dict) else None,
+                    error=package.get("error") if isinstance(package, dict) else None,
+                )
+            elif not self._reorder is None:
+                for mol in self._reorder.push(ReorderBuffer.get_tag(package), mol):
+                    self._write_mol(mol)
+            elif not mol is None:
+                # tombstones are used only to restore the input order
+                self._write_mol(mol)
+
+    def _write_mol(self, mol):
+        """write the molecule according to the mode"""
+        if self.mode == "single":
+            # save all non-private properties in the current molecule
+            if not self.disable_preserve_properties and self.ftype == "sdf":
+                self.writer.SetProps(mol.GetPropNames())
+            self._counter += 1
+            self.writer.write(mol)
+        elif self.mode == "split":
+            outfname = self._get_outfname(mol)
+            self._counter += 1
+            self._split_writer.write(mol, outfname)
+        elif self.mode == "archive":
+            self._counter += 1
+            self._archive_writer.write(mol, member_name=self._get_basename(mol))
+        elif self.mode == "pipe":
+            self._counter += 1
+            self.writer.write(mol)
+
+    def _open_compressed(self, fname: str):
+        """open a compressed output file in text mode"""
+        return open_compressed(
+            fname,
+            "wt",
+            codec=self._codec,
+            level=self.compression_level,
+            threads=self.compression_threads,
+        )
 
     def _get_outfname(
         self,
         mol,
     ):
         """function to automate the output molecule name, and generate
-        progressive subdirectories, if required"""
+        progressive subdirectories, if required; the collision-free path
+        is reserved by the split writer"""
+        basename = self._get_basename(mol)
+        # generate the directory name
+        subdir = None
+        if self.max_lig_per_dir > 0:
+            if self._counter % self.max_lig_per_dir == 0:
+                self._dir_counter += 1
+            subdir = "{:0>8}".format(self._dir_counter - 1)
+        return self._split_writer.reserve(basename, subdir)
 
+    def _get_basename(self, mol):
+        """return the output file name (without extension) of the molecule
+        according to the naming scheme"""
         # TODO check for Scrubber properties here, if they can be used for naming, e.g.: p1_t2_s4
         default_name = "MOL"
-        dirname = [self._basedir]
-        ext = self.ftype
         # get the name
         basename = []
         # generate the file name
@@ -403,30 +1088,7 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
                 basename = "%s_%s" % (default_name, self._counter)
         if not self.disable_name_sanitize:
             basename = self._sanitize_string(basename)
-        # generate the directory name
-        if self.max_lig_per_dir > 0:
-            if self._counter % self.max_lig_per_dir == 0:
-                self._dir_counter += 1
-            new_dir = "{:0>8}".format(self._dir_counter - 1)
-            dirname.append(new_dir)
-            dirname = os.path.sep.join(dirname)
-        else:
-            dirname = dirname[0]
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
-        fullpath = "%s%s%s.%s" % (dirname, os.path.sep, basename, ext)
-        if os.path.exists(fullpath):
-            attempt = 0
-            while os.path.exists(fullpath):
-                attempt += 1
-                fullpath = "%s%s%s_v%d.%s" % (
-                    dirname,
-                    os.path.sep,
-                    basename,
-                    attempt,
-                    ext,
-                )
-        return fullpath
+        return basename
 
     def _sanitize_string(self, string):
         """function to apply rules to generate a valid filename from a
@@ -451,10 +1113,44 @@ class MoleculeStorage(ScrubberBase, multiprocessing.Process):
         return string
 
 
+def _open_input(filename: str, start_offset: int = 0, end_offset: int = None):
+    """open the input file in binary mode; compressed streams that can't seek
+    (zstd) can only be read from the beginning, so offsets (shards, resumed
+    runs) are rejected"""
+    fp = open_compressed(filename, "rb")
+    if not fp.seekable() and (start_offset or end_offset is not None):
+        fp.close()
+        raise ValueError(
+            "Input offsets (shards, resume) are not supported for [%s]: the file can't seek"
+            % filename
+        )
+    return fp
+
+
+def _seek_input(fp, filename: str, offset: int):
+    """move the input to the byte offset and return the file object; streams
+    that can't seek are reopened to restart from the beginning"""
+    if fp.closed:
+        # e.g. closed at the end of the file
+        fp = _open_input(filename)
+    if fp.seekable():
+        fp.seek(offset)
+        return fp
+    if offset:
+        raise ValueError("Seeking is not supported for [%s]: the file can't seek" % filename)
+    fp.close()
+    return _open_input(filename)
+
+
 class SDFMolSupplierWrapper:
     """RDKit SDF molecule wapper to provide molecules in a robust way.
     If an error is encountered when parsing the molecule, the raw text is
     dumped in a log file and/or passed in the error queue,
+
+    The file is read in binary mode, so the byte offset of the next record can
+    be retrieved at any time with `tell()` (e.g., to checkpoint a run) and
+    reading can be restricted to a range of records using `start_offset` and
+    `end_offset` (see fileindex.MoleculeFileIndex).
     """
 
     def __init__(
@@ -465,6 +1161,8 @@ class SDFMolSupplierWrapper:
         strictParsing: bool = True,
         discarded_datafile: str = None,
         queue_err: multiprocessing.Queue = None,
+        start_offset: int = 0,
+        end_offset: int = None,
         _stop_at_defaults: bool = False,
     ):
         self.filename = filename
@@ -473,16 +1171,36 @@ class SDFMolSupplierWrapper:
         self.strictParsing = strictParsing
         self.discarded_datafile = discarded_datafile
         self.queue_err = queue_err
+        self.start_offset = start_offset
+        self.end_offset = end_offset
         if _stop_at_defaults:
             return
         self._counter_problematic = 0
-        self.fp_input = open(filename, "r")
+        self.fp_input = _open_input(filename, self.start_offset, self.end_offset)
+        if self.start_offset:
+            self.fp_input.seek(self.start_offset)
         self.fp_errors = None
         self._buff = []
+        # the same supplier is recycled to parse every record, so that SD data
+        # fields are preserved as molecule properties (MolFromMolBlock drops them)
+        self._parser = Chem.SDMolSupplier()
 
     def __iter__(self):
         return self
 
+    def reset(self):  # same interface as rdkit.Chem.SDMolSupplier
+        """restart reading from the first record"""
+        self.seek(self.start_offset)
+
+    def tell(self) -> int:
+        """return the byte offset of the next record to be read"""
+        return self.fp_input.tell()
+
+    def seek(self, offset: int):
+        """move to the record starting at the specified byte offset"""
+        self.fp_input = _seek_input(self.fp_input, self.filename, offset)
+        self._buff = []
+
     def _close_fp(self):
         """close all potential file pointers"""
         self.fp_input.close()
@@ -491,63 +1209,236 @@ class SDFMolSupplierWrapper:
 
     def __next__(self):
         """iterator step"""
+        if self.end_offset is not None and self.fp_input.tell() >= self.end_offset:
+            raise StopIteration
         while True:
             line = self.fp_input.readline()
             # empty line
             if not line:
-                # last molecule in the file
-                if len(self._buff) > 0:
-                    try:
-                        # buffer full, returning last molecule
-                        mol = Chem.MolFromMolBlock(
-                            "".join(self._buff),
-                            sanitize=self.sanitize,
-                            removeHs=self.removeHs,
-                            strictParsing=self.strictParsing,
-                        )
-                        self._buff = []
-                        break  # go to last try/except
-                    except:
-                        self._manage_problematic()
-                        return None
-                else:
+                if len(self._buff) == 0:
                     # buffer empty, stopping the iteration
                     self._close_fp()
                     raise StopIteration
-            else:
-                self._buff.append(line)
-                if "$$$$" in line:
-                    # molecule completed
-                    complete_buff = self._buff[:]
-                    self._buff = []
-                    break  # go to last try/except...
+                # last molecule in the file (no "$$$$" terminator)
+                break
+            self._buff.append(line)
+            if b"$$$$" in line:
+                # molecule completed
+                break
+        text = b"".join(self._buff).decode("utf-8", errors="replace")
+        self._buff = []
         try:
-            # found a complete molecule, returning it
-            mol = Chem.MolFromMolBlock(
-                "".join(complete_buff),
-                sanitize=self.sanitize,
-                removeHs=self.removeHs,
-                strictParsing=self.strictParsing,
-            )
-            return mol
+            return self._parse(text)
         except:
-            self._manage_problematic()
+            self._manage_problematic(text)
             return None
 
-    def _manage_problematic(self):
+    def _parse(self, text: str):
+        """parse a single SDF record"""
+        self._parser.SetData(
+            text,
+            sanitize=self.sanitize,
+            removeHs=self.removeHs,
+            strictParsing=self.strictParsing,
+        )
+        return next(self._parser)
+
+    def _manage_problematic(self, buff: str):
         """perform opreations to manage problematic data"""
         self._counter_problematic += 1
-        buff = "\n".join(self._buff)
         if not self.discarded_datafile is None:
             if self.fp_errors is None:
                 self.fp_errors = open(self.discarded_datafile, "w")
-            self.fp_errors.write(buff + "\n")
+            self.fp_errors.write(buff)
         if not self.queue_err is None:
             self.queue_err.put(("input", buff), block=True)
 
 
+_sdf_parser = None
+_sdf_parser_opts = {}
+
+
+def _sdf_parser_init(sanitize: bool, removeHs: bool, strictParsing: bool):
+    """initializer of the ParallelSDFMolSupplier processes"""
+    global _sdf_parser, _sdf_parser_opts
+    _sdf_parser = Chem.SDMolSupplier()
+    _sdf_parser_opts = {
+        "sanitize": sanitize,
+        "removeHs": removeHs,
+        "strictParsing": strictParsing,
+    }
+
+
+def _sdf_parse_records(records: list) -> list:
+    """parse a list of raw SDF records; return a list of (data, failed), where
+    data is the binary molecule (with properties) or None"""
+    results = []
+    for text in records:
+        try:
+            _sdf_parser.SetData(text.decode("utf-8", errors="replace"), **_sdf_parser_opts)
+            mol = next(_sdf_parser)
+        except:
+            results.append((None, True))
+            continue
+        if mol is None:
+            results.append((None, False))
+        else:
+            results.append((mol.ToBinary(Chem.PropertyPickleOptions.AllProps), False))
+    return results
+
+
+class ParallelSDFMolSupplier(SDFMolSupplierWrapper):
+    """SDF supplier for large files: the file is scanned in blocks of
+    `block_size` bytes to find the record boundaries, and batches of raw
+    records are parsed by a pool of `nr_proc` processes. Molecules are returned
+    in the same order of the file, and problematic records are managed by the
+    main process as in SDFMolSupplierWrapper (discarded_datafile, queue_err),
+    as well as `tell()`, `seek()` and the offsets range.
+
+    At most `max_pending` batches (default: 2 x nr_proc) are read ahead.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        sanitize: bool = True,
+        removeHs: bool = False,
+        strictParsing: bool = True,
+        discarded_datafile: str = None,
+        queue_err: multiprocessing.Queue = None,
+        start_offset: int = 0,
+        end_offset: int = None,
+        nr_proc: int = None,
+        block_size: int = 4 * 1024**2,
+        batch_size: int = 256,
+        max_pending: int = None,
+        _stop_at_defaults: bool = False,
+    ):
+        if nr_proc is None:
+            nr_proc = multiprocessing.cpu_count()
+        self.nr_proc = nr_proc
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.max_pending = max_pending if max_pending is not None else 2 * nr_proc
+        super().__init__(
+            filename,
+            sanitize=sanitize,
+            removeHs=removeHs,
+            strictParsing=strictParsing,
+            discarded_datafile=discarded_datafile,
+            queue_err=queue_err,
+            start_offset=start_offset,
+            end_offset=end_offset,
+            _stop_at_defaults=_stop_at_defaults,
+        )
+        if _stop_at_defaults:
+            return
+        self._pool = multiprocessing.Pool(
+            nr_proc,
+            initializer=_sdf_parser_init,
+            initargs=(sanitize, removeHs, strictParsing),
+        )
+        self.seek(self.start_offset)
+
+    def tell(self) -> int:
+        """return the byte offset of the next record to be returned"""
+        return self._next_offset
+
+    def seek(self, offset: int):
+        """move to the record starting at the specified byte offset"""
+        self.fp_input = _seek_input(self.fp_input, self.filename, offset)
+        # results of records read ahead are discarded
+        self._batches = collections.deque()
+        self._ready = collections.deque()
+        self._tail = b""
+        self._tail_offset = offset
+        self._next_offset = offset
+        self._eof = False
+
+    def _close_fp(self):
+        """close all potential file pointers and stop the parsers"""
+        super()._close_fp()
+        self._pool.terminate()
+
+    def _scan(self) -> list:
+        """return the next batch of raw records as (text, end offset)"""
+        records = []
+        while not self._eof and len(records) < self.batch_size:
+            data = self._tail
+            pos = 0
+            while len(records) < self.batch_size:
+                if self.end_offset is not None and self._tail_offset + pos >= self.end_offset:
+                    self._eof = True
+                    break
+                idx = data.find(b"$$$$", pos)
+                if idx == -1:
+                    break
+                eol = data.find(b"\n", idx)
+                if eol == -1:
+                    break
+                records.append((data[pos : eol + 1], self._tail_offset + eol + 1))
+                pos = eol + 1
+            self._tail = data[pos:]
+            self._tail_offset += pos
+            if self._eof or len(records) >= self.batch_size:
+                break
+            block = self.fp_input.read(self.block_size)
+            if block:
+                self._tail += block
+                continue
+            self._eof = True
+            # last molecule in the file (no "$$$$" terminator)
+            if self._tail.strip():
+                records.append((self._tail, self._tail_offset + len(self._tail)))
+            self._tail_offset += len(self._tail)
+            self._tail = b""
+        return records
+
+    def _fill(self):
+        """submit batches of records to the parsers"""
+        while not self._eof and len(self._batches) < self.max_pending:
+            records = self._scan()
+            if not records:
+                break
+            result = self._pool.apply_async(_sdf_parse_records, ([r[0] for r in records],))
+            self._batches.append((records, result))
+
+    def __next__(self):
+        """iterator step"""
+        while not self._ready:
+            self._fill()
+            if not self._batches:
+                self._close_fp()
+                raise StopIteration
+            records, result = self._batches.popleft()
+            self._ready.extend(zip(result.get(), records))
+        (data, failed), (text, end_offset) = self._ready.popleft()
+        self._next_offset = end_offset
+        if failed:
+            self._manage_problematic(text.decode("utf-8", errors="replace"))
+            return None
+        if data is None:
+            return None
+        return Chem.Mol(data)
+
+
+def _parse_smiles_line(line: str, sanitize: bool = True, is_enamine_cxsmiles: bool = False):
+    """parse a line of a SMILES (SMILES and name) or Enamine CXSMILES file"""
+    if is_enamine_cxsmiles:
+        smiles, name, _ = line.split("\t", maxsplit=2)
+        mol = Chem.MolFromSmiles(smiles, sanitize=sanitize)
+        mol.SetProp("_Name", name)
+    else:
+        mol = Chem.MolFromSmiles(line, sanitize=sanitize)
+    return mol
+
+
 class SMIMolSupplierWrapper(object):
-    """RDKit SMI molecule supplier wrapper."""
+    """RDKit SMI molecule supplier wrapper.
+
+    As for SDFMolSupplierWrapper, the byte offset of the next line can be
+    retrieved with `tell()` and reading can be restricted to the lines between
+    `start_offset` and `end_offset`."""
 
     def __init__(
         self,
@@ -557,6 +1448,8 @@ class SMIMolSupplierWrapper(object):
         queue_err: multiprocessing.Queue = None,
         discarded_input_fname: str = None,
         is_enamine_cxsmiles: bool = False,
+        start_offset: int = 0,
+        end_offset: int = None,
         _stop_at_defaults: bool = False,
     ):
         self.filename = filename
@@ -565,13 +1458,14 @@ class SMIMolSupplierWrapper(object):
         self.queue_err = queue_err
         self.discarded_input_fname = discarded_input_fname
         self.is_enamine_cxsmiles = is_enamine_cxsmiles
+        self.start_offset = start_offset
+        self.end_offset = end_offset
         if _stop_at_defaults:
             return
-        self.fp_input = open(filename, "r")
+        self.fp_input = _open_input(filename, self.start_offset, self.end_offset)
         self.fp_errors = None
         self._buff = []
-        if self.titleLine:
-            self.fp_input.readline() # ditch first line
+        self.reset()
         # print("INITIALIZED", self.titleLine)
         # print("INITIALIZED", self.queue_err)
 
@@ -582,17 +1476,27 @@ class SMIMolSupplierWrapper(object):
             self.fp_errors.close()
 
     def __iter__(self):
-        self.fp_input.seek(0)
-        if self.titleLine:
-            self.fp_input.readline() # ditch first line
+        self.reset()
         return self
 
     def reset(self): # same interface as rdkit.Chem.SDMolSupplier
-        self.fp_input.seek(0)
+        self.seek(self.start_offset)
+        if self.titleLine and self.start_offset == 0:
+            self.fp_input.readline() # ditch first line
+
+    def tell(self) -> int:
+        """return the byte offset of the next line to be read"""
+        return self.fp_input.tell()
+
+    def seek(self, offset: int):
+        """move to the line starting at the specified byte offset"""
+        self.fp_input = _seek_input(self.fp_input, self.filename, offset)
 
     def __next__(self):
         """iterator step"""
         while True:
+            if self.end_offset is not None and self.fp_input.tell() >= self.end_offset:
+                raise StopIteration
             line = self.fp_input.readline()
             # readline() returns "" at the end of file, "\n" for empty lines in the file
             if not line:
@@ -603,29 +1507,179 @@ class SMIMolSupplierWrapper(object):
             # skip empty lines
             if not line.strip():
                 continue
+            line = line.decode("utf-8", errors="replace")
             try:
-                if self.is_enamine_cxsmiles:
-                    smiles, name, _ = line.split("\t", maxsplit=2)
-                    mol = Chem.MolFromSmiles(smiles, sanitize=self.sanitize)
-                    mol.SetProp("_Name", name) 
-                else:
-                    mol = Chem.MolFromSmiles(line, sanitize=self.sanitize)
-                if mol is None:
-                    if not self.queue_err is None:
-                        self.queue_err.put(("input", line), block=True)
-                    if not self.discarded_input_fname is None:
-                        if self.fp_errors is None:
-                            self.fp_errors = open(self.discarded_input_fname)
-                        self.fp_errors.write(line + "\n")
-                return mol
+                mol = _parse_smiles_line(line, self.sanitize, self.is_enamine_cxsmiles)
             except:
-                if not self.queue_err is None:
-                    self.queue_err.put(("input", line), block=True)
-                if not self.discarded_input_fname is None:
-                    if self.fp_errors is None:
-                        self.fp_errors = open(self.discarded_input_fname)
-                    self.fp_errors.write(line + "\n")
-                return None
+                mol = None
+            if mol is None:
+                self._manage_problematic(line)
+            return mol
+
+    def _manage_problematic(self, line: str):
+        """perform opreations to manage problematic data"""
+        if not self.queue_err is None:
+            self.queue_err.put(("input", line), block=True)
+        if not self.discarded_input_fname is None:
+            if self.fp_errors is None:
+                self.fp_errors = open(self.discarded_input_fname, "w")
+            self.fp_errors.write(line.rstrip("\r\n") + "\n")
+
+
+def _smiles_parse_lines(lines: list, sanitize: bool = True, is_enamine_cxsmiles: bool = False) -> list:
+    """parse a list of raw lines; return the binary molecules (with
+    properties), or None for lines that can't be parsed"""
+    results = []
+    for line in lines:
+        try:
+            mol = _parse_smiles_line(
+                line.decode("utf-8", errors="replace"), sanitize, is_enamine_cxsmiles
+            )
+        except:
+            mol = None
+        if mol is None:
+            results.append(None)
+        else:
+            results.append(mol.ToBinary(Chem.PropertyPickleOptions.AllProps))
+    return results
+
+
+class ParallelSMIMolSupplier(SMIMolSupplierWrapper):
+    """SMILES (or Enamine CXSMILES) supplier for large files: the file is read
+    in blocks of `block_size` bytes split in lines, and batches of
+    `batch_size` lines are parsed by a pool of `nr_proc` processes. As for
+    ParallelSDFMolSupplier, molecules are returned in the same order of the
+    file, problematic lines are managed by the main process, and `tell()`,
+    `seek()` and the offsets range work as in SMIMolSupplierWrapper.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        sanitize: bool = True,
+        titleLine: bool = False,
+        queue_err: multiprocessing.Queue = None,
+        discarded_input_fname: str = None,
+        is_enamine_cxsmiles: bool = False,
+        start_offset: int = 0,
+        end_offset: int = None,
+        nr_proc: int = None,
+        block_size: int = 4 * 1024**2,
+        batch_size: int = 2000,
+        max_pending: int = None,
+        _stop_at_defaults: bool = False,
+    ):
+        if nr_proc is None:
+            nr_proc = multiprocessing.cpu_count()
+        self.nr_proc = nr_proc
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.max_pending = max_pending if max_pending is not None else 2 * nr_proc
+        self._pool = None
+        super().__init__(
+            filename,
+            sanitize=sanitize,
+            titleLine=titleLine,
+            queue_err=queue_err,
+            discarded_input_fname=discarded_input_fname,
+            is_enamine_cxsmiles=is_enamine_cxsmiles,
+            start_offset=start_offset,
+            end_offset=end_offset,
+            _stop_at_defaults=_stop_at_defaults,
+        )
+        if _stop_at_defaults:
+            return
+        self._pool = multiprocessing.Pool(nr_proc)
+
+    def reset(self):
+        self.seek(self.start_offset)
+        if self.titleLine and self.start_offset == 0:
+            # ditch first line, without seeking (compressed streams may not seek)
+            self._reset_buffers(len(self.fp_input.readline()))
+
+    def tell(self) -> int:
+        """return the byte offset of the next line to be returned"""
+        return self._next_offset
+
+    def seek(self, offset: int):
+        """move to the line starting at the specified byte offset"""
+        self.fp_input = _seek_input(self.fp_input, self.filename, offset)
+        self._reset_buffers(offset)
+
+    def _reset_buffers(self, offset: int):
+        """discard the results of lines read ahead; the file is at `offset`"""
+        self._batches = collections.deque()
+        self._ready = collections.deque()
+        self._tail = b""
+        self._tail_offset = offset
+        self._next_offset = offset
+        self._eof = False
+
+    def _close_fp(self):
+        """close all potential file pointers and stop the parsers"""
+        super()._close_fp()
+        if self._pool is not None:
+            self._pool.terminate()
+
+    def _scan(self) -> list:
+        """return the next batch of non-empty lines as (line, end offset)"""
+        lines = []
+        while not self._eof and len(lines) < self.batch_size:
+            data = self._tail
+            pos = 0
+            while len(lines) < self.batch_size:
+                if self.end_offset is not None and self._tail_offset + pos >= self.end_offset:
+                    self._eof = True
+                    break
+                eol = data.find(b"\n", pos)
+                if eol == -1:
+                    break
+                if data[pos:eol].strip():
+                    lines.append((data[pos : eol + 1], self._tail_offset + eol + 1))
+                pos = eol + 1
+            self._tail = data[pos:]
+            self._tail_offset += pos
+            if self._eof or len(lines) >= self.batch_size:
+                break
+            block = self.fp_input.read(self.block_size)
+            if block:
+                self._tail += block
+                continue
+            self._eof = True
+            # last line without newline
+            if self._tail.strip():
+                lines.append((self._tail, self._tail_offset + len(self._tail)))
+            self._tail_offset += len(self._tail)
+            self._tail = b""
+        return lines
+
+    def _fill(self):
+        """submit batches of lines to the parsers"""
+        while not self._eof and len(self._batches) < self.max_pending:
+            lines = self._scan()
+            if not lines:
+                break
+            result = self._pool.apply_async(
+                _smiles_parse_lines,
+                ([l[0] for l in lines], self.sanitize, self.is_enamine_cxsmiles),
+            )
+            self._batches.append((lines, result))
+
+    def __next__(self):
+        """iterator step"""
+        while not self._ready:
+            self._fill()
+            if not self._batches:
+                self._close_fp()
+                raise StopIteration
+            lines, result = self._batches.popleft()
+            self._ready.extend(zip(result.get(), lines))
+        data, (line, end_offset) = self._ready.popleft()
+        self._next_offset = end_offset
+        if data is None:
+            self._manage_problematic(line.decode("utf-8", errors="replace"))
+            return None
+        return Chem.Mol(data)
 
 
 class MoleculeIssueStorage(ScrubberBase, multiprocessing.Process):
@@ -777,113 +1831,3 @@ class MoleculeIssueStorage(ScrubberBase, multiprocessing.Process):
 # TODO: implement a SQLite tmp-file to store all molecules seen so far?
 # - remove duplicates
 # - prevent file names collisions and overwriting
-
-
-class PipeMolSupplier(threading.Thread):
-    """Threded pipe reader
-    https://www.askpython.com/python/oops/threading-with-classes
-
-    """
-
-    PICKLE_HEADER = pickle.dumps(None)[0]
-
-    def __init__(self, max_proc=None):
-        threading.Thread.__init__(self)
-        if max_proc is None:
-            max_proc = multiprocessing.cpu_count()
-        self.buffer = queue.Queue(maxsize=max_proc)
-        self._stop = False
-        # start the thread
-        # self.start()
-
-    def run(self):
-        unread_bytes = sys.stdin.buffer.read()
-        while len(unread_bytes):
-            unread_buffer = BytesIO(unread_bytes)
-            header_byte = unread_buffer.getbuffer()[0]
-            if header_byte == PipeMolSupplier.PICKLE_HEADER:
-                # try:
-                io = pickle.load(unread_buffer)
-                # if not isinstance(io, str ):
-                #     break
-                self.buffer.put(io)
-                # print(">>>SENDING THIS:", io)
-            # except pickle.UnpicklingError:
-            #     print("FATAL ERROR UNPICKLING THIS MOLECULE!")
-            # sys.exit(1)
-            else:
-                # just passing through...
-                print("UNREADEX", unread_bytes.decode())
-                unread_bytes = unread_buffer.read()
-                # break
-            unread_bytes = unread_buffer.read()
-        print("DONE reading...")
-        # raise StopIteration
-
-    def __next__(self):
-        """overloading this function"""
-        # print("> called get buffer")
-        print("LEN QUEUE", self.buffer.qsize())
-        out = self.buffer.get()
-        if out == "terminate":
-            raise StopIteration
-        else:
-            return self.buffer.get()
-
-
-class PipeMolSupplier2:
-    """ """
-
-    PICKLE_HEADER = pickle.dumps(None)[0]
-
-    def __init__(self, sanitize=True, removeHs=False, cleanupSubstructure=True):
-        self._opts = {
-            "sanitize": sanitize,
-            "removeHs": removeHs,
-            "cleanupSubstructures": cleanupSubstructure,
-        }
-        self._counter = 0
-
-    def __iter__(self):
-        """standard iterator definition"""
-        return self
-
-    def __next__(self):
-        """iterator reader"""
-        print("CALLED NEXT", self._counter)
-        while True:
-            unread_bytes = sys.stdin.buffer.read()
-            self._counter += 1
-            # if self._counter == 6:
-            #     print("*************  TOO MANY")
-            #     raise StopIteration
-            # while unread_bytes:
-            print("ITERATING...")
-            # self._counter += 1
-            if not len(unread_bytes):
-                print("DONE READONG", self._counter)
-                raise StopIteration
-            unread_buffer = BytesIO(unread_bytes)
-            header_byte = unread_buffer.getbuffer()[0]
-            if header_byte == PipeMolSupplier.PICKLE_HEADER:
-                try:
-                    mol = pickle.load(unread_buffer)
-                    # print("THIS IS PICKLED!", io)
-                    # unread_bytes = sys.stdin.buffer.read()
-                    print("returning mol to the queue", mol)
-                    return mol
-
-                    # return mol
-                except pickle.UnpicklingError:
-                    print("ERROR UNPICKLING THIS MOLECULE!", self._counter)
-            else:
-                # just passing through...
-                # unread_bytes = sys.stdin.buffer.read()
-                print(q)
-                # print(">>PRINT", unread_bytes.decode())
-                return unread_bytes.decode()
-
-
-if __name__ == "__main__":
-    pr = PipeReader(None)
-    pr.start()
@@ -6,6 +6,7 @@ from rdkit import Chem #, AtomValenceException, KekulizeException
 from rdkit.Chem.PropertyMol import PropertyMol
 
 from ..common import UniqueMoleculeContainer, mol2smi, copy_mol_properties
+from ..patterns import get_reaction
 
 
 class MolecularReactionsLogger(object):
@@ -364,7 +365,7 @@ class MoleculeTransformations(object):
         rxn_right, tag = rxn_right.split(None, 1)
         tag = tag.strip()
         rxn_string = "%s >> %s" % (rxn_left, rxn_right)
-        rxn_obj = Chem.AllChem.ReactionFromSmarts(rxn_string)
+        rxn_obj = get_reaction(rxn_string)
         return rxn_obj, rxn_left, rxn_right, tag
 
 
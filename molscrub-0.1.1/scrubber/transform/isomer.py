@@ -1,7 +1,6 @@
 from operator import itemgetter
 
 from rdkit import Chem, RDLogger
-from rdkit.Chem import AllChem
 from rdkit.Chem.EnumerateStereoisomers import (
     EnumerateStereoisomers,
     StereoEnumerationOptions,
@@ -9,6 +8,7 @@ from rdkit.Chem.EnumerateStereoisomers import (
 )
 
 from ..common import ScrubberBase, UniqueMoleculeContainer, mol2smi
+from ..patterns import get_smarts
 
 from .base import MoleculeTransformations
 from .base import MaxResultsException
@@ -465,17 +465,13 @@ class MoleculeIsomers(ScrubberBase, MoleculeTransformations):
     def __count_amides(self, mol):
         """count the number of amides in a molecule"""
         # does NOT match 2-Pyridone (intentionally)
-        pattern = Chem.MolFromSmarts("[OX1,SX1]=[CX3][NX3]")
-        return len(mol.GetSubstructMatches(pattern))
+        return len(mol.GetSubstructMatches(get_smarts("amide")))
 
     def _neutralize_atoms(self, mol):
         """Neutralie charged molecules by atom
         source: http://www.rdkit.org/docs/Cookbook.html#neutralizing-molecules
         """
-        pattern = Chem.MolFromSmarts(
-            "[+1!h0!$([*]~[-1,-2,-3,-4]),-1!$([*]~[+1,+2,+3,+4])]"
-        )
-        at_matches = mol.GetSubstructMatches(pattern)
+        at_matches = mol.GetSubstructMatches(get_smarts("neutralize"))
         at_matches_list = [y[0] for y in at_matches]
         if len(at_matches_list) > 0:
             for at_idx in at_matches_list:
@@ -668,6 +664,6 @@ def enumerate_tautomers(
     )
     if verbose:
         print("%d tautomers generated" % len(results))
-    check_property_violation(results, Chem.MolFromSmarts("[a]"))
-    check_property_violation(results, Chem.MolFromSmarts("[OX1,SX1]=[CX3][NX3]"))
+    check_property_violation(results, get_smarts("aromatic"))
+    check_property_violation(results, get_smarts("amide"))
     return results
@@ -30,6 +30,7 @@ setup(
     packages=find_packages(),
     scripts=[
         "scripts/scrub.py",
+        "scripts/index_input.py",
     ],
     package_data={"scrubber": ["data/*"]},
     data_files=[("", ["README.md", "LICENSE"]), ("scripts", find_files("scripts"))],
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+Chem = pytest.importorskip("rdkit.Chem")
+
+from scrubber.archive import ArchiveMolSupplier
+from scrubber.archive import ArchiveWriter
+from scrubber.archive import is_archive
+from scrubber.archive import read_manifest
+from scrubber.archive import split_archive
+
+LIGANDS = [("lig_a", "CCO"), ("lig_b", "c1ccccc1"), ("lig_a", "CCN"), ("lig c", "CC(=O)O"), ("lig_d", "C")]
+
+
+def write_archives(basename, ext):
+    fname = "%s.smi%s" % (basename, ext)
+    with ArchiveWriter(fname, max_members=2) as writer:
+        for name, smiles in LIGANDS:
+            writer.add(name, ("%s %s\n" % (smiles, name)).encode())
+    return basename + ".manifest.tsv"
+
+
+def test_split_archive():
+    assert split_archive("out/ligands.sdf.tar") == ("out/ligands.sdf", "tar")
+    assert split_archive("ligands.sdf.tgz") == ("ligands.sdf", "tar.gz")
+    assert split_archive("ligands.smi.zip") == ("ligands.smi", "zip")
+    assert split_archive("ligands.sdf") == ("ligands.sdf", None)
+    assert is_archive("ligands.manifest.tsv")
+    assert not is_archive("ligands.sdf.gz")
+    with pytest.raises(ValueError):
+        ArchiveWriter("ligands.sdf")
+    with pytest.raises(ValueError):
+        ArchiveWriter("ligands.pdb.tar")
+
+
+@pytest.mark.parametrize("ext", [".tar", ".tar.gz", ".zip"])
+def test_manifest(tmp_path, ext):
+    basename = str(tmp_path / "out" / "ligands")
+    manifest = write_archives(basename, ext)
+    entries = read_manifest(manifest)
+    # archives are rotated every 2 members, names of members are unique
+    archives = [os.path.join(str(tmp_path / "out"), "ligands_%05d%s" % (i, ext)) for i in range(3)]
+    assert entries == [
+        ("lig_a", archives[0], "lig_a.smi"),
+        ("lig_b", archives[0], "lig_b.smi"),
+        ("lig_a", archives[1], "lig_a_v1.smi"),
+        ("lig c", archives[1], "lig_c.smi"),
+        ("lig_d", archives[2], "lig_d.smi"),
+    ]
+    supplier = ArchiveMolSupplier(manifest)
+    assert supplier.archives == archives
+    assert [Chem.MolToSmiles(mol) for mol in supplier.get("lig_a")] == [
+        Chem.MolToSmiles(Chem.MolFromSmiles("CCO")),
+        Chem.MolToSmiles(Chem.MolFromSmiles("CCN")),
+    ]
+    assert [mol.GetProp("_Name") for mol in supplier.get("lig c")] == ["lig c"]
+    assert supplier.get("missing") == []
+    # all the archives, in order
+    assert [mol.GetProp("_Name") for mol in supplier] == [name for name, _ in LIGANDS]
+    assert supplier.tell() == len(LIGANDS)
+    supplier.close()
+
+
+def test_single_archive(tmp_path):
+    basename = str(tmp_path / "ligands")
+    write_archives(basename, ".tar")
+    supplier = ArchiveMolSupplier(basename + "_00001.tar")
+    assert [mol.GetProp("_Name") for mol in supplier] == ["lig_a", "lig c"]
+    with pytest.raises(ValueError):
+        supplier.get("lig_a")
+    supplier.close()
+
+
+def test_write_sdf(tmp_path):
+    fname = str(tmp_path / "ligands.sdf.tar")
+    mol = Chem.MolFromSmiles("CCO")
+    mol.SetProp("_Name", "ethanol")
+    mol.SetProp("score", "1.5")
+    with ArchiveWriter(fname) as writer:
+        archive_fname, member = writer.write(mol)
+    assert archive_fname == str(tmp_path / "ligands_00000.tar")
+    assert member == "ethanol.sdf"
+    mols = ArchiveMolSupplier(str(tmp_path / "ligands.manifest.tsv")).get("ethanol")
+    assert len(mols) == 1
+    assert mols[0].GetProp("score") == "1.5"
+    assert Chem.MolToSmiles(mols[0]) == Chem.MolToSmiles(mol)
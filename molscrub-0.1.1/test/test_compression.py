@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip("rdkit")
+
+from scrubber.compression import is_compressed
+from scrubber.compression import open_compressed
+from scrubber.compression import split_compression
+
+TEXT = "".join("C%s mol_%d\n" % ("C" * i, i) for i in range(1000))
+
+CODECS = [
+    ("gz", "gzip"),
+    ("bz2", "bz2"),
+    ("xz", "xz"),
+]
+
+
+def test_split_compression():
+    assert split_compression("library.sdf.gz") == ("library.sdf", "gzip")
+    assert split_compression("library.smi.ZST") == ("library.smi", "zstd")
+    assert split_compression("library.sdf") == ("library.sdf", None)
+    assert is_compressed("library.smi.xz")
+    assert not is_compressed("library.molbin")
+
+
+@pytest.mark.parametrize("ext, codec", CODECS)
+def test_text_round_trip(tmp_path, ext, codec):
+    fname = str(tmp_path / ("library.smi.%s" % ext))
+    with open_compressed(fname, "wt", level=1) as fp:
+        fp.write(TEXT)
+    with open(fname, "rb") as fp:
+        assert fp.read(len(TEXT)) != TEXT.encode()
+    with open_compressed(fname, "rt") as fp:
+        assert fp.readline() == "C mol_0\n"
+        assert fp.read() == TEXT[len("C mol_0\n") :]
+
+
+@pytest.mark.parametrize("ext, codec", CODECS)
+def test_binary_seek(tmp_path, ext, codec):
+    fname = str(tmp_path / "library.smi")
+    with open_compressed(fname + "." + ext, "wb") as fp:
+        fp.write(TEXT.encode())
+    # codec specified explicitly, not from the extension
+    with open_compressed(fname + "." + ext, "rb", codec=codec) as fp:
+        fp.seek(100)
+        assert fp.read(50) == TEXT.encode()[100:150]
+        assert fp.tell() == 150
+
+
+def test_uncompressed(tmp_path):
+    fname = str(tmp_path / "library.smi")
+    with open_compressed(fname, "w") as fp:
+        fp.write(TEXT)
+    with open(fname) as fp:
+        assert fp.read() == TEXT
+
+
+def test_zstd_round_trip(tmp_path):
+    pytest.importorskip("zstandard")
+    fname = str(tmp_path / "library.smi.zst")
+    with open_compressed(fname, "wt", threads=2) as fp:
+        fp.write(TEXT)
+    with open_compressed(fname, "rt") as fp:
+        assert fp.readline() == "C mol_0\n"
+        assert fp.read() == TEXT[len("C mol_0\n") :]
+
+
+def test_invalid_codec(tmp_path):
+    with pytest.raises(ValueError):
+        open_compressed(str(tmp_path / "library.smi"), "rt", codec="rar")
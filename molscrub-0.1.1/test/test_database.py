@@ -0,0 +1,102 @@
+import pytest
+
+Chem = pytest.importorskip("rdkit.Chem")
+
+from scrubber.database import DatabaseMolSupplier
+from scrubber.database import DatabaseMolWriter
+from scrubber.database import get_input_id
+from scrubber.database import INPUT_ID_PROP
+from scrubber.database import is_database
+from scrubber.database import MoleculeDatabase
+
+SMILES = [("CCO", "ethanol"), ("c1ccccc1", "benzene"), ("CC(=O)O", "acetic_acid")]
+
+
+def get_mols():
+    mols = []
+    for smiles, name in SMILES:
+        mol = Chem.MolFromSmiles(smiles)
+        mol.SetProp("_Name", name)
+        mols.append(mol)
+    # input that could not be parsed
+    mols.append(None)
+    return mols
+
+
+def get_isomer(input_mol, suffix):
+    isomer = Chem.Mol(input_mol)
+    isomer.SetProp("_Name", input_mol.GetProp("_Name") + suffix)
+    return isomer
+
+
+@pytest.fixture
+def campaign(tmp_path):
+    library = tmp_path / "library.smi"
+    library.write_text("".join("%s %s\n" % item for item in SMILES))
+    fname = str(tmp_path / "campaign.db")
+    db = MoleculeDatabase(fname, batch_size=2)
+    assert db.import_molecules(get_mols(), str(library)) == 4
+    return fname, str(library), db
+
+
+def test_import(campaign):
+    fname, library, db = campaign
+    assert is_database(fname)
+    assert db.counts() == {"pending": 3, "failed": 1}
+    # files already imported are skipped
+    assert db.import_molecules(get_mols(), library) == 0
+    assert [entry["name"] for entry in db.find(name="benzene")] == ["benzene"]
+    assert [entry["name"] for entry in db.find(smiles="OCC")] == ["ethanol"]
+    assert db.find(name="missing") == []
+    with pytest.raises(ValueError):
+        db.find()
+
+
+def test_resume(campaign):
+    fname, library, db = campaign
+    supplier = DatabaseMolSupplier(db)
+    writer = DatabaseMolWriter(db)
+    ethanol = next(supplier)
+    assert ethanol.GetProp("_Name") == "ethanol"
+    writer.write(get_isomer(ethanol, "_1"))
+    writer.write(get_isomer(ethanol, "_2"))
+    benzene = next(supplier)
+    writer.write_error(benzene, "embedding failed")
+    acetic_acid = next(supplier)
+    # batch of 2 inputs committed, the third is lost (interrupted run)
+    writer.write(get_isomer(acetic_acid, "_1"))
+    assert supplier.tell() == 3
+    db.close()
+
+    db = MoleculeDatabase(fname)
+    assert db.counts() == {"done": 1, "failed": 2, "pending": 1}
+    ethanol_id = get_input_id(ethanol)
+    isomers = db.get_isomers(ethanol_id)
+    assert [mol.GetProp("_Name") for mol in isomers] == ["ethanol_1", "ethanol_2"]
+    # the input id is not stored with the isomers
+    assert not isomers[0].HasProp(INPUT_ID_PROP)
+    assert db.get_errors(get_input_id(benzene)) == ["embedding failed"]
+    assert db.get_input(ethanol_id).GetProp("_Name") == "ethanol"
+    # only the pending inputs are processed when the campaign is resumed
+    assert [mol.GetProp("_Name") for mol in DatabaseMolSupplier(db)] == ["acetic_acid"]
+    # failed inputs are retried, except the ones that could not be parsed
+    assert db.reset_status() == 1
+    assert [mol.GetProp("_Name") for mol in DatabaseMolSupplier(db)] == ["benzene", "acetic_acid"]
+
+
+def test_write_tagged(campaign):
+    fname, library, db = campaign
+    ethanol, benzene, acetic_acid = DatabaseMolSupplier(db)
+    with DatabaseMolWriter(db, batch_size=1) as writer:
+        # results of different inputs are interleaved
+        writer.write_tagged((1, 0, 2), get_isomer(ethanol, "_1"))
+        writer.write_tagged((2, 0, 2), input_id=get_input_id(benzene), error="geom_fail_3d")
+        writer.write_tagged((3, 0, 2), get_isomer(acetic_acid, "_1"))
+        assert db.counts() == {"pending": 3, "failed": 1}
+        writer.write_tagged((1, 1, 2), input_id=get_input_id(ethanol), error="geom_timeout")
+        writer.write_tagged((2, 1, 2), input_id=get_input_id(benzene), error="geom_timeout")
+        assert db.counts() == {"done": 1, "failed": 2, "pending": 1}
+    # the results of acetic acid are incomplete, the input stays pending
+    assert db.counts() == {"done": 1, "failed": 2, "pending": 1}
+    assert [mol.GetProp("_Name") for mol in db.get_isomers(get_input_id(ethanol))] == ["ethanol_1"]
+    assert db.get_errors(get_input_id(benzene)) == ["geom_fail_3d, geom_timeout"]
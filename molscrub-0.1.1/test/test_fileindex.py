@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+pytest.importorskip("rdkit")
+
+from scrubber.fileindex import MoleculeFileIndex
+from scrubber.fileindex import build_index
+
+SMILES_LINES = ["CCO ethanol\n", "\n", "c1ccccc1 benzene\n", "CC(=O)O acetic_acid\n"]
+
+SDF_RECORD = """%s
+     RDKit          2D
+
+  1  0  0  0  0  0  0  0  0  0999 V2000
+    0.0000    0.0000    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0
+M  END
+$$$$
+"""
+
+
+def write_file(fname, lines):
+    with open(fname, "w") as fp:
+        fp.write("".join(lines))
+
+
+def line_offsets(lines):
+    offsets = []
+    offset = 0
+    for line in lines:
+        offsets.append(offset)
+        offset += len(line)
+    return offsets
+
+
+def test_smiles_offsets(tmp_path):
+    fname = str(tmp_path / "library.smi")
+    write_file(fname, SMILES_LINES)
+    index = MoleculeFileIndex.get(fname)
+    offsets = line_offsets(SMILES_LINES)
+    # empty lines are skipped
+    assert len(index) == 3
+    assert [index.offset(i) for i in range(3)] == [offsets[0], offsets[2], offsets[3]]
+    assert index.offset(3) == os.path.getsize(fname)
+    assert list(index.offsets()) == [offsets[0], offsets[2], offsets[3], os.path.getsize(fname)]
+    with pytest.raises(IndexError):
+        index.offset(4)
+    with open(fname) as fp:
+        fp.seek(index.offset(1))
+        assert fp.readline() == "c1ccccc1 benzene\n"
+    index.close()
+
+
+def test_title_line(tmp_path):
+    fname = str(tmp_path / "library.cxsmiles")
+    lines = ["smiles\tid\n"] + SMILES_LINES
+    write_file(fname, lines)
+    index = MoleculeFileIndex.get(fname, titleLine=True)
+    assert len(index) == 3
+    assert index.offset(0) == len(lines[0])
+    index.close()
+    # the index built with a different title line option is not reused
+    index = MoleculeFileIndex.get(fname, titleLine=False)
+    assert len(index) == 4
+    assert index.offset(0) == 0
+    index.close()
+
+
+def test_sdf_offsets(tmp_path):
+    fname = str(tmp_path / "library.sdf")
+    records = [SDF_RECORD % name for name in ("mol_1", "mol_2", "mol_3")]
+    # last record without "$$$$" terminator
+    records[-1] = records[-1].replace("$$$$\n", "")
+    write_file(fname, records)
+    index_fname = build_index(fname)
+    assert index_fname == fname + ".idx"
+    index = MoleculeFileIndex(index_fname)
+    assert [index.offset(i) for i in range(3)] == line_offsets(records)
+    with open(fname) as fp:
+        fp.seek(index.offset(2))
+        assert fp.readline() == "mol_3\n"
+    index.close()
+
+
+def test_shards(tmp_path):
+    fname = str(tmp_path / "library.smi")
+    lines = ["C%s mol_%d\n" % ("C" * i, i) for i in range(10)]
+    write_file(fname, lines)
+    index = MoleculeFileIndex.get(fname)
+    shards = index.shards(3)
+    assert [(s["start_count"], s["end_count"]) for s in shards] == [(1, 4), (5, 7), (8, 10)]
+    offsets = line_offsets(lines)
+    assert shards[0]["start_offset"] == 0
+    assert shards[1]["start_offset"] == offsets[4]
+    assert shards[1]["end_offset"] == shards[2]["start_offset"]
+    assert shards[2]["end_offset"] == os.path.getsize(fname)
+    index.close()
+
+
+def test_out_of_date(tmp_path):
+    fname = str(tmp_path / "library.smi")
+    write_file(fname, SMILES_LINES)
+    MoleculeFileIndex.get(fname).close()
+    # same size, different content and modification time
+    write_file(fname, [line.replace("CCO", "OCC") for line in SMILES_LINES])
+    stat = os.stat(fname)
+    os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with pytest.raises(ValueError):
+        MoleculeFileIndex.get(fname, rebuild=False)
+    index = MoleculeFileIndex.get(fname)
+    assert index.is_current(fname)
+    index.close()
+    with pytest.raises(FileNotFoundError):
+        MoleculeFileIndex.get(str(tmp_path / "missing.smi"), rebuild=False)
+    with pytest.raises(ValueError):
+        MoleculeFileIndex.get(str(tmp_path / "library.smi.gz"))
@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip("h5py")
+np = pytest.importorskip("numpy")
+Chem = pytest.importorskip("rdkit.Chem")
+
+from rdkit.Chem import AllChem
+
+from scrubber.hdf5store import HDF5MolReader
+from scrubber.hdf5store import HDF5MolWriter
+
+SMILES = ["CCO", "C[C@H](N)C(=O)[O-]", "C/C=C/Cl", "c1ccncc1", "[NH4+]"]
+
+
+def get_mols():
+    mols = []
+    for i, smiles in enumerate(SMILES):
+        mol = Chem.AddHs(Chem.MolFromSmiles(smiles))
+        AllChem.EmbedMultipleConfs(mol, i % 2 + 1, randomSeed=42)
+        mol.SetProp("_Name", "mol_%d" % i)
+        mol.SetIntProp("index", i)
+        mol.SetDoubleProp("score", i / 2.0)
+        mol.SetProp("source", "test")
+        mols.append(mol)
+    return mols
+
+
+@pytest.fixture
+def store(tmp_path):
+    fname = str(tmp_path / "mols.hdf5")
+    mols = get_mols()
+    # several chunks, the last one incomplete
+    with HDF5MolWriter(fname, header={"ph": 7.4}, chunk_size=2) as writer:
+        for i, mol in enumerate(mols):
+            writer.write(mol, group_id=i // 2, isomer_id=i % 2)
+        assert len(writer) == len(mols)
+    return fname, mols
+
+
+def test_read_mols(store):
+    fname, mols = store
+    reader = HDF5MolReader(fname, block_size=2)
+    assert reader.header == {"ph": 7.4}
+    assert len(reader) == len(mols)
+    assert reader.names == ["mol_%d" % i for i in range(len(mols))]
+    for mol, read_mol in zip(mols, reader.read_mols(0, len(mols))):
+        assert Chem.MolToSmiles(read_mol) == Chem.MolToSmiles(mol)
+        assert read_mol.GetProp("_Name") == mol.GetProp("_Name")
+        assert read_mol.GetIntProp("index") == mol.GetIntProp("index")
+        assert read_mol.GetDoubleProp("score") == mol.GetDoubleProp("score")
+        assert read_mol.GetProp("source") == "test"
+        assert read_mol.GetNumConformers() == mol.GetNumConformers()
+        for conf, read_conf in zip(mol.GetConformers(), read_mol.GetConformers()):
+            assert np.allclose(read_conf.GetPositions(), conf.GetPositions(), atol=1e-4)
+    # slices of molecules that span the chunks
+    assert [mol.GetProp("_Name") for mol in reader.read_mols(1, 4)] == ["mol_1", "mol_2", "mol_3"]
+    assert reader.read_mols(3, 100)[-1].GetProp("_Name") == "mol_4"
+    assert reader.read_mols(5, 6) == []
+    reader.close()
+
+
+def test_table_and_coordinates(store):
+    fname, mols = store
+    reader = HDF5MolReader(fname)
+    table = reader.read_table(1, 3)
+    assert table["name"] == ["mol_1", "mol_2"]
+    assert list(table["group_id"]) == [0, 1]
+    assert list(table["isomer_id"]) == [1, 0]
+    assert list(table["num_atoms"]) == [mols[1].GetNumAtoms(), mols[2].GetNumAtoms()]
+    coords = reader.coordinates(1)
+    assert coords.shape == (2, mols[1].GetNumAtoms(), 3)
+    assert np.allclose(coords[1], mols[1].GetConformer(1).GetPositions(), atol=1e-4)
+    reader.close()
+
+
+def test_supplier(store):
+    fname, mols = store
+    reader = HDF5MolReader(fname, block_size=2)
+    assert [mol.GetProp("_Name") for mol in reader] == reader.names
+    reader.seek(3)
+    assert reader.tell() == 3
+    assert [mol.GetProp("_Name") for mol in reader] == ["mol_3", "mol_4"]
+    assert reader[-1].GetProp("_Name") == "mol_4"
+    assert [mol.GetProp("_Name") for mol in reader[0:5:2]] == ["mol_0", "mol_2", "mol_4"]
+    with pytest.raises(IndexError):
+        reader[len(mols)]
+    reader.close()
@@ -0,0 +1,70 @@
+import pytest
+
+Chem = pytest.importorskip("rdkit.Chem")
+
+from scrubber.molbin import MolbinReader
+from scrubber.molbin import MolbinWriter
+
+
+def get_mols():
+    mols = []
+    for i, smiles in enumerate(["CCO", "c1ccccc1", "CC(=O)O", "CCO"]):
+        mol = Chem.MolFromSmiles(smiles)
+        mol.SetProp("_Name", "mol_%d" % (i % 3))
+        mol.SetProp("source", "test")
+        mols.append(mol)
+    return mols
+
+
+def test_write_read(tmp_path):
+    fname = str(tmp_path / "mols.molbin")
+    mols = get_mols()
+    with MolbinWriter(fname, header={"ph": 7.4}) as writer:
+        for mol in mols:
+            writer.write(mol)
+    reader = MolbinReader(fname)
+    assert reader.header == {"ph": 7.4}
+    assert len(reader) == len(mols)
+    assert [Chem.MolToSmiles(mol) for mol in reader] == [Chem.MolToSmiles(mol) for mol in mols]
+    assert reader[1].GetProp("source") == "test"
+    assert reader[-1].GetProp("_Name") == "mol_0"
+    assert reader.index_of("mol_0") == [0, 3]
+    assert [Chem.MolToSmiles(mol) for mol in reader.get("mol_2")] == ["CC(=O)O"]
+    with pytest.raises(IndexError):
+        reader[len(mols)]
+    reader.close()
+
+
+def test_seek(tmp_path):
+    fname = str(tmp_path / "mols.molbin")
+    with MolbinWriter(fname) as writer:
+        for mol in get_mols():
+            writer.write(mol)
+    reader = MolbinReader(fname)
+    next(reader)
+    offset = reader.tell()
+    assert offset == reader.offset(1)
+    names = [mol.GetProp("_Name") for mol in reader]
+    reader.seek(offset)
+    assert [mol.GetProp("_Name") for mol in reader] == names
+    resumed = MolbinReader(fname, start_offset=offset)
+    assert [mol.GetProp("_Name") for mol in resumed] == names
+
+
+def test_truncated(tmp_path):
+    fname = str(tmp_path / "mols.molbin")
+    mols = get_mols()
+    with MolbinWriter(fname) as writer:
+        for mol in mols:
+            writer.write(mol)
+        data_end = writer.tell()
+    with open(fname, "rb") as fp:
+        data = fp.read()
+    # interrupted run: no index and trailer, the last record is incomplete
+    truncated = str(tmp_path / "truncated.molbin")
+    with open(truncated, "wb") as fp:
+        fp.write(data[: data_end - 5])
+    reader = MolbinReader(truncated)
+    assert len(reader) == len(mols) - 1
+    assert [mol.GetProp("_Name") for mol in reader] == ["mol_0", "mol_1", "mol_2"]
+    assert reader.index_of("mol_0") == [0]
@@ -0,0 +1,102 @@
+import io
+import json
+
+import pytest
+
+Chem = pytest.importorskip("rdkit.Chem")
+
+from scrubber.pipe import FRAME_END
+from scrubber.pipe import PIPE_FRAME
+from scrubber.pipe import PipeMolSupplier
+from scrubber.pipe import PipeMolWriter
+
+
+class Buffer(io.BytesIO):
+    """keep the content after the writer closes the stream"""
+
+    def close(self):
+        self.data = self.getvalue()
+        super().close()
+
+
+def get_mols(count=3):
+    mols = []
+    for i in range(count):
+        mol = Chem.MolFromSmiles("C" * (i + 1))
+        mol.SetProp("_Name", "mol_%d" % i)
+        mols.append(mol)
+    return mols
+
+
+def write_stream(mols, aborted=False, **kwargs):
+    fp = Buffer()
+    writer = PipeMolWriter(fp, **kwargs)
+    for mol in mols:
+        writer.write(mol)
+    writer.close(aborted=aborted)
+    return fp.data
+
+
+def read_names(data):
+    return [mol.GetProp("_Name") for mol in PipeMolSupplier(io.BytesIO(data))]
+
+
+def test_round_trip():
+    data = write_stream(get_mols(), header={"ph": 7.4}, flush_every=2)
+    supplier = PipeMolSupplier(io.BytesIO(data))
+    mols = list(supplier)
+    assert [mol.GetProp("_Name") for mol in mols] == ["mol_0", "mol_1", "mol_2"]
+    assert Chem.MolToSmiles(mols[2]) == "CCC"
+    assert supplier.header == {"ph": 7.4}
+    assert supplier.tell() == 3
+
+
+def test_empty_stream():
+    assert read_names(write_stream([])) == []
+    with pytest.raises(EOFError):
+        read_names(b"")
+    with pytest.raises(ValueError):
+        read_names(b"NOTASTREAM" * 2)
+
+
+def test_truncated():
+    data = write_stream(get_mols())
+    end_frame = PIPE_FRAME.size + len(json.dumps({"count": 3}))
+    # missing end frame (e.g. the upstream process was killed)
+    with pytest.raises(EOFError):
+        read_names(data[:-end_frame])
+    # incomplete molecule frame
+    with pytest.raises(EOFError):
+        read_names(data[: -end_frame - 5])
+
+
+def test_aborted():
+    # the end frame is not written if the writer is aborted
+    with pytest.raises(EOFError):
+        read_names(write_stream(get_mols(), aborted=True))
+    fp = Buffer()
+    with pytest.raises(RuntimeError):
+        with PipeMolWriter(fp) as writer:
+            writer.write(get_mols(1)[0])
+            raise RuntimeError("failed")
+    with pytest.raises(EOFError):
+        read_names(fp.data)
+
+
+def test_count_mismatch():
+    data = write_stream(get_mols())
+    # a molecule frame is missing (e.g. dropped by a faulty relay)
+    end_frame = PIPE_FRAME.size + len(json.dumps({"count": 3}))
+    payload = json.dumps({"count": 4}).encode()
+    data = data[:-end_frame] + PIPE_FRAME.pack(FRAME_END, len(payload)) + payload
+    with pytest.raises(EOFError):
+        read_names(data)
+
+
+def test_unknown_frames():
+    data = write_stream(get_mols())
+    # frames of types unknown to this version are skipped
+    end_frame = PIPE_FRAME.size + len(json.dumps({"count": 3}))
+    extra = PIPE_FRAME.pack(b"X", 3) + b"abc"
+    data = data[:-end_frame] + extra + data[-end_frame:]
+    assert read_names(data) == ["mol_0", "mol_1", "mol_2"]
@@ -0,0 +1,86 @@
+import os
+import queue
+
+import pytest
+
+Chem = pytest.importorskip("rdkit.Chem")
+
+from scrubber.storage import get_shard_fname
+from scrubber.storage import merge_shards
+from scrubber.storage import ReorderBuffer
+from scrubber.storage import ShardedQueue
+
+
+def get_mol(name=None, seq=None):
+    mol = Chem.MolFromSmiles("CCO")
+    if not name is None:
+        mol.SetProp("_Name", name)
+    if not seq is None:
+        ReorderBuffer.tag_mol(mol, seq)
+    return mol
+
+
+def test_shard_fname():
+    assert get_shard_fname("out/output.sdf.gz", 3) == "out/output_003.sdf.gz"
+    assert get_shard_fname("ligands.sdf.tar", 12) == "ligands_012.sdf.tar"
+    assert get_shard_fname("output.molbin", 0) == "output_000.molbin"
+    assert get_shard_fname("out/mol.sdf", 1, mode="split") == os.path.join("out", "shard_001", "mol.sdf")
+    # the shards share the database
+    assert get_shard_fname("campaign.db", 2) == "campaign.db"
+
+
+def test_tagged():
+    shards = ShardedQueue([queue.Queue() for _ in range(4)])
+    assert len(shards) == 4
+    # the sequence number of the input decides, not the name
+    assert [shards.get_shard(get_mol("same", seq)) for seq in range(6)] == [0, 1, 2, 3, 0, 1]
+    # all the isomers of an input go to the same shard
+    isomer = get_mol("isomer")
+    ReorderBuffer.tag_mol(isomer, 5, idx=1, total=2)
+    assert shards.get_shard(isomer) == 1
+    assert shards.get_shard({"mol": isomer, "report": "ok"}) == 1
+    # tombstones of discarded inputs follow the same route
+    assert shards.get_shard(ReorderBuffer.tombstone(get_mol("lost", 7))) == 3
+
+
+def test_untagged():
+    shards = ShardedQueue([queue.Queue() for _ in range(4)])
+    # same name, same shard
+    shard = shards.get_shard(get_mol("ethanol"))
+    assert all(shards.get_shard(get_mol("ethanol")) == shard for _ in range(5))
+    # molecules without name are assigned in turn
+    assert len(set(shards.get_shard(get_mol()) for _ in range(4))) == 4
+    assert len(set(shards.get_shard(get_mol("")) for _ in range(4))) == 4
+
+
+def test_put():
+    queues = [queue.Queue() for _ in range(3)]
+    shards = ShardedQueue(queues)
+    for seq in range(5):
+        shards.put(get_mol("mol_%d" % seq, seq))
+    # one poison pill for each shard
+    shards.put(None)
+    for shard, shard_queue in enumerate(queues):
+        packages = []
+        while not shard_queue.empty():
+            packages.append(shard_queue.get())
+        assert packages[-1] is None
+        assert [mol.GetProp("_Name") for mol in packages[:-1]] == [
+            "mol_%d" % seq for seq in range(5) if seq % 3 == shard
+        ]
+
+
+def test_merge(tmp_path):
+    fname = str(tmp_path / "output.smi")
+    fnames = []
+    for shard in range(3):
+        fnames.append(get_shard_fname(fname, shard))
+        with open(fnames[-1], "w") as fp:
+            fp.write("SMILES Name\nC%s mol_%d\n" % ("C" * shard, shard))
+    # the header is written once
+    merge_shards(fnames, fname, header=True)
+    with open(fname) as fp:
+        assert fp.read() == "SMILES Name\nC mol_0\nCC mol_1\nCCC mol_2\n"
+    assert not any(os.path.exists(shard_fname) for shard_fname in fnames)
+    with pytest.raises(ValueError):
+        merge_shards(fnames, fname, mode="split")